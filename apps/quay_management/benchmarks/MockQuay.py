@@ -0,0 +1,395 @@
+import base64
+import hashlib
+import http.server
+import json
+import re
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlsplit
+
+
+class MockQuay:
+    # Media types used for the seeded images
+    manifest_media_type = "application/vnd.oci.image.manifest.v1+json"
+    config_media_type = "application/vnd.oci.image.config.v1+json"
+    layer_media_type = "application/vnd.oci.image.layer.v1.tar+gzip"
+
+    def __init__(self, api_token: str = "benchmark-token", username: str = "quayadmin", password: str = "password",
+                 page_size: int = 50, api_latency: float = 0, registry_latency: float = 0) -> None:
+        """
+        Description:
+            An in-memory stand in for a Quay server. A single HTTP listener on 127.0.0.1 serves both the
+            parts of the Quay REST API (/api/v1) that QuayAPI uses and an OCI distribution registry (/v2)
+            with bearer token auth, cross repository mounts and monolithic uploads. Every request is counted
+            so a benchmark can report how many calls the sync made
+        Args:
+            api_token (str, optional): The bearer token the API accepts. Defaults to "benchmark-token".
+            username (str, optional): The registry username. Defaults to "quayadmin".
+            password (str, optional): The registry password. Defaults to "password".
+            page_size (int, optional): How many repositories or tags are returned per page. Defaults to 50.
+            api_latency (float, optional): Seconds added to every API response to mimic a real server. Defaults to 0.
+            registry_latency (float, optional): Seconds added to every registry response. Defaults to 0.
+        """
+        self.api_token = api_token
+        self.credentials = (username, password)
+        self.registry_token = uuid.uuid4().hex
+        self.page_size = page_size
+        self.api_latency = api_latency
+        self.registry_latency = registry_latency
+        # {<org>: {<repo>: {<tag>: <manifest digest>}}}
+        self.orgs = {}
+        self.blobs = {}
+        self.blob_links = set()
+        self.manifests = {}
+        # Audit log entries, oldest first
+        self.logs = []
+        # (<API path>, <page number>) answered with a 500, to test listings that fail partway
+        self.failing_pages = set()
+        self.lock = threading.Lock()
+        self.stats = {"api_calls": 0, "registry_calls": 0, "token_calls": 0, "blobs_uploaded": 0,
+                      "bytes_uploaded": 0, "bytes_downloaded": 0, "manifests_pushed": 0}
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.request_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self) -> "MockQuay":
+        """
+        Description:
+            Starts serving requests on a background thread
+        Returns:
+            MockQuay: This instance so it can be chained
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f"mock-quay-{self.url}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Description:
+            Stops the server and closes the listening socket
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key: str, amount: int = 1) -> None:
+        """
+        Description:
+            Adds to one of the request counters
+        Args:
+            key (str): The counter in self.stats
+            amount (int, optional): How much to add. Defaults to 1.
+        """
+        with self.lock:
+            self.stats[key] += amount
+
+    def reset_stats(self) -> None:
+        """
+        Description:
+            Sets every request counter back to 0, for example between two benchmark passes
+        """
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def image_count(self) -> int:
+        """
+        Description:
+            Counts the tags across every repository
+        Returns:
+            int: The number of tagged images on this server
+        """
+        with self.lock:
+            return sum(len(tags) for repos in self.orgs.values() for tags in repos.values())
+
+    def tag_digests(self) -> dict:
+        """
+        Description:
+            Lists every tag with the digest of its manifest, used to check a mirror is complete
+        Returns:
+            dict: {"<org>/<repo>:<tag>": <manifest digest>}
+        """
+        with self.lock:
+            return {f"{org}/{repo}:{tag}": digest for org, repos in self.orgs.items()
+                    for repo, tags in repos.items() for tag, digest in tags.items()}
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """
+        Description:
+            Works out the sha256 content digest of a blob or manifest
+        Args:
+            data (bytes): The content
+        Returns:
+            str: sha256:<hex>
+        """
+        return "sha256:" + hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def layer_bytes(seed: str, size: int) -> bytes:
+        """
+        Description:
+            Builds a layer of the requested size. The content is unique per seed but cheap to generate,
+            so large data sets can be created without waiting on a random number generator
+        Args:
+            seed (str): Makes the layer (and its digest) unique
+            size (int): The size of the layer in bytes
+        Returns:
+            bytes: The layer content
+        """
+        block = hashlib.sha256(seed.encode()).digest()
+        return (block * (size // len(block) + 1))[:size]
+
+    def add_blob(self, repository: str, data: bytes) -> dict:
+        """
+        Description:
+            Stores a blob and links it into a repository. The caller must hold self.lock
+        Args:
+            repository (str): <org>/<repo>
+            data (bytes): The blob content
+        Returns:
+            dict: The descriptor (digest and size) to reference the blob from a manifest
+        """
+        blob_digest = self.digest(data)
+        self.blobs[blob_digest] = data
+        self.blob_links.add((repository, blob_digest))
+        return {"digest": blob_digest, "size": len(data)}
+
+    def add_image(self, org: str, repo: str, tag: str, layers: list) -> str:
+        """
+        Description:
+            Pushes an image straight into the server's storage without going through HTTP
+        Args:
+            org (str): The organization, created if it does not exist
+            repo (str): The repository, created if it does not exist
+            tag (str): The tag
+            layers (list): The content of each layer as bytes
+        Returns:
+            str: The manifest digest
+        """
+        repository = f"{org}/{repo}"
+        with self.lock:
+            layer_descriptors = [dict(self.add_blob(repository, layer), mediaType=self.layer_media_type) for layer in layers]
+            config = json.dumps({"architecture": "amd64", "os": "linux", "repository": repository, "tag": tag}).encode()
+            config_descriptor = dict(self.add_blob(repository, config), mediaType=self.config_media_type)
+            manifest = json.dumps({"schemaVersion": 2, "mediaType": self.manifest_media_type,
+                                   "config": config_descriptor, "layers": layer_descriptors}).encode()
+            manifest_digest = self.digest(manifest)
+            self.manifests[manifest_digest] = (manifest, self.manifest_media_type)
+            self.orgs.setdefault(org, {}).setdefault(repo, {})[tag] = manifest_digest
+            self.logs.append({"kind": "push_repo", "datetime": formatdate(time.time()), "namespace": {"name": org},
+                              "metadata": {"namespace": org, "repo": repo, "tag": tag}})
+        return manifest_digest
+
+    def seed(self, orgs: int = 5, repos_per_org: int = 4, tags_per_repo: int = 3, layers_per_image: int = 3,
+             layer_size: int = 256 * 1024, shared_layers: int = 1) -> dict:
+        """
+        Description:
+            Fills the server with generated organizations, repositories and tags. The first shared_layers
+            layers of every image are the same base layers, like images built FROM a common base,
+            the rest are unique to each image
+        Args:
+            orgs (int, optional): How many organizations to create. Defaults to 5.
+            repos_per_org (int, optional): How many repositories in each organization. Defaults to 4.
+            tags_per_repo (int, optional): How many tags in each repository. Defaults to 3.
+            layers_per_image (int, optional): How many layers in each image. Defaults to 3.
+            layer_size (int, optional): The size of each layer in bytes. Defaults to 256 KiB.
+            shared_layers (int, optional): How many of the layers are shared by every image. Defaults to 1.
+        Returns:
+            dict: {"images": <int>, "unique_bytes": <int>, "image_bytes": <int>}
+        """
+        shared_layers = min(shared_layers, layers_per_image)
+        base_layers = [self.layer_bytes(f"base-{number}", layer_size) for number in range(shared_layers)]
+        images = 0
+        for org_number in range(orgs):
+            org = f"org{org_number:04d}"
+            for repo_number in range(repos_per_org):
+                repo = f"repo{repo_number:04d}"
+                for tag_number in range(tags_per_repo):
+                    tag = f"v{tag_number}"
+                    unique_layers = [self.layer_bytes(f"{org}/{repo}:{tag}-{number}", layer_size)
+                                     for number in range(layers_per_image - shared_layers)]
+                    self.add_image(org, repo, tag, base_layers + unique_layers)
+                    images += 1
+        with self.lock:
+            unique_bytes = sum(len(blob) for blob in self.blobs.values())
+        return {"images": images, "unique_bytes": unique_bytes, "image_bytes": images * layers_per_image * layer_size}
+
+    def request_handler(self):
+        """
+        Description:
+            Builds the BaseHTTPRequestHandler class bound to this server's state
+        Returns:
+            type: The handler class for http.server
+        """
+        mock = self
+
+        class MockQuayHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (ConnectionResetError, BrokenPipeError):
+                    # The preflight probe reads the start of the status line and hangs up without reading the rest
+                    self.close_connection = True
+
+            def finish(self):
+                try:
+                    super().finish()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass
+
+            def reply(self, status: int, body=b"", headers: dict = None) -> None:
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                    headers = dict(headers or {}, **{"Content-Type": "application/json"})
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD" and body:
+                    self.wfile.write(body)
+
+            def read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = self.read_body()
+                if url.path.startswith("/api/v1/"):
+                    mock.count("api_calls")
+                    time.sleep(mock.api_latency)
+                    return self.api(url.path[len("/api/v1"):], query, body)
+                if url.path == "/v2/auth":
+                    mock.count("token_calls")
+                    return self.token()
+                if url.path.startswith("/v2/"):
+                    mock.count("registry_calls")
+                    time.sleep(mock.registry_latency)
+                    return self.registry(url.path[len("/v2/"):], query, body)
+                return self.reply(404)
+
+            do_GET = do_POST = do_PUT = do_HEAD = do_DELETE = do_PATCH = handle_request
+
+            def page(self, items: list, items_key: str, query: dict) -> None:
+                page_number = int(query.get("page", 1))
+                start = (page_number - 1) * mock.page_size
+                return self.reply(200, {items_key: items[start:start + mock.page_size], "page": page_number,
+                                        "has_additional": start + mock.page_size < len(items)})
+
+            def api(self, path: str, query: dict, body: bytes) -> None:
+                if self.headers.get("Authorization") != f"Bearer {mock.api_token}":
+                    return self.reply(401, {"error": "Invalid token"})
+                with mock.lock:
+                    if (path, int(query.get("page", 1))) in mock.failing_pages:
+                        return self.reply(500, {"error_message": "Internal Server Error"})
+                    if path == "/superuser/organizations/" and self.command == "GET":
+                        return self.reply(200, {"organizations": [{"name": org} for org in sorted(mock.orgs)]})
+                    if path == "/organization/" and self.command == "POST":
+                        name = json.loads(body or b"{}").get("name")
+                        if not name or name in mock.orgs:
+                            return self.reply(400, {"error_message": "A user or organization with this name already exists"})
+                        mock.orgs[name] = {}
+                        return self.reply(201, b"\"Created\"")
+                    match = re.fullmatch(r"/organization/([^/]+)", path)
+                    if match and self.command == "GET":
+                        if match.group(1) not in mock.orgs:
+                            return self.reply(404, {"error_message": "Not Found"})
+                        return self.reply(200, {"name": match.group(1)})
+                    if path == "/superuser/logs" and self.command == "GET":
+                        # Newest first, paged with an opaque next_page token like Quay
+                        start = int(query.get("next_page", 0))
+                        entries = mock.logs[::-1][start:start + mock.page_size]
+                        page = {"logs": entries}
+                        if start + mock.page_size < len(mock.logs):
+                            page["next_page"] = str(start + mock.page_size)
+                        return self.reply(200, page)
+                    if path == "/find/repositories" and self.command == "GET":
+                        repositories = [{"kind": "repository", "name": repo, "namespace": {"name": org}, "href": f"/repository/{org}/{repo}"}
+                                        for org in sorted(mock.orgs) for repo in sorted(mock.orgs[org])]
+                        return self.page(repositories, "results", query)
+                    if path == "/repository" and self.command == "GET":
+                        namespace = query.get("namespace")
+                        repositories = [{"kind": "image", "namespace": namespace, "name": repo} for repo in sorted(mock.orgs.get(namespace, {}))]
+                        return self.page(repositories, "repositories", query)
+                    match = re.fullmatch(r"/repository/([^/]+)/([^/]+)/tag/?", path)
+                    if match and self.command == "GET":
+                        tags = mock.orgs.get(match.group(1), {}).get(match.group(2))
+                        if tags is None:
+                            return self.reply(404, {"error_message": "Not Found"})
+                        return self.page([{"name": tag, "manifest_digest": digest} for tag, digest in sorted(tags.items())], "tags", query)
+                return self.reply(404, {"error_message": "Not Found"})
+
+            def token(self) -> None:
+                expected = "Basic " + base64.b64encode(":".join(mock.credentials).encode()).decode()
+                if self.headers.get("Authorization") != expected:
+                    return self.reply(401, {"errors": [{"code": "UNAUTHORIZED"}]})
+                return self.reply(200, {"token": mock.registry_token, "expires_in": 300})
+
+            def registry(self, path: str, query: dict, body: bytes) -> None:
+                if self.headers.get("Authorization") != f"Bearer {mock.registry_token}":
+                    realm = f'Bearer realm="{mock.url}/v2/auth",service="{mock.url.split("//")[1]}"'
+                    return self.reply(401, {"errors": [{"code": "UNAUTHORIZED"}]}, {"WWW-Authenticate": realm})
+                if path == "":
+                    return self.reply(200, {})
+                match = re.fullmatch(r"(.+?)/(manifests|blobs)/(.*)", path)
+                if not match:
+                    return self.reply(404)
+                repository, kind, reference = match.groups()
+                org, _, repo = repository.partition("/")
+                with mock.lock:
+                    if kind == "blobs" and reference.startswith("uploads"):
+                        return self.upload(repository, query, body)
+                    if kind == "blobs":
+                        if (repository, reference) not in mock.blob_links:
+                            return self.reply(404, {"errors": [{"code": "BLOB_UNKNOWN"}]})
+                        blob = mock.blobs[reference]
+                    elif self.command == "PUT":
+                        if org not in mock.orgs:
+                            return self.reply(404, {"errors": [{"code": "NAME_UNKNOWN"}]})
+                        manifest_digest = mock.digest(body)
+                        mock.manifests[manifest_digest] = (body, self.headers.get("Content-Type", mock.manifest_media_type))
+                        if not reference.startswith("sha256:"):
+                            mock.orgs[org].setdefault(repo, {})[reference] = manifest_digest
+                        mock.stats["manifests_pushed"] += 1
+                        return self.reply(201, b"", {"Docker-Content-Digest": manifest_digest, "Location": f"/v2/{repository}/manifests/{manifest_digest}"})
+                    else:
+                        manifest_digest = reference
+                        if not reference.startswith("sha256:"):
+                            manifest_digest = mock.orgs.get(org, {}).get(repo, {}).get(reference)
+                        if manifest_digest not in mock.manifests:
+                            return self.reply(404, {"errors": [{"code": "MANIFEST_UNKNOWN"}]})
+                        manifest, media_type = mock.manifests[manifest_digest]
+                        return self.reply(200, manifest, {"Content-Type": media_type, "Docker-Content-Digest": manifest_digest})
+                if self.command == "GET":
+                    mock.count("bytes_downloaded", len(blob))
+                return self.reply(200, blob, {"Docker-Content-Digest": reference, "Content-Type": "application/octet-stream"})
+
+            def upload(self, repository: str, query: dict, body: bytes) -> None:
+                # Called with mock.lock held
+                if self.command == "POST" and "mount" in query:
+                    if (query.get("from"), query["mount"]) in mock.blob_links:
+                        mock.blob_links.add((repository, query["mount"]))
+                        return self.reply(201, b"", {"Location": f"/v2/{repository}/blobs/{query['mount']}", "Docker-Content-Digest": query["mount"]})
+                if self.command == "POST" and "digest" not in query:
+                    return self.reply(202, b"", {"Location": f"/v2/{repository}/blobs/uploads/{uuid.uuid4()}", "Range": "0-0"})
+                if self.command in ("POST", "PUT") and "digest" in query:
+                    if mock.digest(body) != query["digest"]:
+                        return self.reply(400, {"errors": [{"code": "DIGEST_INVALID"}]})
+                    mock.blobs[query["digest"]] = body
+                    mock.blob_links.add((repository, query["digest"]))
+                    mock.stats["blobs_uploaded"] += 1
+                    mock.stats["bytes_uploaded"] += len(body)
+                    return self.reply(201, b"", {"Location": f"/v2/{repository}/blobs/{query['digest']}", "Docker-Content-Digest": query["digest"]})
+                return self.reply(405)
+
+        return MockQuayHandler
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+import argparse
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from MockQuay import MockQuay
+
+logging.basicConfig(level=logging.INFO)
+parser = argparse.ArgumentParser(description="Measures quay_sync.py throughput against a local mock Quay and registry")
+parser.add_argument("--api-latency", type=float, default=0, help="Seconds added to every Quay API response")
+parser.add_argument("--baseline", help="A JSON file written by --json-output. Exits 1 if this run is worse than the baseline by more than --tolerance")
+parser.add_argument("--extra-sync-args", default="", help="Extra flags passed to quay_sync.py, for example \"--api-rate 50\"")
+parser.add_argument("--incremental", action="store_true", help="Run the sync a second time with the same state file to measure a run where nothing changed")
+parser.add_argument("--json-output", help="Write the results to this file as JSON")
+parser.add_argument("--layer-size", type=int, default=256 * 1024, help="Size of each layer in bytes")
+parser.add_argument("--layers-per-image", type=int, default=3, help="How many layers each image has")
+parser.add_argument("--log-file", help="Keep the quay_sync.py output in this file. By default it is only shown when the sync fails")
+parser.add_argument("--max-workers", type=int, default=4, help="Passed to quay_sync.py --max-workers")
+parser.add_argument("--orgs", type=int, default=5, help="How many organizations are seeded on the primary")
+parser.add_argument("--page-size", type=int, default=50, help="How many repositories or tags the mock API returns per page")
+parser.add_argument("--registry-latency", type=float, default=0, help="Seconds added to every registry response")
+parser.add_argument("--repos-per-org", type=int, default=4, help="How many repositories are seeded in each organization")
+parser.add_argument("--secondaries", type=int, default=1, help="How many mock secondaries the sync mirrors to. More than 1 adds additional_secondaries to the config")
+parser.add_argument("--shared-layers", type=int, default=1, help="How many layers every image shares, like a common base image")
+parser.add_argument("--sync-processes", type=int, default=1, help="How many quay_sync.py workers run at the same time. More than 1 shares the work through --shard-store")
+parser.add_argument("--tags-per-repo", type=int, default=3, help="How many tags are seeded in each repository")
+parser.add_argument("--tolerance", type=float, default=0.2, help="How much worse than the baseline a result can be before it counts as a regression. Defaults to 0.2 (20%%)")
+parser.add_argument("--verify", action="store_true", help="After the sync, time quay_sync.py --verify comparing the primary with every secondary")
+
+args = parser.parse_args()
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# These are compared against a baseline. True means a higher number is better
+compared_results = {"images_per_second": True, "bytes_per_second": True, "api_calls_per_image": False,
+                    "registry_calls_per_image": False, "peak_rss_mib": False}
+
+
+def write_config(config_file: str, primary: MockQuay, secondaries: list) -> None:
+    """
+    Description:
+        Writes a quay_sync.py config file pointing at the mock servers
+    Args:
+        config_file (str): Where to write the config
+        primary (MockQuay): The server mirrored from
+        secondaries (list): The MockQuay servers mirrored to. All but the first go in additional_secondaries
+    """
+    # quay_sync.py insists on a repository list even though --auto-discovery does not use it
+    config = {"repositories": sorted(primary.tag_digests())[:1]}
+    for server_type, server in (("primary", primary), ("secondary", secondaries[0])):
+        config[f"{server_type}_server"] = server.url
+        config[f"{server_type}_token"] = server.api_token
+        config[f"{server_type}_init_token"] = server.api_token
+        config[f"{server_type}_quay_user"] = server.credentials[0]
+        config[f"{server_type}_quay_password"] = server.credentials[1]
+    if len(secondaries) > 1:
+        config["additional_secondaries"] = [{"server": server.url, "init_token": server.api_token, "quay_user": server.credentials[0],
+                                             "quay_password": server.credentials[1]} for server in secondaries[1:]]
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def write_podman_shim(bin_dir: str) -> None:
+    """
+    Description:
+        quay_sync.py logs in with podman before it starts. The shim accepts "podman login" and refuses
+        everything else, so the benchmark does not need podman and an image that falls back to podman
+        shows up as a failure instead of silently measuring something else
+    Args:
+        bin_dir (str): A directory that is put first in PATH for the sync
+    """
+    shim = os.path.join(bin_dir, "podman")
+    with open(shim, "w") as f:
+        f.write("#!/bin/sh\n"
+                "[ \"$1\" = \"login\" ] && exit 0\n"
+                "echo \"podman $1 is not available during the benchmark\" >&2\n"
+                "exit 1\n")
+    os.chmod(shim, 0o755)
+
+
+def run_sync(sync_commands: list, environment: dict, log_file: str) -> tuple:
+    """
+    Description:
+        Starts every quay_sync.py worker at once and waits for them with wait4 so the peak RSS of
+        each worker can be read
+    Args:
+        sync_commands (list): The command of each worker
+        environment (dict): The environment for the sync
+        log_file (str): Where stdout and stderr of the sync are written
+    Returns:
+        tuple: (<highest exit code>, <seconds until the last worker finished>, <highest peak RSS in MiB>)
+    """
+    exit_code = 0
+    peak_rss = 0
+    with open(log_file, "a") as log:
+        start_time = time.perf_counter()
+        processes = [subprocess.Popen(command, cwd=app_dir, env=environment, stdout=log, stderr=subprocess.STDOUT) for command in sync_commands]
+        for process in processes:
+            _, status, usage = os.wait4(process.pid, 0)
+            # Popen would try to reap the process again
+            process.returncode = os.waitstatus_to_exitcode(status)
+            exit_code = max(exit_code, process.returncode)
+            # ru_maxrss is in KiB on Linux
+            peak_rss = max(peak_rss, usage.ru_maxrss / 1024)
+        elapsed = time.perf_counter() - start_time
+    return exit_code, elapsed, peak_rss
+
+
+def measure_pass(name: str, sync_commands: list, environment: dict, log_file: str, primary: MockQuay,
+                 secondaries: list, images: int, image_bytes: int) -> dict:
+    """
+    Description:
+        Runs one sync and works out the throughput from the wall clock time and the mock servers' counters
+    Args:
+        name (str): The name of the pass in the report
+        sync_commands (list): The command of each worker
+        environment (dict): The environment for the sync
+        log_file (str): Where the sync output is written
+        primary (MockQuay): The server mirrored from
+        secondaries (list): The MockQuay servers mirrored to
+        images (int): How many images were seeded
+        image_bytes (int): The total size of the layers of every image, counting shared layers once per image
+    Returns:
+        dict: The results of the pass
+    """
+    servers = [primary] + secondaries
+    for server in servers:
+        server.reset_stats()
+    for sync_command in sync_commands:
+        logging.info(f"Running the {name} sync ---> {shlex.join(sync_command)} <---")
+    exit_code, elapsed, peak_rss_mib = run_sync(sync_commands, environment, log_file)
+    source_tags = primary.tag_digests()
+    # An image only counts as mirrored once it is on every secondary
+    mirrored = min(sum(1 for image, digest in source_tags.items() if secondary.tag_digests().get(image) == digest) for secondary in secondaries)
+    api_calls = sum(server.stats["api_calls"] for server in servers)
+    registry_calls = sum(server.stats["registry_calls"] + server.stats["token_calls"] for server in servers)
+    bytes_uploaded = sum(secondary.stats["bytes_uploaded"] for secondary in secondaries)
+    return {"pass": name, "exit_code": exit_code, "seconds": round(elapsed, 3), "images": images, "mirrored": mirrored,
+            "images_per_second": round(images / elapsed, 2), "logical_bytes_per_second": round(image_bytes / elapsed),
+            "bytes_uploaded": bytes_uploaded, "bytes_per_second": round(bytes_uploaded / elapsed),
+            "bytes_downloaded": primary.stats["bytes_downloaded"],
+            "manifests_pushed": sum(secondary.stats["manifests_pushed"] for secondary in secondaries), "api_calls": api_calls,
+            "api_calls_per_image": round(api_calls / images, 2), "registry_calls": registry_calls,
+            "registry_calls_per_image": round(registry_calls / images, 2), "peak_rss_mib": round(peak_rss_mib, 1)}
+
+
+def report(result: dict) -> None:
+    """
+    Description:
+        Logs the results of a pass
+    Args:
+        result (dict): The output of measure_pass()
+    """
+    logging.info(f"{result['pass']} sync: {result['mirrored']}/{result['images']} images in sync after {result['seconds']} seconds (exit code {result['exit_code']})")
+    logging.info(f"    images/sec ---> {result['images_per_second']} <---")
+    logging.info(f"    bytes/sec ---> {result['bytes_per_second']} <--- ({result['bytes_uploaded']} bytes uploaded, {result['logical_bytes_per_second']} logical bytes/sec)")
+    logging.info(f"    bytes downloaded from the primary ---> {result['bytes_downloaded']} <---")
+    logging.info(f"    API calls per image ---> {result['api_calls_per_image']} <--- ({result['api_calls']} calls)")
+    logging.info(f"    registry calls per image ---> {result['registry_calls_per_image']} <--- ({result['registry_calls']} calls)")
+    logging.info(f"    peak RSS ---> {result['peak_rss_mib']} MiB <---")
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Description:
+        Compares each pass to the pass with the same name in a baseline
+    Args:
+        results (list): The results of this run
+        baseline (list): The results of an earlier run
+        tolerance (float): How much worse a number can get, 0.2 is 20%
+    Returns:
+        list: A description of every number that got worse by more than the tolerance
+    """
+    found = []
+    baseline_passes = {result["pass"]: result for result in baseline}
+    for result in results:
+        previous = baseline_passes.get(result["pass"])
+        if not previous:
+            continue
+        for key, higher_is_better in compared_results.items():
+            if not previous.get(key):
+                continue
+            change = (result[key] - previous[key]) / previous[key]
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                found.append(f"{result['pass']} {key}: {previous[key]} ---> {result[key]}")
+    return found
+
+
+if __name__ == "__main__":
+    primary = MockQuay(page_size=args.page_size, api_latency=args.api_latency, registry_latency=args.registry_latency).start()
+    secondaries = [MockQuay(page_size=args.page_size, api_latency=args.api_latency, registry_latency=args.registry_latency).start()
+                   for _ in range(max(1, args.secondaries))]
+    logging.info(f"Seeding ---> {primary.url} <--- with {args.orgs} orgs x {args.repos_per_org} repos x {args.tags_per_repo} tags")
+    seeded = primary.seed(orgs=args.orgs, repos_per_org=args.repos_per_org, tags_per_repo=args.tags_per_repo,
+                          layers_per_image=args.layers_per_image, layer_size=args.layer_size, shared_layers=args.shared_layers)
+    logging.info(f"Seeded {seeded['images']} images, {seeded['unique_bytes']} bytes of unique blobs")
+    # Holds the config, the podman shim, the state files and the sync log. Removed even if a pass fails
+    with tempfile.TemporaryDirectory(prefix="quay_sync_benchmark_") as work_dir:
+        config_file = os.path.join(work_dir, "config.yaml")
+        log_file = args.log_file or os.path.join(work_dir, "sync.log")
+        write_config(config_file, primary, secondaries)
+        write_podman_shim(work_dir)
+        environment = dict(os.environ, PATH=work_dir + os.pathsep + os.environ.get("PATH", ""))
+        sync_commands = []
+        for worker in range(max(1, args.sync_processes)):
+            # Each worker keeps its own state file, the same as workers on separate hosts would
+            sync_command = [sys.executable, "quay_sync.py", "--config-file", config_file, "--auto-discovery", "--copy-backend", "direct",
+                            "--state-file", os.path.join(work_dir, f"state-{worker}.db"), "--journal-file", os.path.join(work_dir, f"journal-{worker}.db"),
+                            "--max-workers", str(args.max_workers)]
+            if args.sync_processes > 1:
+                sync_command += ["--shard-store", os.path.join(work_dir, "shards.db"), "--worker-id", f"benchmark-{worker}"]
+            sync_commands.append(sync_command + shlex.split(args.extra_sync_args))
+
+        passes = [("full", [command + ["--full-resync"] for command in sync_commands])]
+        if args.incremental:
+            passes.append(("incremental", sync_commands))
+        if args.verify:
+            # Only reads both sides, so a single process is enough. Images/sec is tags compared per second
+            passes.append(("verify", [[sys.executable, "quay_sync.py", "--config-file", config_file, "--auto-discovery", "--verify",
+                                       "--state-file", os.path.join(work_dir, "state-0.db")] + shlex.split(args.extra_sync_args)]))
+        results = []
+        for name, commands in passes:
+            result = measure_pass(name, commands, environment, log_file, primary, secondaries, seeded["images"], seeded["image_bytes"])
+            report(result)
+            results.append(result)
+            if result["exit_code"] or result["mirrored"] != result["images"]:
+                with open(log_file) as f:
+                    logging.critical(f"The {name} sync did not mirror every image. Its output was:\n{f.read()[-5000:]}")
+                exit(1)
+    for server in [primary] + secondaries:
+        server.stop()
+
+    if args.json_output:
+        with open(args.json_output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+        logging.info(f"Wrote results to ---> {args.json_output} <---")
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f)["results"], args.tolerance)
+        for regression in found:
+            logging.critical(f"Regression ---> {regression} <---")
+        if found:
+            exit(1)
+        logging.info(f"No regressions against ---> {args.baseline} <---")
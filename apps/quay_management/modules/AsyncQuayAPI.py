@@ -0,0 +1,550 @@
+import asyncio
+import atexit
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from .Metrics import Metrics
+from .QuayAPI import QuayAPI, QuayAPIError
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncQuayAPI:
+    # One connection pool is shared by every instance running on the same event loop
+    session = None
+    session_loop = None
+    pool_size = 100
+    max_per_host = 20
+    connect_timeout = 10
+    read_timeout = 60
+    # A semaphore per Quay host so thousands of coroutines can be queued without flooding a single server
+    host_limits = {}
+    # The event loop that submit() runs coroutines on for code that is not async itself, started on first use
+    loop = None
+    loop_thread = None
+    loop_lock = threading.Lock()
+    # What a request raises when it could not be sent, for callers that do not import aiohttp themselves
+    request_errors = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp else (asyncio.TimeoutError,)
+
+    def __init__(self, base_url: str = None, api_token: str = None, robot_acct: dict = None) -> None:
+        """
+        Description:
+            Initialize a new instance of the AsyncQuayAPI class. It has the same methods as QuayAPI but every
+            call that talks to Quay is a coroutine so many calls can be awaited together with asyncio.gather().
+            Code that is not async itself can hand coroutines to submit() or run_all()
+        Args:
+            base_url (str, optional): The base URL of the Quay API. Defaults to None.
+            api_token (str, optional): The API token for authentication. Defaults to None.
+            robot_acct (dict, optional): The robot account to operate on, in the same format QuayAPI expects. Defaults to None.
+        """
+        if aiohttp is None:
+            logging.critical("AsyncQuayAPI requires the aiohttp package... pip install aiohttp")
+            exit(1)
+        self.api_token = api_token
+        self.base_url = base_url
+        self.repo_endpoint = f"{self.base_url}/api/v1/find/repositories"
+        self.org_endpoint = "/api/v1/organization/"
+        self.org_member_list_endpoint = f"{self.org_endpoint}/<org>/members"
+        self.org_list_endpoint = "/api/v1/superuser/organizations/"
+        self.org_member_add_endpoint = "/api/v1/organization/<org>/team/<team_name>/members/<new_member>"
+        # The <org> is a placeholder so that it can be replaced as needed
+        self.proxycache_url = f"{self.base_url}/api/v1/organization/<org>/proxycache"
+        self.headers = {'Authorization': f'Bearer {self.api_token}'}
+        if isinstance(robot_acct, dict):
+            try:
+                if robot_acct["type"] == "org":
+                    robot_acct['url'] = f"{self.base_url}/api/v1/organization/{robot_acct['org_name']}/robots/{robot_acct['name']}"
+                elif robot_acct["type"] == "personal":
+                    robot_acct['url'] = f"{self.base_url}/api/v1/user/robots/{robot_acct['name']}"
+            except KeyError:
+                logging.error("Invalid input for robot account")
+        elif robot_acct is not None:
+            logging.error(f"Expected robot acct to be a dict... got {type(robot_acct)}")
+        self.robot_acct = robot_acct
+
+    @classmethod
+    def configure_session(cls, pool_size: int = None, max_per_host: int = None, connect_timeout: float = None, read_timeout: float = None) -> None:
+        """
+        Description:
+            Changes the settings used the next time the shared session is created. Call before the first request
+        Args:
+            pool_size (int, optional): The maximum number of open connections across all hosts. Defaults to None (unchanged).
+            max_per_host (int, optional): The maximum number of requests in flight against a single Quay host. Defaults to None (unchanged).
+            connect_timeout (float, optional): Seconds to wait for a TCP/TLS connection to be established. Defaults to None (unchanged).
+            read_timeout (float, optional): Seconds to wait for the server to send a response. Defaults to None (unchanged).
+        """
+        if pool_size:
+            cls.pool_size = pool_size
+        if max_per_host:
+            cls.max_per_host = max_per_host
+            cls.host_limits = {}
+        if connect_timeout:
+            cls.connect_timeout = connect_timeout
+        if read_timeout:
+            cls.read_timeout = read_timeout
+
+    @classmethod
+    def get_session(cls) -> "aiohttp.ClientSession":
+        """
+        Description:
+            Returns the shared session for the running event loop, creating it on first use
+        Returns:
+            aiohttp.ClientSession: A session whose connector keeps connections alive between calls
+        """
+        loop = asyncio.get_running_loop()
+        if cls.session is None or cls.session.closed or cls.session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=cls.pool_size, limit_per_host=cls.max_per_host)
+            timeout = aiohttp.ClientTimeout(sock_connect=cls.connect_timeout, sock_read=cls.read_timeout)
+            cls.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            cls.session_loop = loop
+            cls.host_limits = {}
+        return cls.session
+
+    @classmethod
+    async def close_session(cls) -> None:
+        """
+        Description:
+            Closes the shared session. Should be awaited before the event loop is shut down
+        """
+        if cls.session is not None and not cls.session.closed:
+            await cls.session.close()
+        cls.session = None
+        cls.session_loop = None
+
+    @classmethod
+    def submit(cls, coroutine) -> "concurrent.futures.Future":
+        """
+        Description:
+            Runs a coroutine on the shared background event loop from code that is not async, starting the loop on
+            first use. Every coroutine submitted shares the session and the host semaphores of that loop
+        Args:
+            coroutine: The coroutine to run
+        Returns:
+            concurrent.futures.Future: Resolves to what the coroutine returns
+        """
+        with cls.loop_lock:
+            if cls.loop is None:
+                cls.loop = asyncio.new_event_loop()
+                cls.loop_thread = threading.Thread(target=cls.loop.run_forever, name="async-quay-api", daemon=True)
+                cls.loop_thread.start()
+                atexit.register(cls.stop_loop)
+            return asyncio.run_coroutine_threadsafe(coroutine, cls.loop)
+
+    @classmethod
+    def run_all(cls, coroutines: list) -> list:
+        """
+        Description:
+            Runs coroutines together on the background event loop and waits for all of them. Requests are still
+            capped by the semaphore of each host, so thousands can be handed in at once
+        Args:
+            coroutines (list): The coroutines to run
+        Returns:
+            list: What each coroutine returned, in the same order
+        """
+        async def gather():
+            return await asyncio.gather(*coroutines)
+        return cls.submit(gather()).result()
+
+    @classmethod
+    def stop_loop(cls) -> None:
+        """
+        Description:
+            Closes the shared session and stops the background event loop. Registered to run at exit
+        """
+        with cls.loop_lock:
+            loop, cls.loop = cls.loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(cls.close_session(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        cls.loop_thread.join()
+        loop.close()
+
+    @classmethod
+    def host_limit(cls, url: str) -> asyncio.Semaphore:
+        """
+        Description:
+            Gets (or creates) the semaphore which caps the number of requests in flight against a host
+        Args:
+            url (str): Any URL on the host
+        Returns:
+            asyncio.Semaphore: The semaphore for that host
+        """
+        host = urlsplit(url).netloc
+        if host not in cls.host_limits:
+            cls.host_limits[host] = asyncio.Semaphore(cls.max_per_host)
+        return cls.host_limits[host]
+
+    async def request(self, method: str, url: str, headers: dict = None, data: dict = None, params: dict = None) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Sends a request through the shared session while holding the semaphore for the host.
+            The body is read before returning so .status, await .json() and await .text() can be used afterwards.
+            Failed requests are retried with the same rules and backoff as QuayAPI (see QuayAPI.configure_scheduler()),
+            without holding the semaphore while waiting
+        Args:
+            method (str): The HTTP method, GET, POST, PUT, DELETE etc
+            url (str): The full URL to send the request to
+            headers (dict, optional): The headers to send. Defaults to None.
+            data (dict, optional): A dict to send as the JSON body. Defaults to None.
+            params (dict, optional): Query string parameters. Defaults to None.
+        Returns:
+            aiohttp.ClientResponse: The response object from the API
+        """
+        if params:
+            params = {key: str(value).lower() if isinstance(value, bool) else str(value) for key, value in params.items()}
+        endpoint = QuayAPI.endpoint_name(url)
+        scheduler = QuayAPI.scheduler
+        method = method.upper()
+        attempt = 0
+        with Metrics.timer("quay_api_request_seconds", method=method, endpoint=endpoint):
+            while True:
+                try:
+                    async with self.host_limit(url):
+                        async with self.get_session().request(method, url, headers=headers, json=data, params=params) as response:
+                            await response.read()
+                except self.request_errors:
+                    if method not in scheduler.idempotent_methods or attempt >= scheduler.max_retries:
+                        raise
+                    retry_after = None
+                else:
+                    Metrics.increment("quay_api_responses_total", method=method, endpoint=endpoint, code=response.status)
+                    # Anything other than 429 may have been acted on, so only idempotent calls are sent again
+                    retryable = response.status == 429 or (response.status in scheduler.retry_statuses and method in scheduler.idempotent_methods)
+                    if not retryable or attempt >= scheduler.max_retries:
+                        return response
+                    retry_after = scheduler.parse_retry_after(response.headers.get("Retry-After"))
+                await asyncio.sleep(scheduler.backoff(attempt, retry_after))
+                attempt += 1
+
+    def assemble_org_url(self, org_name: str = None, url_to_replace: str = None) -> str:
+        """
+        Description:
+            Assembles the proxycache URL, basic find/replace function
+        Args:
+            org_name (str, optional): Name of the organization. Defaults to None.
+            url_to_replace (str, optional): A URL containing <org>. Defaults to None.
+        Returns:
+            str: A full url to the endpoint
+        """
+        return url_to_replace.replace("<org>", org_name)
+
+    async def create_org(self, org_name: str = None, override_headers: bool = False, additional_api_key: str = None) -> bool:
+        """
+        Description:
+            Create a new organization on Quay.
+        Args:
+            org_name (str): The name of the organization to create.
+        Returns:
+            bool: True if the organization was created successfully, False otherwise.
+        """
+        if override_headers:
+            headers = {'Authorization': f'Bearer {additional_api_key}'}
+        else:
+            headers = self.headers
+        logging.info(f"Attempting to create organization: {org_name}")
+        response = await self.post_data(url=f'{self.base_url}{self.org_endpoint}', headers=headers, data={'name': org_name})
+        if response.status == 201:
+            logging.info(f"Organization created successfully: {org_name}")
+            return True
+        logging.critical("Error creating organization")
+        logging.debug(await response.text())
+        return False
+
+    async def create_org_member(self, org_name: str = None, new_member: str = None, team_name: str = None) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Adds a user as a member of a specific team
+        Args:
+            org_name (str, optional): The name of the organization where the new membership should reside
+            new_member (str, optional): The name of the user to add a membership for
+            team_name (str, optional): The name of the team to add the user to
+        Returns:
+            aiohttp.ClientResponse: The response object from the API
+        """
+        url = self.assemble_org_url(org_name=org_name, url_to_replace=f'{self.base_url}{self.org_member_add_endpoint}')
+        url = url.replace("<team_name>", team_name).replace("<new_member>", new_member)
+        return await self.put_data(url=url)
+
+    async def create_proxycache(self, org_name: str = None, json_data: dict = None) -> None:
+        """
+        Description:
+            Uses the QuayAPI to create a proxycache setting under a specific organization
+        Args:
+            org_name (str, optional): Name of the organization where proxycache is to reside. Defaults to None.
+            json_data (dict, optional): A JSON object describing the proxycache configuration. Defaults to None.
+        """
+        url = self.assemble_org_url(org_name=org_name, url_to_replace=self.proxycache_url)
+        response = await self.post_data(url=url, data=json_data)
+        if response.status != 201:
+            logging.warning("----> Failed to create proxy cache")
+            logging.warning(await response.text())
+            logging.warning(f'Status code: {response.status}')
+
+    async def create_robot_acct(self) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Creates a robot account in quay
+        """
+        logging.info(f"Creating robot account {self.robot_acct}")
+        return await self.put_data(url=self.robot_acct['url'])
+
+    async def delete_data(self, data: dict = None, url: str = None, headers_required=True, headers: str = None) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Deletes data from a specified URL using the shared session.
+        Args:
+            data (dict): The data to be deleted.
+            url (str): The URL to delete the data from.
+            headers_required (bool): Whether or not headers are required for the request.
+        Returns:
+            aiohttp.ClientResponse: The response from the server.
+        """
+        if not headers:
+            headers = self.headers
+        return await self.request("DELETE", url, headers=headers if headers_required else None, data=data)
+
+    async def delete_proxycache(self, org_name: str = None) -> None:
+        """
+        Description:
+            Deletes the proxycache configuration from the specified Quay organization
+        Args:
+            org_name (str, optional): The organization where the proxycache config resides. Defaults to None.
+        """
+        url = self.assemble_org_url(org_name=org_name, url_to_replace=self.proxycache_url)
+        response = await self.delete_data(url=url)
+        if response.status != 201:
+            logging.warning("----> Failed to delete proxy cache")
+            logging.warning(await response.text())
+            logging.warning(f'Status code: {response.status}')
+
+    async def delete_robot_acct(self) -> None:
+        """
+        Description:
+            Deletes a robot account if it exists
+        """
+        logging.info(f"Deleting robot account {self.robot_acct['name']}")
+        await self.delete_data(url=self.robot_acct['url'])
+
+    async def get_data(self, url: str = None, override_headers: bool = False, additional_api_key: str = None, params: dict = None) -> dict:
+        """
+        Description:
+            Fetches data from the Quay API.
+        Args:
+            url (str): The URL to fetch data from. If not specified, uses the default Quay repository URI.
+            params (dict, optional): Query string parameters such as page. Defaults to None.
+        Returns:
+            dict: A dictionary containing the JSON response from the API, or None on error. Unlike QuayAPI an empty
+                  first page is returned instead of exiting, since exit() can not stop the program from inside the event loop
+        """
+        if url is None:
+            url = self.repo_endpoint
+        if override_headers:
+            headers = {'Authorization': f'Bearer {additional_api_key}'}
+        else:
+            headers = self.headers
+        try:
+            response = await self.request("GET", url, headers=headers, params=params)
+        except self.request_errors as e:
+            logging.error("Error getting data from %s: %s", url, e)
+            return None
+        if response.status != 200:
+            logging.error("Error getting data from %s: %s", url, response.status)
+            return None
+        try:
+            return await response.json(content_type=None)
+        except ValueError:
+            return None
+
+    async def get_org(self, override_headers: bool = False, additional_api_key: str = None) -> dict:
+        """
+        Description:
+            Gets a list of all the organizations in Quay
+        Args:
+            override_headers (bool, optional): There may be cases where you need to override the headers
+                                                because you want to use a different API key.
+            additional_api_key (str, optional): If you need to change the API key for some reason
+                                                use this key instead
+        Returns:
+            (dict): Returns the API response as a dict
+        """
+        return await self.get_data(url=f'{self.base_url}{self.org_list_endpoint}', override_headers=override_headers, additional_api_key=additional_api_key)
+
+    async def get_org_members(self, org_name: str = None) -> dict:
+        """
+        Description:
+            Gets the current members of the specified organization
+        Args:
+            org_name (str, optional): The name of the Quay organization to get a member list from.
+        Returns:
+            (dict): The response from the API
+        """
+        url = self.assemble_org_url(org_name=org_name, url_to_replace=f'{self.base_url}{self.org_member_list_endpoint}')
+        return await self.get_data(url=url)
+
+    async def get_proxycache(self, org_name: str = None) -> dict:
+        """
+        Description:
+            Retrieves proxycache information from the API
+        Args:
+            org_name (str, optional): The organization in which the proxycache information resides. Defaults to None.
+        Returns:
+            dict: The response data from the API
+        """
+        url = self.assemble_org_url(org_name=org_name, url_to_replace=self.proxycache_url)
+        return await self.get_data(url=url) or None
+
+    async def get_robot_acct(self) -> dict:
+        """
+        Description:
+            Retrieves the robot account from the url specified
+        Returns:
+            dict: The response data from the API
+        """
+        logging.info(f"Retrieving robot account {self.robot_acct['name']}")
+        return await self.get_data(url=self.robot_acct['url'])
+
+    async def get_tag_info(self, href: str) -> list:
+        """
+        Description:
+            Gets information about tags in a Quay repository. Every page of tags is read.
+        Args:
+            href (str): The href of the repository to fetch tag information for.
+        Returns:
+            list: A list of tag names in the repository.
+        """
+        tag_list = []
+        async for tag in self.iter_tags(href):
+            if tag['name'] not in tag_list:
+                tag_list.append(tag['name'])
+        return tag_list
+
+    async def iter_pages(self, url: str = None, items_key: str = "results", params: dict = None):
+        """
+        Description:
+            Async generator that follows Quay's page/has_additional and next_page pagination
+        Args:
+            url (str, optional): The paginated endpoint. Defaults to the repository search endpoint.
+            items_key (str, optional): The key in the response which holds the list of items. Defaults to "results".
+            params (dict, optional): Any extra query string parameters. Defaults to None.
+        Yields:
+            dict: One item from the list in items_key
+        Raises:
+            QuayAPIError: If a page could not be read
+        """
+        params = dict(params or {})
+        while True:
+            page = await self.get_data(url=url, params=params)
+            if page is None:
+                raise QuayAPIError(f"Stopped reading {url or self.repo_endpoint} at page {params.get('page', 1)}")
+            for item in page.get(items_key, []):
+                yield item
+            if page.get("next_page"):
+                params["next_page"] = page["next_page"]
+            elif page.get("has_additional"):
+                params["page"] = page.get("page", params.get("page", 1)) + 1
+            else:
+                return
+
+    async def iter_repositories(self, query: str = ""):
+        """
+        Description:
+            Async generator that yields every repository the token can see, one page at a time
+        Args:
+            query (str, optional): Search string passed to the find/repositories endpoint. Defaults to "" (everything).
+        Yields:
+            dict: A repository from the API, including 'namespace' and 'href'
+        """
+        async for repository in self.iter_pages(url=self.repo_endpoint, items_key="results", params={"query": query}):
+            yield repository
+
+    def iter_repository_tags(self, repositories, lookahead: int = 200):
+        """
+        Description:
+            Generator for code that is not async. The tags of up to lookahead repositories are listed at the same
+            time on the background event loop while the caller works through the repositories in order, so a sync
+            of thousands of repositories does not wait on one tag listing at a time
+        Args:
+            repositories (iterable): Repositories with an 'href', for example from QuayAPI.iter_repositories()
+            lookahead (int, optional): How many repositories are listed ahead of the one being handed out. Defaults to 200.
+        Yields:
+            tuple: (<repository>, [<tag from the API>], <QuayAPIError if not every page could be read, otherwise None>)
+        """
+        listings = deque()
+        repository_iterator = iter(repositories)
+        try:
+            while True:
+                while len(listings) < max(1, lookahead):
+                    repository = next(repository_iterator, None)
+                    if repository is None:
+                        break
+                    listings.append((repository, self.submit(self.list_tags(repository['href']))))
+                if not listings:
+                    return
+                repository, listing = listings.popleft()
+                yield (repository, *listing.result())
+        finally:
+            # The caller stopped early, listings that have not started are not needed
+            for _, listing in listings:
+                listing.cancel()
+
+    async def iter_tags(self, href: str):
+        """
+        Description:
+            Async generator that yields every active tag in a repository, one page at a time
+        Args:
+            href (str): The href of the repository, for example /repository/<org>/<repo>
+        Yields:
+            dict: A tag from the API, including 'name' and 'manifest_digest'
+        """
+        working_url = f"{self.base_url}/api/v1{href}/tag"
+        async for tag in self.iter_pages(url=working_url, items_key="tags", params={"onlyActiveTags": "true", "limit": 100}):
+            yield tag
+
+    async def list_tags(self, href: str) -> tuple[list, Exception]:
+        """
+        Description:
+            Reads every active tag of a repository
+        Args:
+            href (str): The href of the repository, for example /repository/<org>/<repo>
+        Returns:
+            tuple: ([<tag from the API>], None), or the tags read before a page failed and the QuayAPIError
+        """
+        tags = []
+        try:
+            async for tag in self.iter_tags(href):
+                tags.append(tag)
+        except QuayAPIError as e:
+            return tags, e
+        return tags, None
+
+    async def post_data(self, data: dict = None, url: str = None, headers_required=True, headers: str = None) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Posts data to a specified URL using the shared session.
+        Args:
+            data (dict): The data to be posted.
+            url (str): The URL to post the data to.
+            headers_required (bool): Whether or not headers are required for the request.
+        Returns:
+            aiohttp.ClientResponse: The response from the server.
+        """
+        if not headers:
+            headers = self.headers
+        return await self.request("POST", url, headers=headers if headers_required else None, data=data or {})
+
+    async def put_data(self, data: dict = None, url: str = None, headers_required=True) -> "aiohttp.ClientResponse":
+        """
+        Description:
+            Uses the PUT method instead of the POST method to interact with the API
+        Args:
+            data (dict, optional): JSON object to send to the API endpoint. Defaults to None.
+            url (str, optional): The API endpoint to put the data. Defaults to None.
+            headers_required (bool, optional): In some cases the header might not be required. Defaults to True.
+        Returns:
+            aiohttp.ClientResponse: The response object from the API
+        """
+        return await self.request("PUT", url, headers=self.headers if headers_required else None, data=data or {})
@@ -1,4 +1,5 @@
 import yaml
+import json
 import logging
 import os
 import tempfile
@@ -8,6 +9,9 @@ import string
 from uuid import uuid4;
         
 class BaseOperations:
+    # libyaml's loader is many times faster than the pure python one and is used whenever PyYAML was built with it
+    yaml_loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
     def __init__(self, config_file, args: dict = None):
         self.config = BaseOperations.load_config(config_file=config_file)
         expected_config_values = {}
@@ -49,6 +53,8 @@ class BaseOperations:
                         "openshift_username": {"type": "string", "desc": "OpenShift cluster admin username"},
                         "openshift_password": {"type": "string", "desc": "OpenShift cluster admin password"},
                         "openshift_yaml_dir": {"type": "string", "desc": "Full path to the directory with YAMLs to be applied to the OpenShift cluster"},
+                        "primary_openshift_api_url": {"type": "string", "desc": "Optional. Login URL for the OpenShift cluster running the primary quay instance. Defaults to openshift_api_url"},
+                        "secondary_openshift_api_url": {"type": "string", "desc": "Optional. Login URL for the OpenShift cluster running the secondary quay instance. Defaults to openshift_api_url"},
                         "organizations": {"type": "dict", "desc": "A dictionary that tells the program which organizations should or should not exist in quay in the format of {'<org_name>': 'present': 'true/false'}"},
                         "proxycache": {"type": "dict", "desc": "A dictionary of proxy config in the format of {'<org_name>': { 'org_name': '<org_name>', 'upstream_registry_username': '<user>, 'upstream_registry_username': <passwd>}, 'upstream_registry': <url>}"},
                         "quay_admin_org": {"type": "string", "desc": "The name of the organization where the initial OAUTH token will reside"},
@@ -202,21 +208,27 @@ class BaseOperations:
                 # To initialize the OAUTH you need to do some database work
                 # to do that you need to access resources in OpenShift such as pods and secrets and the namespace where Quay resides
                 if args.initialize_oauth:
-                    server_type = "primary"
+                    server_types = ["primary"]
                     try:
                         if args.configure_secondary_quay_server:
-                            server_type = "secondary"
+                            server_types = ["secondary"]
                     except: 
                         pass
-                    quay_namespace = f"{server_type}_quay_namespace"
-                    quay_init_token = f"{server_type}_init_token"
-                    quay_url = f"{server_type}_server"
+                    try:
+                        # --all-quay-servers sets up the token on both servers at the same time
+                        if args.all_quay_servers:
+                            server_types = ["primary", "secondary"]
+                    except:
+                        pass
                     add_these_options = [openshift_options.copy()]
-                    add_these_options.append({quay_url: all_options[quay_url]})
                     add_these_options.append({"quay_admin_org": all_options["quay_admin_org"]})
-                    
-                    add_these_options.append({quay_namespace: all_options[quay_namespace]})
-                    add_these_options.append({quay_init_token: all_options[quay_init_token]})
+                    for server_type in server_types:
+                        quay_namespace = f"{server_type}_quay_namespace"
+                        quay_init_token = f"{server_type}_init_token"
+                        quay_url = f"{server_type}_server"
+                        add_these_options.append({quay_url: all_options[quay_url]})
+                        add_these_options.append({quay_namespace: all_options[quay_namespace]})
+                        add_these_options.append({quay_init_token: all_options[quay_init_token]})
                     expected_config_values = build_dict(add_these_options=add_these_options, incoming_dict=expected_config_values)
             except:
                 pass
@@ -340,7 +352,7 @@ class BaseOperations:
         logging.info(f"Reading {config_path}...")
         with open(config_path, "r") as file:
             yaml_dict = file.read()
-        yaml_dict = yaml.load(yaml_dict, Loader=yaml.FullLoader)
+        yaml_dict = BaseOperations.load_yaml(yaml_dict)
         if not isinstance(insert_dict, dict):
             logging.error(f"Cannot add {insert_dict} to config file. It is not a dict")
             exit(1)   
@@ -369,96 +381,90 @@ class BaseOperations:
         return(command)
 
     @staticmethod
-    def create_initial_oauth_script(user_id: str = None, app_id: str = None, db_info: dict = None) -> str:
+    def create_oauth_helper_script(db_info: dict = None, application_name: str = "automation") -> tuple:
         """
         Description:
-            Creates a small script that makes some database inserts to manually create an oauth token. 
-            This is a workaround because Quay does not allow you to programmatically create an oauth 
+            Creates a script that is piped into a Quay pod to manually create an oauth token.
+            This is a workaround because Quay does not allow you to programmatically create an oauth
             token without first having an oauth token.
+            The script uses a single database connection to find the oauth application, find the user
+            that already has a token for it and insert the new token. The token is generated and hashed
+            here so only the hash is sent to the pod. The last line the script prints is JSON:
+            {"application_id": <int>, "org_id": <int>, "user_id": <int>, "token_id": <int>} or {"error": <str>}
         Args:
-            user_id (str, optional): _description_. Defaults to None.
-            app_id (str, optional): _description_. Defaults to None.
-            org_id (int, optional): _description_. Defaults to None.
+            db_info (dict, optional): This is the processed output from the openshift secret that has database connection info. Defaults to None.
+            application_name (str, optional): The name of the oauth application to tie the token to. Defaults to "automation".
         Returns:
-            The path to the file that was written
+            tuple: (<the script>, <the token>)
         """
-        local_file_location = "/tmp/generic.py"
         random = Random()
         token = ''.join([random.choice(string.ascii_uppercase + string.digits) for _ in range(40)])
         bcrypt_token = bcrypt.hashpw(token[20:].encode("utf-8"), bcrypt.gensalt())
-        short_token = token[:20]
-        db_command = f"""INSERT INTO public.oauthaccesstoken " + 
-"(uuid, application_id, authorized_user_id, scope, token_type, expires_at, data, token_code, token_name) " +
-f"VALUES ('{str(uuid4())}', {app_id}, {user_id}, 'org:admin repo:admin repo:create repo:read repo:write super:user user:admin user:read', " +
-f"'Bearer', '2033-12-15 00:00:00.0', '', '{bcrypt_token.decode()}', '{short_token}') RETURNING public.oauthaccesstoken.id;"""
-        connection_string = f"dbname='{db_info['database-name']}' user='{db_info['database-username']}' host='{db_info['database-svc']}' password='{db_info['database-password']}'"
+        parameters = {
+            "connection": {"dbname": db_info['database-name'], "user": db_info['database-username'],
+                           "host": db_info['database-svc'], "password": db_info['database-password']},
+            "application_name": application_name,
+            "uuid": str(uuid4()),
+            "scope": "org:admin repo:admin repo:create repo:read repo:write super:user user:admin user:read",
+            "expires_at": "2033-12-15 00:00:00.0",
+            "token_code": bcrypt_token.decode(),
+            "token_name": token[:20],
+        }
+        # The parameters are passed as JSON and every query is parameterized so nothing needs quoting
+        python_script = """import json
+import sys
+import psycopg2
+parameters = json.loads(%r)
+result = {}
+conn = None
+try:
+    conn = psycopg2.connect(**parameters["connection"])
+    cur = conn.cursor()
+    cur.execute("SELECT id, organization_id FROM public.oauthapplication WHERE name = %%s ORDER BY id DESC LIMIT 1",
+                (parameters["application_name"],))
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError("No oauth application named %%s" %% parameters["application_name"])
+    result["application_id"], result["org_id"] = row
+    cur.execute("SELECT authorized_user_id FROM public.oauthaccesstoken WHERE application_id = %%s ORDER BY id DESC LIMIT 1",
+                (result["application_id"],))
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError("No access token exists for the %%s oauth application" %% parameters["application_name"])
+    result["user_id"] = row[0]
+    cur.execute("INSERT INTO public.oauthaccesstoken "
+                "(uuid, application_id, authorized_user_id, scope, token_type, expires_at, data, token_code, token_name) "
+                "VALUES (%%s, %%s, %%s, %%s, 'Bearer', %%s, '', %%s, %%s) RETURNING id",
+                (parameters["uuid"], result["application_id"], result["user_id"], parameters["scope"],
+                 parameters["expires_at"], parameters["token_code"], parameters["token_name"]))
+    result["token_id"] = cur.fetchone()[0]
+    conn.commit()
+except Exception as e:
+    print(json.dumps({"error": str(e)}))
+    sys.exit(1)
+finally:
+    if conn is not None:
+        conn.close()
+print(json.dumps(result))
+""" % json.dumps(parameters)
+        return(python_script, token)
 
-        python_script = """#!/usr/bin/python
-import psycopg2;
-conn = psycopg2.connect(\"%s\") ;
-cur = conn.cursor();
-cur.execute(\"%s\");
-print(cur.fetchall())
-conn.commit()
-cur.close()
-""" % (connection_string, db_command)
-        with open(local_file_location, "w") as f:
-            f.write(python_script)
-            f.close()
-        return(local_file_location, token)
-    
     @staticmethod
-    def create_db_info_script(select_statement: str = None, db_info: dict = None) -> str:
+    def human_readable_bytes(number_of_bytes: int) -> str:
         """
         Description:
-            Creates a script that retrieves oauthapplication and oauthaccesstoken tables from the Quay database
+            Formats a byte count for log messages
         Args:
-            select_statement (str, optional): A SELECT statement for sql getting all entries for a give table. Defaults to None.
-            db_info (dict, optional): This is the processed output from the openshift secret that has database connection info. Defaults to None.
+            number_of_bytes (int): The number of bytes
         Returns:
-            Full path to the script to transfer
+            str: For example "1.5 GiB"
         """
-        local_file_location = "/tmp/generic.py"
-        connection_string = f"dbname='{db_info['database-name']}' user='{db_info['database-username']}' host='{db_info['database-svc']}' password='{db_info['database-password']}'"
-        if "oauthapplication" in select_statement:
-            while_loop = """
-while counter < list_length:
-    id = list(output[counter])[0]
-    client_id = list(output[counter])[1]
-    org_id = list(output[counter])[4]
-    name = list(output[counter])[5]
-    app_info_dict[id] = {'client_id': client_id, 'org_id': org_id, "oauth_name": name}
-    counter +=1
-"""
-        elif "oauthaccesstoken" in select_statement:
-            while_loop = """
-while counter < list_length:
-    database_id = list(output[counter])[0]
-    uuid = list(output[counter])[1]
-    app_id = list(output[counter])[2]
-    user_id = list(output[counter])[3]
-    app_info_dict[database_id] = {'uuid': uuid, 'app_id': app_id, 'user_id': user_id}
-    counter +=1
-"""
-        else:
-            pass
-        python_script = """#!/usr/bin/python
-import psycopg2;
-conn = psycopg2.connect(\"%s\") ;
-cur = conn.cursor();
-cur.execute(\"%s\");
-counter = 0
-app_info_dict = {}
-output = cur.fetchall()
-list_length = len(output)
-%s
-print(app_info_dict)
-""" % (connection_string, select_statement, while_loop)
-        with open(local_file_location, "w") as f:
-            f.write(python_script)
-            f.close()
-        return(local_file_location)
-
+        size = float(number_of_bytes)
+        for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+            if abs(size) < 1024 or unit == "TiB":
+                break
+            size /= 1024
+        return f"{size:.1f} {unit}"
 
     @classmethod
     def load_config(cls, config_file: str) -> dict[str,str]:
@@ -474,7 +480,7 @@ print(app_info_dict)
 
         try:
             with open(config_file, 'r') as f:
-                data = yaml.load(f, Loader=yaml.FullLoader)
+                data = cls.load_yaml(f)
         except FileNotFoundError:
             logging.critical(f"--> Config file not found: {config_file}")
             exit(1)
@@ -485,6 +491,18 @@ print(app_info_dict)
         return data
 
 
+    @classmethod
+    def load_yaml(cls, data) -> dict:
+        """
+        Description:
+            Parses YAML (or JSON) with the C accelerated loader when it is available
+        Args:
+            data: A string, bytes or an open file
+        Returns:
+            The parsed data
+        """
+        return yaml.load(data, Loader=cls.yaml_loader)
+
     @classmethod
     def strip_ldap_from_config(cls, config_file: str) -> str:
         """
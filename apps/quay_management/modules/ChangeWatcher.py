@@ -0,0 +1,267 @@
+import datetime
+import hmac
+import http.server
+import json
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qs, urlsplit
+from .Metrics import Metrics
+from .QuayAPI import QuayAPIError
+
+
+class ChangeWatcher:
+    # Audit log kinds that mean a tag may now point at a different manifest
+    push_kinds = {"push_repo", "create_tag", "move_tag", "revert_tag"}
+    # Log entries only have a resolution of one second, so entries this close to the newest one seen are read again
+    # and de-duplicated in case more were written in the same second
+    log_overlap_seconds = 5
+
+    def __init__(self, quay_api=None, poll_interval: float = 30, webhook_port: int = None, webhook_address: str = "0.0.0.0",
+                 webhook_token: str = None, settle_seconds: float = 2) -> None:
+        """
+        Description:
+            Collects the repositories and tags that changed on the primary so a long running sync only
+            mirrors what was pushed. Changes arrive from two sources that can be used together:
+            Quay repository notifications (a "Push to Repository" webhook pointed at a local listener) and
+            polling the superuser audit log for push and tag events. Changes are merged per repository
+            until the sync picks them up
+        Args:
+            quay_api (QuayAPI, optional): The primary's API, used to poll the audit log. Defaults to None.
+            poll_interval (float, optional): Seconds between audit log polls. 0 turns polling off. Defaults to 30.
+            webhook_port (int, optional): Listen for Quay notifications on this port. Defaults to None (no listener).
+            webhook_address (str, optional): The address the listener binds to. Defaults to "0.0.0.0".
+            webhook_token (str, optional): If set, notifications must be sent to a URL ending in ?token=<webhook_token>. Defaults to None.
+            settle_seconds (float, optional): How long to wait for more changes after the first one before handing them to the sync,
+                                              so a burst of pushes is mirrored together. Defaults to 2.
+        """
+        self.quay_api = quay_api
+        self.poll_interval = poll_interval
+        self.webhook_port = webhook_port
+        self.webhook_address = webhook_address
+        self.webhook_token = webhook_token
+        self.settle_seconds = settle_seconds
+        # {<org>/<repo>: set of tags, or None when every tag should be checked}
+        self.pending = {}
+        # [(<monotonic time it is due>, <org>/<repo>, <tags>)] for changes that failed and are retried later
+        self.delayed = []
+        self.condition = threading.Condition()
+        self.stop_requested = threading.Event()
+        # Newest audit log time already read and the entries seen at or after it minus the overlap
+        self.log_watermark = time.time() - self.log_overlap_seconds
+        self.seen_entries = {}
+        self.server = None
+        self.threads = []
+
+    def add_change(self, repository: str, tags=None, source: str = "manual") -> None:
+        """
+        Description:
+            Queues a repository to be mirrored. Changes to the same repository are merged until they are picked up
+        Args:
+            repository (str): <org>/<repo>
+            tags (iterable, optional): The tags that changed. Defaults to None (check every tag in the repository).
+            source (str, optional): Where the change came from, for the logs and metrics. Defaults to "manual".
+        """
+        repository = repository.strip("/")
+        if repository.count("/") != 1:
+            logging.warning(f"Ignoring a change to ---> {repository} <--- from {source} because it is not <org>/<repo>")
+            return
+        with self.condition:
+            self.merge(repository, tags)
+            self.condition.notify_all()
+        Metrics.increment("watcher_events_total", source=source)
+        logging.info(f"Change from {source} ---> {repository} {sorted(tags) if tags is not None else '(all tags)'} <---")
+
+    def merge(self, repository: str, tags) -> None:
+        """
+        Description:
+            Adds a change to pending. None (every tag) wins over a set of tags. Must be called while holding self.condition
+        Args:
+            repository (str): <org>/<repo>
+            tags (iterable): The tags that changed, or None for every tag
+        """
+        if tags is None or (repository in self.pending and self.pending[repository] is None):
+            self.pending[repository] = None
+        else:
+            self.pending.setdefault(repository, set()).update(tags)
+
+    def requeue(self, changes: dict, delay: float) -> None:
+        """
+        Description:
+            Queues changes again after a delay, for images that failed to mirror
+        Args:
+            changes (dict): {<org>/<repo>: <set of tags or None>}
+            delay (float): Seconds before they are handed to the sync again
+        """
+        due = time.monotonic() + delay
+        with self.condition:
+            self.delayed.extend((due, repository, tags) for repository, tags in changes.items())
+            self.condition.notify_all()
+
+    def take_due_retries(self) -> None:
+        """
+        Description:
+            Moves delayed changes that are due into pending. Must be called while holding self.condition
+        """
+        now = time.monotonic()
+        due = [retry for retry in self.delayed if retry[0] <= now]
+        self.delayed = [retry for retry in self.delayed if retry[0] > now]
+        for _, repository, tags in due:
+            self.merge(repository, tags)
+
+    def wait_for_changes(self, timeout: float = None) -> dict:
+        """
+        Description:
+            Blocks until something changed on the primary, then keeps collecting for settle_seconds so a burst of
+            pushes is handed over together
+        Args:
+            timeout (float, optional): Give up after this many seconds. Defaults to None (wait until a change or stop()).
+        Returns:
+            dict: {<org>/<repo>: <set of tags or None>}. Empty if the timeout passed, None once stop() was called
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.stop_requested.is_set():
+                    return None
+                self.take_due_retries()
+                if self.pending:
+                    break
+                wait_for = [deadline - time.monotonic()] if deadline is not None else []
+                wait_for += [min(retry[0] for retry in self.delayed) - time.monotonic()] if self.delayed else []
+                if deadline is not None and wait_for[0] <= 0:
+                    return {}
+                self.condition.wait(max(0, min(wait_for)) if wait_for else None)
+            # A burst of pushes (a CI pipeline pushing several tags) usually arrives within a couple of seconds
+            self.condition.wait_for(self.stop_requested.is_set, timeout=self.settle_seconds)
+            self.take_due_retries()
+            changes, self.pending = self.pending, {}
+        return changes
+
+    def poll_audit_log(self) -> None:
+        """
+        Description:
+            Reads the audit log entries written since the last poll and queues every pushed or moved tag.
+            The log is returned newest first, so reading stops at the first entry older than what was already read
+        """
+        start = self.log_watermark - self.log_overlap_seconds
+        start_date = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).strftime("%m/%d/%Y")
+        end_date = datetime.datetime.now(datetime.timezone.utc).strftime("%m/%d/%Y")
+        newest = self.log_watermark
+        changes = {}
+        try:
+            for entry in self.quay_api.iter_logs(start_date, end_date):
+                try:
+                    entry_time = parsedate_to_datetime(entry["datetime"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if entry_time.tzinfo is None:
+                    entry_time = entry_time.replace(tzinfo=datetime.timezone.utc)
+                entry_time = entry_time.timestamp()
+                if entry_time < start:
+                    break
+                if entry.get("kind") not in self.push_kinds:
+                    continue
+                metadata = entry.get("metadata") or {}
+                namespace = metadata.get("namespace") or (entry.get("namespace") or {}).get("name")
+                if not namespace or not metadata.get("repo"):
+                    continue
+                key = json.dumps([entry["datetime"], entry["kind"], metadata], sort_keys=True, default=str)
+                if key in self.seen_entries:
+                    continue
+                self.seen_entries[key] = entry_time
+                newest = max(newest, entry_time)
+                repository = f"{namespace}/{metadata['repo']}"
+                if not metadata.get("tag") or changes.get(repository, set()) is None:
+                    # A push without a tag name in the metadata, check the whole repository
+                    changes[repository] = None
+                else:
+                    changes.setdefault(repository, set()).add(metadata["tag"])
+        except QuayAPIError:
+            # Older entries were not read, so the watermark stays where it was and the next poll reads them again.
+            # What was read is still queued, and seen_entries keeps it from being queued twice
+            for repository, tags in changes.items():
+                self.add_change(repository, tags, source="audit_log")
+            raise
+        self.log_watermark = newest
+        self.seen_entries = {key: seen for key, seen in self.seen_entries.items() if seen >= newest - self.log_overlap_seconds}
+        for repository, tags in changes.items():
+            self.add_change(repository, tags, source="audit_log")
+
+    def poll_loop(self) -> None:
+        """
+        Description:
+            Polls the audit log every poll_interval seconds until stop() is called
+        """
+        while not self.stop_requested.wait(self.poll_interval):
+            try:
+                with Metrics.timer("watcher_poll_seconds"):
+                    self.poll_audit_log()
+            except Exception as e:
+                logging.error(f"Could not read the audit log: {e}")
+
+    def request_handler(self):
+        """
+        Description:
+            Builds the BaseHTTPRequestHandler class that accepts Quay repository notifications
+        Returns:
+            type: The handler class for http.server
+        """
+        watcher = self
+
+        class NotificationHandler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook {self.address_string()} {format % args}")
+
+            def reply(self, status: int, message: str) -> None:
+                body = json.dumps({"message": message}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                token = parse_qs(urlsplit(self.path).query).get("token", [""])[0]
+                if watcher.webhook_token and not hmac.compare_digest(token, watcher.webhook_token):
+                    return self.reply(403, "Invalid token")
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    # expected payload example: {"repository": "org/repo", "namespace": "org", "name": "repo", "docker_url": "quay.example.com/org/repo", "updated_tags": ["latest"]}
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    repository = payload.get("repository") or f"{payload['namespace']}/{payload['name']}"
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    return self.reply(400, "Expected a Quay repository notification")
+                watcher.add_change(repository, payload.get("updated_tags") or None, source="webhook")
+                self.reply(202, "Queued")
+
+        return NotificationHandler
+
+    def start(self) -> None:
+        """
+        Description:
+            Starts the webhook listener and the audit log poller, whichever are turned on
+        """
+        if self.webhook_port is not None:
+            self.server = http.server.ThreadingHTTPServer((self.webhook_address, self.webhook_port), self.request_handler())
+            self.server.daemon_threads = True
+            self.threads.append(threading.Thread(target=self.server.serve_forever, name="watcher-webhook", daemon=True))
+            logging.info(f"Listening for Quay notifications on ---> http://{self.webhook_address}:{self.server.server_address[1]}/ <---")
+        if self.poll_interval and self.quay_api:
+            self.threads.append(threading.Thread(target=self.poll_loop, name="watcher-audit-log", daemon=True))
+            logging.info(f"Polling the audit log on ---> {self.quay_api.base_url} <--- every {self.poll_interval} seconds")
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Description:
+            Stops the listener and the poller and wakes up wait_for_changes()
+        """
+        self.stop_requested.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
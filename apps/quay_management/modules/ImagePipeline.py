@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from .Metrics import Metrics
+
+
+class ImagePipeline:
+    def __init__(self, engine, queue_depth: int = 2, pull_workers: int = 1, push_workers: int = 1) -> None:
+        """
+        Description:
+            Mirrors images through separate pull, tag and push stages joined by bounded queues, so the next
+            image is being pulled from the source while the last one is pushed to the destination and the
+            network is busy in both directions. The queue depth caps how many pulled images wait in local
+            storage between two stages. Used by MirrorEngine.run() in place of a ThreadPoolExecutor:
+            submit() returns a Future that resolves to the outcome of the image
+        Args:
+            engine (MirrorEngine): The engine whose backend, registry limits and sync state are used. The backend
+                                   must have pull_image(), tag_image(), push_image() and release_image(), like PodmanCopyBackend
+            queue_depth (int, optional): How many images can wait between two stages. Defaults to 2.
+            pull_workers (int, optional): Threads pulling images. Defaults to 1.
+            push_workers (int, optional): Threads pushing images. Defaults to 1.
+        """
+        self.engine = engine
+        self.queue_depth = max(1, queue_depth)
+        # None is put on a queue to stop one thread of the stage reading it
+        self.submitted = queue.Queue()
+        self.pulled = queue.Queue(maxsize=self.queue_depth)
+        self.tagged = queue.Queue(maxsize=self.queue_depth)
+        self.stages = [(self.submitted, self.start_threads("pull", self.pull_stage, max(1, pull_workers))),
+                       # Tagging only touches local storage, one thread keeps up with any number of pulls
+                       (self.pulled, self.start_threads("tag", self.tag_stage, 1)),
+                       (self.tagged, self.start_threads("push", self.push_stage, max(1, push_workers)))]
+
+    @staticmethod
+    def start_threads(stage: str, target, count: int) -> list:
+        threads = [threading.Thread(target=target, name=f"{stage}-{number}", daemon=True) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def submit(self, job: dict) -> Future:
+        """
+        Description:
+            Queues an image for the pull stage
+        Args:
+            job (dict): A job as described in MirrorEngine.mirror_image()
+        Returns:
+            Future: Resolves to "mirrored", "unchanged", "partial" or "failed". It can be cancelled until the pull starts
+        """
+        future = Future()
+        self.submitted.put((job, future))
+        return future
+
+    @staticmethod
+    def hand_off(stage: str, next_queue: queue.Queue, item: tuple) -> None:
+        """
+        Description:
+            Puts an image on the queue of the next stage, waiting while it is full. The time spent waiting
+            shows which stage is holding the pipeline up
+        Args:
+            stage (str): The stage handing the image off
+            next_queue (queue.Queue): The queue of the next stage
+            item (tuple): What the next stage needs to carry on with the image
+        """
+        start_time = time.perf_counter()
+        next_queue.put(item)
+        Metrics.observe("pipeline_stall_seconds", time.perf_counter() - start_time, stage=stage)
+
+    def pull_stage(self) -> None:
+        while (item := self.submitted.get()) is not None:
+            job, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                job["started"] = time.perf_counter()
+                results, pending = self.engine.pending_destinations(job)
+                if not pending:
+                    future.set_result(self.engine.record_copies(job, results, {}))
+                    continue
+                source_limit = self.engine.registry_limit(self.engine.registry_from_image(job["image_source"]), "source")
+                if not self.engine.backend.pull_image(job, source_limit):
+                    future.set_result(self.engine.record_copies(job, results, {image_destination: False for image_destination in pending}))
+                    continue
+                self.hand_off("pull", self.pulled, (job, future, results, pending))
+            except Exception as e:
+                future.set_exception(e)
+
+    def tag_stage(self) -> None:
+        while (item := self.pulled.get()) is not None:
+            job, future, results, pending = item
+            try:
+                copied = {image_destination: False for image_destination in pending if not self.engine.backend.tag_image(job, image_destination)}
+                self.hand_off("tag", self.tagged, (job, future, results, [image_destination for image_destination in pending if image_destination not in copied], copied))
+            except Exception as e:
+                self.release(job)
+                future.set_exception(e)
+
+    def push_stage(self) -> None:
+        while (item := self.tagged.get()) is not None:
+            job, future, results, tagged, copied = item
+            try:
+                def push_to(image_destination):
+                    destination_limit = self.engine.registry_limit(self.engine.registry_from_image(image_destination), "destination")
+                    return self.engine.backend.push_image(job, image_destination, destination_limit)
+
+                if len(tagged) > 1:
+                    # Each destination is pushed on its own thread so a slow one does not delay the others
+                    with ThreadPoolExecutor(max_workers=len(tagged), thread_name_prefix="push-destination") as executor:
+                        copied.update(zip(tagged, executor.map(push_to, tagged)))
+                else:
+                    copied.update((image_destination, push_to(image_destination)) for image_destination in tagged)
+                self.release(job)
+                future.set_result(self.engine.record_copies(job, results, copied))
+            except Exception as e:
+                self.release(job)
+                future.set_exception(e)
+
+    def release(self, job: dict) -> None:
+        """
+        Description:
+            Tells the backend an image is done with every destination so it can be removed from local storage
+        Args:
+            job (dict): A job as described in MirrorEngine.mirror_image()
+        """
+        try:
+            self.engine.backend.release_image(job)
+        except Exception as e:
+            logging.warning(f"Could not release ---> {job['image_source']} <--- from local storage: {e}")
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        """
+        Description:
+            Stops the stages one after the other once the images already in them have been pushed.
+            Like ThreadPoolExecutor.shutdown(), but it always waits
+        Args:
+            wait (bool, optional): Kept for compatibility with ThreadPoolExecutor.shutdown(). Defaults to True.
+            cancel_futures (bool, optional): Cancel images that have not started to be pulled. Defaults to False.
+        """
+        if cancel_futures:
+            while True:
+                try:
+                    item = self.submitted.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[1].cancel()
+        for stage_queue, threads in self.stages:
+            for _ in threads:
+                stage_queue.put(None)
+            for thread in threads:
+                thread.join()
+        logging.debug("Image pipeline stopped")
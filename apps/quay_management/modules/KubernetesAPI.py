@@ -0,0 +1,752 @@
+import atexit
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import requests
+import yaml
+from .BaseOperations import BaseOperations
+from .Metrics import Metrics
+from .OpenShiftOperations import OpenShiftCommands
+
+
+class KubernetesAPI(OpenShiftCommands):
+    # A drop in replacement for OpenShiftCommands which talks to the API server directly instead of starting
+    # an `oc` process for every call. Each cluster gets one authenticated session reused by every call, so
+    # polling and watching do not re-read the kubeconfig or redo TLS. The wait methods are inherited and use
+    # the API watch below. Exec and file transfer need a streaming protocol (websockets/SPDY) so those still
+    # run `oc`, with a kubeconfig holding this session's token
+
+    # The name recorded against every field this program sets with server-side apply
+    field_manager = "quay-management"
+    # One connection per kubeconfig (None is the default login) so several clusters can be used at once
+    connections = {}
+    connections_lock = threading.Lock()
+    verify_tls = True
+    max_connections = 32
+    # A private directory (mode 0700) for the certificates, keys and kubeconfigs with tokens this class has to
+    # write for requests and `oc`. Created on first use and removed when the program exits
+    temp_dir = None
+
+    @classmethod
+    def configure(cls, skip_tls_verify: bool = False, max_connections: int = 32) -> None:
+        """
+        Description:
+            Sets the options used for connections that have not been opened yet
+        Args:
+            skip_tls_verify (bool, optional): Do not verify the API server certificate. Defaults to False.
+            max_connections (int, optional): The size of the connection pool for each cluster. Defaults to 32.
+        """
+        cls.verify_tls = not skip_tls_verify
+        cls.max_connections = max_connections
+
+    @classmethod
+    def private_temp_dir(cls) -> str:
+        """
+        Description:
+            Gets the private directory credentials are written to, creating it the first time
+        Returns:
+            str: The path to the directory
+        """
+        with cls.connections_lock:
+            if not cls.temp_dir:
+                cls.temp_dir = tempfile.mkdtemp(prefix="quay_management_")
+                atexit.register(cls.remove_temp_dir)
+            return cls.temp_dir
+
+    @classmethod
+    def remove_temp_dir(cls) -> None:
+        """
+        Description:
+            Removes the private directory along with every credential written to it
+        """
+        with cls.connections_lock:
+            temp_dir, cls.temp_dir = cls.temp_dir, None
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @classmethod
+    def new_session(cls) -> requests.Session:
+        """
+        Description:
+            Creates a session with a connection pool large enough for concurrent manifests and watches
+        Returns:
+            requests.Session: The new session
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=cls.max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.verify = cls.verify_tls
+        return session
+
+    @classmethod
+    def openshift_login(cls, api_url: str, username: str, passwd: str, kubeconfig: str = None) -> None:
+        """
+        Description:
+            Logs into the OpenShift Cluster with username and password using the OAuth server's challenge flow
+            (the same flow `oc login` uses) and keeps the token on a session for every later call
+        Args:
+            api_url (str): The url including protocol (http/https) and port are expected
+            username (str): OpenShift cluster admin user
+            passwd (str): OpenShift cluster admin password
+            kubeconfig (str, optional): Also write the login to this kubeconfig, which must not exist yet, and use it
+                                        to tell several clusters apart. Defaults to None.
+        """
+        api_url = api_url.rstrip("/")
+        session = cls.new_session()
+        try:
+            oauth_server = session.get(f"{api_url}/.well-known/oauth-authorization-server", timeout=30)
+            oauth_server.raise_for_status()
+            response = session.get(oauth_server.json()["authorization_endpoint"],
+                                   params={"response_type": "token", "client_id": "openshift-challenging-client"},
+                                   auth=(username, passwd),
+                                   headers={"X-CSRF-Token": "1"},
+                                   allow_redirects=False,
+                                   timeout=30)
+            token = parse_qs(urlsplit(response.headers.get("Location", "")).fragment)["access_token"][0]
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            logging.critical(f"Failed to log into {api_url}: {e}")
+            exit(1)
+        session.headers.update({"Authorization": f"Bearer {token}"})
+        connection = {"server": api_url, "session": session, "token": token, "kubeconfig_file": kubeconfig, "resources": {}, "groups": None}
+        if kubeconfig:
+            cls.write_kubeconfig(connection, kubeconfig)
+        with cls.connections_lock:
+            cls.connections[kubeconfig] = connection
+
+    @classmethod
+    def load_kubeconfig(cls, kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Builds a connection from the current context of an existing kubeconfig. Used when nothing has
+            logged in through this class, for example after a plain `oc login`
+        Args:
+            kubeconfig (str, optional): The kubeconfig to read. Defaults to $KUBECONFIG or ~/.kube/config.
+        Returns:
+            dict: The connection
+        """
+        kubeconfig_path = kubeconfig or os.environ.get("KUBECONFIG", "").split(os.pathsep)[0] or os.path.expanduser("~/.kube/config")
+        config = BaseOperations.load_config(config_file=kubeconfig_path)
+        context = next(item["context"] for item in config["contexts"] if item["name"] == config["current-context"])
+        cluster = next(item["cluster"] for item in config["clusters"] if item["name"] == context["cluster"])
+        user = next((item["user"] for item in config.get("users", []) if item["name"] == context.get("user")), {})
+        session = cls.new_session()
+
+        def data_file(data: str) -> str:
+            # requests can only read certificates from files
+            file_descriptor, path = tempfile.mkstemp(dir=cls.private_temp_dir())
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(base64.b64decode(data))
+            return path
+
+        if cluster.get("insecure-skip-tls-verify"):
+            session.verify = False
+        elif cluster.get("certificate-authority-data"):
+            session.verify = data_file(cluster["certificate-authority-data"])
+        elif cluster.get("certificate-authority"):
+            session.verify = cluster["certificate-authority"]
+        if user.get("token"):
+            session.headers.update({"Authorization": f"Bearer {user['token']}"})
+        elif user.get("client-certificate-data"):
+            session.cert = (data_file(user["client-certificate-data"]), data_file(user["client-key-data"]))
+        elif user.get("client-certificate"):
+            session.cert = (user["client-certificate"], user["client-key"])
+        return {"server": cluster["server"].rstrip("/"), "session": session, "token": user.get("token"),
+                "kubeconfig_file": kubeconfig_path, "resources": {}, "groups": None}
+
+    @staticmethod
+    def write_kubeconfig(connection: dict, kubeconfig: str) -> None:
+        """
+        Description:
+            Writes a kubeconfig holding the session's token so `oc` can be used for exec and file transfer
+        Args:
+            connection (dict): The connection to write
+            kubeconfig (str): Where to write it. The file must not exist yet
+        """
+        cluster = {"server": connection["server"]}
+        if connection["session"].verify is False:
+            cluster["insecure-skip-tls-verify"] = True
+        config = {"apiVersion": "v1", "kind": "Config", "current-context": "quay-management",
+                  "clusters": [{"name": "quay-management", "cluster": cluster}],
+                  "users": [{"name": "quay-management", "user": {"token": connection["token"]}}],
+                  "contexts": [{"name": "quay-management", "context": {"cluster": "quay-management", "user": "quay-management"}}]}
+        # The token is a credential so only the current user can read the file, and an existing file or
+        # symlink someone else put there is never written through
+        file_descriptor = os.open(kubeconfig, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(file_descriptor, "w") as file:
+            file.write(yaml.dump(config))
+
+    @classmethod
+    def connection(cls, kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Gets the connection for a cluster, loading it from the kubeconfig the first time it is used
+        Args:
+            kubeconfig (str, optional): The kubeconfig the connection was logged in with. Defaults to None.
+        Returns:
+            dict: {"server": <str>, "session": <requests.Session>, "token": <str>, "kubeconfig_file": <str>, "resources": <dict>, "groups": <list>}
+        """
+        with cls.connections_lock:
+            if kubeconfig not in cls.connections:
+                cls.connections[kubeconfig] = cls.load_kubeconfig(kubeconfig)
+            return cls.connections[kubeconfig]
+
+    @classmethod
+    def api_request(cls, method: str, path: str, kubeconfig: str = None, **kwargs) -> requests.Response:
+        """
+        Description:
+            Sends a request to the API server over the cluster's session
+        Args:
+            method (str): The HTTP method
+            path (str): The path starting with /api or /apis
+            kubeconfig (str, optional): Which cluster to send the request to. Defaults to None.
+            Any other keyword arguments are passed to requests
+        Returns:
+            requests.Response: The response
+        """
+        connection = cls.connection(kubeconfig)
+        kwargs.setdefault("timeout", 60)
+        with Metrics.timer("kubernetes_api_request_seconds", method=method, resource=cls.resource_name(path)):
+            return connection["session"].request(method, f"{connection['server']}{path}", **kwargs)
+
+    @staticmethod
+    def resource_name(path: str) -> str:
+        """
+        Description:
+            Finds the resource a request path is for so metrics are grouped by resource rather than by object
+        Args:
+            path (str): The path starting with /api or /apis
+        Returns:
+            str: For example pods or secrets. "discovery" for requests about the API itself
+        """
+        segments = [segment for segment in path.split("?")[0].split("/") if segment]
+        # /api/<version>/... or /apis/<group>/<version>/...
+        segments = segments[2:] if segments[:1] == ["api"] else segments[3:]
+        if segments[:1] == ["namespaces"] and len(segments) > 2:
+            segments = segments[2:]
+        return segments[0] if segments else "discovery"
+
+    @staticmethod
+    def api_prefix(api_version: str) -> str:
+        """
+        Description:
+            Returns the path for an apiVersion. The core group lives under /api, everything else under /apis
+        Args:
+            api_version (str): For example v1 or apps/v1
+        Returns:
+            str: For example /api/v1 or /apis/apps/v1
+        """
+        if "/" in api_version:
+            return f"/apis/{api_version}"
+        return f"/api/{api_version}"
+
+    @classmethod
+    def api_resources(cls, api_version: str, kubeconfig: str = None) -> list:
+        """
+        Description:
+            Gets (and caches) the resources served by a group version
+        Args:
+            api_version (str): For example v1 or apps/v1
+            kubeconfig (str, optional): Which cluster to ask. Defaults to None.
+        Returns:
+            list: The resources, each with the apiVersion added. Subresources such as pods/exec are left out
+        """
+        connection = cls.connection(kubeconfig)
+        if api_version not in connection["resources"]:
+            response = cls.api_request("GET", cls.api_prefix(api_version), kubeconfig=kubeconfig)
+            resources = []
+            if response.ok:
+                for resource in response.json().get("resources", []):
+                    if "/" in resource["name"]:
+                        continue
+                    resource["apiVersion"] = api_version
+                    resources.append(resource)
+            connection["resources"][api_version] = resources
+        return connection["resources"][api_version]
+
+    @classmethod
+    def find_resource(cls, object_type: str = None, kind: str = None, api_version: str = None, kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Works out which API resource an `oc get` style object type (pods, svc, csv, quayregistry...) or a
+            manifest's kind and apiVersion refers to. Discovery results are cached so this only costs requests
+            the first time a group is needed. Groups are looked up again once in case a CRD was just installed
+        Args:
+            object_type (str, optional): The name, singular name or short name of the resource. Defaults to None.
+            kind (str, optional): The kind from a manifest. Defaults to None.
+            api_version (str, optional): The apiVersion from a manifest. Defaults to None.
+            kubeconfig (str, optional): Which cluster to ask. Defaults to None.
+        Returns:
+            dict: The API resource with "name", "kind", "namespaced" and "apiVersion"
+        """
+        connection = cls.connection(kubeconfig)
+
+        def matches(resource):
+            if kind:
+                return resource["kind"] == kind
+            names = {resource["name"], resource.get("singularName") or resource["kind"].lower(), resource["kind"].lower()}
+            names.update(resource.get("shortNames", []))
+            return object_type.lower() in names
+
+        for attempt in range(2):
+            if api_version:
+                api_versions = [api_version]
+                if attempt:
+                    connection["resources"].pop(api_version, None)
+            else:
+                if connection["groups"] is None or attempt:
+                    groups = cls.api_request("GET", "/apis", kubeconfig=kubeconfig).json().get("groups", [])
+                    connection["groups"] = ["v1"] + [group["preferredVersion"]["groupVersion"] for group in groups]
+                    if attempt:
+                        connection["resources"].clear()
+                api_versions = connection["groups"]
+            for group_version in api_versions:
+                for resource in cls.api_resources(group_version, kubeconfig=kubeconfig):
+                    if matches(resource):
+                        return resource
+        raise LookupError(f"The API server does not serve {kind or object_type} {api_version or ''}".strip())
+
+    @classmethod
+    def resource_path(cls, resource: dict, namespace: str = None, name: str = None) -> str:
+        """
+        Description:
+            Builds the path for a resource, a namespace and optionally an object name
+        Args:
+            resource (dict): The API resource from find_resource()
+            namespace (str, optional): Ignored for cluster scoped resources. Defaults to None (all namespaces).
+            name (str, optional): The object name. Defaults to None (the collection).
+        Returns:
+            str: The path
+        """
+        path = cls.api_prefix(resource["apiVersion"])
+        if resource["namespaced"] and namespace:
+            path += f"/namespaces/{namespace}"
+        path += f"/{resource['name']}"
+        if name:
+            path += f"/{name}"
+        return path
+
+    @staticmethod
+    def field_selector(**kwargs) -> str:
+        """
+        Description:
+            Combines the object name and field_selector kwargs into one field selector for the API server
+        Args:
+            Takes the same **kwargs as openshift_get_object
+        Returns:
+            str: The field selector, empty if there is nothing to select on
+        """
+        selectors = []
+        if kwargs.get("object_name"):
+            selectors.append(f"metadata.name={kwargs['object_name']}")
+        if kwargs.get("field_selector"):
+            selectors.append(kwargs["field_selector"])
+        return ",".join(selectors)
+
+    @classmethod
+    def list_objects(cls, **kwargs) -> dict:
+        """
+        Description:
+            Lists objects the way `oc get` does. The items get their kind and apiVersion back
+        Args:
+            Takes the same **kwargs as openshift_get_object
+        Returns:
+            dict: {"apiVersion": "v1", "kind": "List", "items": [...], "metadata": {"resourceVersion": <str>}}
+        """
+        kubeconfig = kwargs.get("kubeconfig")
+        resource = cls.find_resource(object_type=kwargs["object_type"], kubeconfig=kubeconfig)
+        params = {}
+        if kwargs.get("label"):
+            params["labelSelector"] = kwargs["label"]
+        field_selector = cls.field_selector(**kwargs)
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        response = cls.api_request("GET", cls.resource_path(resource, kwargs.get("namespace")), kubeconfig=kubeconfig, params=params)
+        response.raise_for_status()
+        listing = response.json()
+        for item in listing.get("items", []):
+            item.setdefault("kind", resource["kind"])
+            item.setdefault("apiVersion", resource["apiVersion"])
+        return {"apiVersion": "v1", "kind": "List", "items": listing.get("items", []), "metadata": listing.get("metadata", {})}
+
+    @classmethod
+    def openshift_get_json(cls, **kwargs) -> dict:
+        """
+        Description:
+            Gets an object from openshift already parsed, the same dict `oc get -o json` would print
+        Args:
+            Takes the same **kwargs as openshift_get_object except output
+        Returns:
+            dict: The object, or {"items": [...]} when listing
+        """
+        kubeconfig = kwargs.get("kubeconfig")
+        if kwargs.get("object_name") and not kwargs.get("label") and not kwargs.get("field_selector"):
+            resource = cls.find_resource(object_type=kwargs["object_type"], kubeconfig=kubeconfig)
+            response = cls.api_request("GET", cls.resource_path(resource, kwargs.get("namespace"), kwargs["object_name"]), kubeconfig=kubeconfig)
+            response.raise_for_status()
+            return response.json()
+        result = cls.list_objects(**kwargs)
+        result["metadata"] = {"resourceVersion": ""}
+        return result
+
+    @classmethod
+    def openshift_get_object(cls, **kwargs):
+        """
+        Description:
+            Gets an object from openshift and returns the same bytes `oc get` would print
+
+        Args:
+            Takes **kwargs but current expects
+            object_type: usually pod, node, secret etc
+            object_name: the name of the object if required/known
+            label: A label used to identify the correct object
+            field_selector: A field selector such as status.phase=Running (if any)
+            namespace: The namespace where the object resides (if any)
+            output: The output format, json or yaml. Defaults to json
+            kubeconfig: Which cluster to ask (if any)
+        """
+        result = cls.openshift_get_json(**kwargs)
+        if kwargs.get("output", "json") == "yaml":
+            return yaml.dump(result).encode()
+        return json.dumps(result, indent=4).encode()
+
+    @classmethod
+    def does_secret_exist(cls, secret_name: str = None, namespace: str = None, kubeconfig: str = None) -> bool:
+        """
+        Description:
+            Checks to see if a secret exists in the cluster
+        Args:
+            secret_name (str, optional): The name of the secret to look for. Defaults to None.
+            namespace (str, optional): The namespace to look for the secret within. Defaults to "default".
+            kubeconfig (str, optional): Which cluster to ask. Defaults to None.
+        Returns:
+            bool: True if the secret exists, false if it does not
+        """
+        response = cls.api_request("GET", f"/api/v1/namespaces/{namespace or 'default'}/secrets/{secret_name}", kubeconfig=kubeconfig)
+        return response.status_code == 200
+
+    @classmethod
+    def apply_manifest(cls, manifest: dict, namespace: str = None, kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Creates or updates a single object with server-side apply. Conflicting fields are taken over
+            the same way `oc apply --server-side --force-conflicts` does
+        Args:
+            manifest (dict): The object to apply
+            namespace (str, optional): The namespace for objects that do not set one. Defaults to "default".
+            kubeconfig (str, optional): Which cluster to apply to. Defaults to None.
+        Returns:
+            dict: The object as stored by the API server
+        """
+        resource = cls.find_resource(kind=manifest["kind"], api_version=manifest["apiVersion"], kubeconfig=kubeconfig)
+        namespace = manifest["metadata"].get("namespace") or namespace or "default"
+        response = cls.api_request("PATCH", cls.resource_path(resource, namespace, manifest["metadata"]["name"]),
+                                   kubeconfig=kubeconfig,
+                                   params={"fieldManager": cls.field_manager, "force": "true"},
+                                   headers={"Content-Type": "application/apply-patch+yaml"},
+                                   data=json.dumps(manifest))
+        if not response.ok:
+            raise RuntimeError(f"{manifest['kind']}/{manifest['metadata']['name']} was rejected: {response.status_code} {response.text}")
+        return response.json()
+
+    @staticmethod
+    def load_manifests(file_path: str) -> list:
+        """
+        Description:
+            Loads every object from a manifest file. Files can hold several documents and List objects
+        Args:
+            file_path (str): The full path to the manifest
+        Returns:
+            list: The objects in the file
+        """
+        with open(file_path, "r") as file:
+            documents = list(yaml.load_all(file, Loader=BaseOperations.yaml_loader))
+        manifests = []
+        for document in documents:
+            if not isinstance(document, dict) or "kind" not in document:
+                continue
+            if document["kind"] == "List":
+                manifests.extend(document.get("items", []))
+            else:
+                manifests.append(document)
+        return manifests
+
+    @classmethod
+    def openshift_apply_file(cls, file_path: str = None, namespace: str = None, kubeconfig: str = None):
+        """
+        Description:
+            Uses server-side apply to create or modify the OpenShift objects in a file
+        Args:
+            file_path (str, optional): The full path to the file to apply to the cluster. Defaults to None.
+            namespace (str, optional): Which namespace to apply the resources to. Defaults to None.
+            kubeconfig (str, optional): Which cluster to apply to. Defaults to None.
+        """
+        try:
+            for manifest in cls.load_manifests(file_path):
+                cls.apply_manifest(manifest, namespace=namespace, kubeconfig=kubeconfig)
+        except Exception as e:
+            logging.critical(f"Failed to apply ---> {file_path}: {e}")
+            logging.critical("Aborting")
+            exit(1)
+
+    @classmethod
+    def openshift_apply_directory(cls, directory: str = None, namespace: str = None, kubeconfig: str = None, max_workers: int = 8) -> None:
+        """
+        Description:
+            Server-side applies every manifest in a directory (and its subdirectories) as one batch over the
+            shared session. Namespaces and CRDs go first since the other objects may need them, then
+            everything else is sent at the same time. Nothing waits for the objects to become ready
+        Args:
+            directory (str, optional): The directory with the manifests. Defaults to None.
+            namespace (str, optional): Which namespace to apply resources without a namespace to. Defaults to None.
+            kubeconfig (str, optional): Which cluster to apply to. Defaults to None.
+            max_workers (int, optional): How many objects are applied at the same time. Defaults to 8.
+        """
+        manifests = []
+        for file_path in BaseOperations.yaml_file_list(directory):
+            if file_path.endswith((".yaml", ".yml", ".json")):
+                manifests.extend(cls.load_manifests(file_path))
+        first = [manifest for manifest in manifests if manifest["kind"] in ("Namespace", "CustomResourceDefinition")]
+        rest = [manifest for manifest in manifests if manifest["kind"] not in ("Namespace", "CustomResourceDefinition")]
+        start_time = time.perf_counter()
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="apply") as executor:
+            for batch in (first, rest):
+                futures = {executor.submit(cls.apply_manifest, manifest, namespace, kubeconfig): manifest for manifest in batch}
+                for future, manifest in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures.append(f"{manifest['kind']}/{manifest['metadata']['name']}: {e}")
+                if failures:
+                    break
+        if failures:
+            for failure in failures:
+                logging.critical(f"Failed to apply ---> {failure}")
+            logging.critical("Aborting")
+            exit(1)
+        logging.info(f"Applied {len(manifests)} objects from {directory} in {time.perf_counter() - start_time:.1f} seconds")
+
+    @classmethod
+    def openshift_create_secret(cls, file_path: str, namespace: str = None, secret_name: str = "init-config-bundle-secret", secret_type: str = "generic", kubeconfig: str = None):
+        """
+        Description:
+            Creates a secret from a file. The initial intent is to create the `init-config-bundle-secret`
+        Args:
+            file_path (str): The full path to the file to apply to the cluster
+            namespace (str, optional): Which namespace to apply the resources to. Defaults to None.
+            secret_name (str, optional): Name of the secret. Defaults to init-config-bundle-secret.
+            secret_type (str, optional): The type of secret to be created. Only generic is supported. Defaults to generic.
+            kubeconfig (str, optional): Which cluster to create the secret in. Defaults to None.
+        """
+        if cls.does_secret_exist(secret_name=secret_name, namespace=namespace, kubeconfig=kubeconfig):
+            logging.error(f"The secret {secret_name} already exists!")
+            return
+        logging.info(f"The secret {secret_name} does not currently exist... creating")
+        key = "config.yaml" if secret_name == "init-config-bundle-secret" else os.path.basename(file_path)
+        response = cls.api_request("POST", f"/api/v1/namespaces/{namespace or 'default'}/secrets", kubeconfig=kubeconfig,
+                                   json=cls.secret_from_file(file_path, secret_name, key))
+        response.raise_for_status()
+
+    @staticmethod
+    def secret_from_file(file_path: str, secret_name: str, key: str = "config.yaml") -> dict:
+        """
+        Description:
+            Builds an Opaque secret holding a file, like `oc create secret generic --from-file`
+        Args:
+            file_path (str): The file to put in the secret
+            secret_name (str): The name of the secret
+            key (str, optional): The key the file is stored under. Defaults to "config.yaml".
+        Returns:
+            dict: The secret
+        """
+        with open(file_path, "rb") as file:
+            data = base64.b64encode(file.read()).decode()
+        return {"apiVersion": "v1", "kind": "Secret", "type": "Opaque", "metadata": {"name": secret_name}, "data": {key: data}}
+
+    @classmethod
+    def openshift_replace_quay_init_secret(cls, full_path_to_file: str = None, secret_name: str = None, namespace: str = "quay", kubeconfig: str = None):
+        """
+        Description:
+            Replaces a secret with the contents of a file stored under config.yaml
+        Args:
+            full_path_to_file (str, optional): The path to the secret file with updated contents
+            secret_name (str, optional): The name of the secret in OpenShift to replace
+            namespace (str, optional): The namespace of the secret. Defaults to "quay".
+            kubeconfig (str, optional): Which cluster the secret is in. Defaults to None.
+        Returns:
+            Nothing. This method performs an action with no returns
+        """
+        secret = cls.secret_from_file(full_path_to_file, secret_name)
+        secret["metadata"]["namespace"] = namespace
+        response = cls.api_request("PUT", f"/api/v1/namespaces/{namespace}/secrets/{secret_name}", kubeconfig=kubeconfig, json=secret)
+        if not response.ok:
+            logging.critical(f"Failed to replace the secret {secret_name}: {response.status_code} {response.text}")
+            exit(1)
+
+    @classmethod
+    def openshift_delete_object(cls, object_type: str = "pods", namespace: str = "quay", label: str = "quay-component=quay-app", grace_period: str = None, kubeconfig: str = None) -> None:
+        """
+        Description:
+            Used to delete objects in OpenShift. Every matching object is deleted with one request.
+            A label is required, like `oc delete` which will not delete a whole type without a name or selector
+        Args:
+            object_type (str, optional): The type of object to be deleted. Defaults to "pods".
+            namespace (str, optional): The namespace where an object resides. Defaults to "quay".
+            label (str, optional): The label to match. Defaults to "quay-component=quay-app".
+            grace_period (int): If you want to make sure the pods die more quickly you can set grace_period=0
+            kubeconfig (str, optional): Which cluster to delete from. Defaults to None.
+        """
+        if not label:
+            logging.critical(f"Refusing to delete every {object_type} in {namespace}... a label is required")
+            exit(1)
+        resource = cls.find_resource(object_type=object_type, kubeconfig=kubeconfig)
+        params = {"labelSelector": label}
+        if grace_period != None:
+            params["gracePeriodSeconds"] = grace_period
+        logging.debug(f"Deleting {object_type} in {namespace} matching {params}")
+        response = cls.api_request("DELETE", cls.resource_path(resource, namespace), kubeconfig=kubeconfig, params=params)
+        response.raise_for_status()
+
+    @classmethod
+    def openshift_watch(cls, is_ready, timeout: int = 600, retry_delay: int = 5, **kwargs) -> bool:
+        """
+        Description:
+            Lists the objects, then follows the API watch from that point and returns as soon as is_ready() is True.
+            The objects are handed to is_ready() in the same {"items": [...]} form `oc get -o yaml` returns.
+            If the watch ends early, expires or the object type does not exist yet it is started again until the deadline
+        Args:
+            is_ready (callable): Takes {"items": [<object>]} and returns True when waiting can stop
+            timeout (int, optional): Seconds to wait before giving up. Defaults to 600.
+            retry_delay (int, optional): Seconds to wait before restarting a failed watch. Defaults to 5.
+            Takes the same **kwargs as openshift_get_object
+        Returns:
+            bool: True if is_ready() returned True before the deadline
+        """
+        deadline = time.monotonic() + timeout
+        kubeconfig = kwargs.get("kubeconfig")
+
+        def object_key(watched_object):
+            return watched_object.get('metadata', {}).get('uid') or watched_object.get('metadata', {}).get('name')
+
+        while time.monotonic() < deadline:
+            try:
+                listing = cls.list_objects(**kwargs)
+                items = {object_key(item): item for item in listing["items"]}
+                if is_ready({"items": list(items.values())}):
+                    return True
+                resource = cls.find_resource(object_type=kwargs["object_type"], kubeconfig=kubeconfig)
+                remaining = deadline - time.monotonic()
+                params = {"watch": "true", "allowWatchBookmarks": "true",
+                          "resourceVersion": listing["metadata"].get("resourceVersion", ""),
+                          "timeoutSeconds": max(1, int(remaining))}
+                if kwargs.get("label"):
+                    params["labelSelector"] = kwargs["label"]
+                field_selector = cls.field_selector(**kwargs)
+                if field_selector:
+                    params["fieldSelector"] = field_selector
+                with cls.api_request("GET", cls.resource_path(resource, kwargs.get("namespace")), kubeconfig=kubeconfig,
+                                     params=params, stream=True, timeout=(30, max(1, remaining))) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        watched_object = event.get('object', {})
+                        if event.get('type') == "ERROR":
+                            # Usually 410 Gone because the resourceVersion is too old... list again
+                            break
+                        if event.get('type') == "DELETED":
+                            items.pop(object_key(watched_object), None)
+                        elif event.get('type') in ("ADDED", "MODIFIED"):
+                            items[object_key(watched_object)] = watched_object
+                        else:
+                            continue
+                        if is_ready({"items": list(items.values())}):
+                            return True
+                        if time.monotonic() >= deadline:
+                            return False
+            except (requests.exceptions.RequestException, LookupError, ValueError) as e:
+                logging.debug(f"The watch on {kwargs.get('object_type')} failed: {e}")
+            logging.debug(f"The watch on {kwargs.get('object_type')} ended... restarting")
+            time.sleep(max(0, min(retry_delay, deadline - time.monotonic())))
+        return False
+
+    @classmethod
+    def exec_kubeconfig(cls, kubeconfig: str = None) -> str:
+        """
+        Description:
+            Gets a kubeconfig `oc` can use with this connection's credentials, writing one to the private
+            temporary directory if the login did not write one
+        Args:
+            kubeconfig (str, optional): Which cluster. Defaults to None.
+        Returns:
+            str: The path to the kubeconfig
+        """
+        connection = cls.connection(kubeconfig)
+        with cls.connections_lock:
+            kubeconfig_file = connection["kubeconfig_file"]
+        if not kubeconfig_file:
+            kubeconfig_file = os.path.join(cls.private_temp_dir(), f"{uuid.uuid4().hex}.kubeconfig")
+            cls.write_kubeconfig(connection, kubeconfig_file)
+            with cls.connections_lock:
+                # Another thread may have written one at the same time, the spare one goes with the directory
+                kubeconfig_file = connection["kubeconfig_file"] = connection["kubeconfig_file"] or kubeconfig_file
+        return kubeconfig_file
+
+    @classmethod
+    def openshift_exec_pod(cls, command: list = None, pod_name: str = None, namespace: str = None, kubeconfig: str = None):
+        """
+        Description:
+            Execs into a pod to run a command. This runs `oc exec` with the session's credentials
+        Args:
+            command (list, optional): A command broken into a list that subprocess can recognize. Defaults to None.
+            pod_name (str, optional): Name of the pod to exec into. Defaults to None.
+            namespace (str, optional): Namespace where the pod resides. Defaults to None.
+            kubeconfig (str, optional): Which cluster the pod is in. Defaults to None.
+        Returns:
+            the response from subprocess
+        """
+        return OpenShiftCommands.openshift_exec_pod(command=command, pod_name=pod_name, namespace=namespace, kubeconfig=cls.exec_kubeconfig(kubeconfig))
+
+    @classmethod
+    def openshift_exec_pod_script(cls, script: str = None, pod_name: str = None, namespace: str = None,
+                                  interpreter: str = "/usr/bin/python", kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Pipes a python script into a pod over stdin. This runs `oc exec` with the session's credentials
+        Args:
+            script (str, optional): The python script to run. Defaults to None.
+            pod_name (str, optional): Name of the pod to exec into. Defaults to None.
+            namespace (str, optional): Namespace where the pod resides. Defaults to None.
+            interpreter (str, optional): The python inside the pod. Defaults to "/usr/bin/python".
+            kubeconfig (str, optional): Which cluster the pod is in. Defaults to None.
+        Returns:
+            dict: The JSON printed by the script
+        """
+        return OpenShiftCommands.openshift_exec_pod_script(script=script, pod_name=pod_name, namespace=namespace,
+                                                           interpreter=interpreter, kubeconfig=cls.exec_kubeconfig(kubeconfig))
+
+    @classmethod
+    def openshift_transfer_file(cls, remote_filename: str = "/tmp/generic.py", filename: str = None, namespace: str = None,
+                                pod_name: str = None, kubeconfig: str = None):
+        """
+        Description:
+            Transfers a file to a pod. This runs `oc cp` with the session's credentials
+        Args:
+            remote_filename (str, optional): The location within the pod to create the file. Defaults to "/tmp/generic.py".
+            filename (str, optional): The path to the local file you intend to transfer. Defaults to None.
+            namespace (str, optional): Namespace where the pod resides. Defaults to None.
+            pod_name (str, optional): Name of the pod to transfer files to. Defaults to None.
+            kubeconfig (str, optional): Which cluster the pod is in. Defaults to None.
+        """
+        return OpenShiftCommands.openshift_transfer_file(remote_filename=remote_filename, filename=filename, namespace=namespace,
+                                                         pod_name=pod_name, kubeconfig=cls.exec_kubeconfig(kubeconfig))
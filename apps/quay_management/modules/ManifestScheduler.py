@@ -0,0 +1,176 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .BaseOperations import BaseOperations
+
+
+class ManifestScheduler:
+    # Lists extra dependencies as a comma separated list of <Kind>/<name> or <Kind>/<namespace>/<name>
+    depends_on_annotation = "quay-management/depends-on"
+    # Kinds that are built into OpenShift. Anything else is treated as a custom resource provided by an operator
+    builtin_kinds = {"Namespace", "OperatorGroup", "Subscription", "ConfigMap", "Secret", "MachineSet",
+                     "Console", "Service", "Deployment", "ServiceAccount", "Role", "RoleBinding",
+                     "ClusterRole", "ClusterRoleBinding", "CatalogSource", "MachineConfig"}
+    # Subscriptions in this namespace install operators that watch every namespace
+    global_operator_namespace = "openshift-operators"
+
+    def __init__(self, manifest_files: list, max_workers: int = 4) -> None:
+        """
+        Description:
+            Works out the dependencies between a set of OpenShift manifests so independent manifests can be
+            applied at the same time. A manifest depends on:
+                - the Namespace it lives in
+                - the OperatorGroup in its namespace, if it is a Subscription
+                - the Subscriptions in its namespace (or in openshift-operators), if it is a custom resource
+                - anything listed in its quay-management/depends-on annotation
+        Args:
+            manifest_files (list): Full paths to the manifests, probably from BaseOperations.yaml_file_list()
+            max_workers (int, optional): How many manifests can be applied at the same time. Defaults to 4.
+        """
+        self.max_workers = max(1, max_workers)
+        self.manifests = {}
+        for manifest_file in manifest_files:
+            manifest = BaseOperations.load_config(config_file=manifest_file)
+            if not isinstance(manifest, dict) or "kind" not in manifest:
+                logging.warning(f"Skipping ---> {manifest_file} <--- because it is not a Kubernetes manifest")
+                continue
+            self.manifests[manifest_file] = manifest
+        self.dependencies = {manifest_file: self.find_dependencies(manifest_file) for manifest_file in self.manifests}
+
+    @staticmethod
+    def manifest_reference(manifest: dict) -> tuple:
+        """
+        Description:
+            Identifies a manifest by kind, namespace and name
+        Args:
+            manifest (dict): The loaded manifest
+        Returns:
+            tuple: (<kind>, <namespace or None>, <name>)
+        """
+        metadata = manifest.get("metadata", {})
+        return (manifest["kind"], metadata.get("namespace"), metadata.get("name"))
+
+    def find_manifests(self, kind: str, name: str = None, namespace: str = None) -> list:
+        """
+        Description:
+            Finds the manifests in this run matching a kind and optionally a name and namespace
+        Args:
+            kind (str): The kind to look for
+            name (str, optional): The name to match. Defaults to None (any).
+            namespace (str, optional): The namespace to match. Defaults to None (any).
+        Returns:
+            list: The matching manifest file paths
+        """
+        matches = []
+        for manifest_file, manifest in self.manifests.items():
+            manifest_kind, manifest_namespace, manifest_name = self.manifest_reference(manifest)
+            if manifest_kind != kind:
+                continue
+            if name is not None and manifest_name != name:
+                continue
+            if namespace is not None and manifest_namespace != namespace:
+                continue
+            matches.append(manifest_file)
+        return matches
+
+    def find_dependencies(self, manifest_file: str) -> set:
+        """
+        Description:
+            Works out which other manifests have to be applied (and ready) before this one
+        Args:
+            manifest_file (str): The manifest to find the dependencies for
+        Returns:
+            set: The manifest file paths this one depends on
+        """
+        manifest = self.manifests[manifest_file]
+        kind, namespace, name = self.manifest_reference(manifest)
+        dependencies = set()
+        if namespace and kind != "Namespace":
+            dependencies.update(self.find_manifests("Namespace", name=namespace))
+        if kind == "Subscription":
+            dependencies.update(self.find_manifests("OperatorGroup", namespace=namespace))
+        elif kind not in self.builtin_kinds:
+            # Prefer the operator installed next to the resource, otherwise fall back to the cluster wide operators
+            operators = self.find_manifests("Subscription", namespace=namespace)
+            dependencies.update(operators or self.find_manifests("Subscription", namespace=self.global_operator_namespace))
+        annotations = manifest.get("metadata", {}).get("annotations") or {}
+        for reference in str(annotations.get(self.depends_on_annotation, "")).split(","):
+            reference = reference.strip()
+            if not reference:
+                continue
+            parts = reference.split("/")
+            if len(parts) == 2:
+                matches = self.find_manifests(parts[0], name=parts[1])
+            elif len(parts) == 3:
+                matches = self.find_manifests(parts[0], namespace=parts[1], name=parts[2])
+            else:
+                matches = []
+            if not matches:
+                logging.warning(f"{manifest_file} depends on ---> {reference} <--- which is not in this set of manifests")
+            dependencies.update(matches)
+        dependencies.discard(manifest_file)
+        return dependencies
+
+    def execution_order(self) -> list:
+        """
+        Description:
+            Groups the manifests into levels. Everything in a level only depends on earlier levels.
+            Exits if the dependencies contain a cycle
+        Returns:
+            list: A list of levels, each a sorted list of manifest file paths
+        """
+        remaining = {manifest_file: set(dependencies) for manifest_file, dependencies in self.dependencies.items()}
+        levels = []
+        while remaining:
+            ready = sorted(manifest_file for manifest_file, dependencies in remaining.items() if not dependencies)
+            if not ready:
+                logging.critical(f"The manifests have a dependency cycle ---> {sorted(remaining)} <---")
+                exit(1)
+            levels.append(ready)
+            for manifest_file in ready:
+                remaining.pop(manifest_file)
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+        return levels
+
+    def run(self, apply_manifest) -> None:
+        """
+        Description:
+            Applies every manifest with apply_manifest(manifest_file, manifest) as soon as all of its
+            dependencies have finished. Independent branches run at the same time. If a manifest fails,
+            nothing new is started, the manifests in flight are allowed to finish and the program exits
+        Args:
+            apply_manifest (callable): Applies a single manifest and waits for it to be ready
+        """
+        for level_number, level in enumerate(self.execution_order()):
+            logging.info(f"Manifest level {level_number}: {', '.join(level)}")
+        finished = set()
+        started = set()
+        in_flight = {}
+        failed = None
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="manifest") as executor:
+            while True:
+                if failed is None:
+                    for manifest_file in sorted(self.manifests):
+                        if manifest_file in started or not self.dependencies[manifest_file] <= finished:
+                            continue
+                        logging.info(f"Apply ---> {manifest_file} \n")
+                        started.add(manifest_file)
+                        in_flight[executor.submit(apply_manifest, manifest_file, self.manifests[manifest_file])] = manifest_file
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    manifest_file = in_flight.pop(future)
+                    try:
+                        future.result()
+                    except (Exception, SystemExit) as e:
+                        logging.critical(f"Failed to apply ---> {manifest_file} <--- {e}")
+                        failed = manifest_file
+                        continue
+                    finished.add(manifest_file)
+                    logging.info(f"Finished ---> {manifest_file} <--- after {time.perf_counter() - start_time:.0f} seconds")
+        if failed:
+            logging.critical("Aborting")
+            exit(1)
@@ -0,0 +1,360 @@
+import atexit
+import http.server
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    # Every metric name is prefixed with this, for example quay_management_phase_seconds. Each program sets its own with configure()
+    namespace = "quay_management"
+    # Upper bounds (in seconds) of the latency histogram buckets
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+    # <name>: (<type>, <help>). Every <name>_seconds histogram has a matching <name>_failures_total counter
+    descriptions = {
+        "phase_seconds": ("histogram", "Time spent in each phase of the run"),
+        "phase_failures_total": ("counter", "Phases that ended with an error"),
+        "preflight_seconds": ("gauge", "Time each step of reaching an endpoint took during preflight, by endpoint and stage"),
+        "quay_api_request_seconds": ("histogram", "Latency of Quay API calls, including retries, by endpoint"),
+        "quay_api_request_failures_total": ("counter", "Quay API calls that could not be sent, by endpoint"),
+        "quay_api_responses_total": ("counter", "Quay API responses by endpoint and status code"),
+        "oc_command_seconds": ("histogram", "Latency of oc commands by verb"),
+        "oc_command_failures_total": ("counter", "oc commands that failed, by verb"),
+        "kubernetes_api_request_seconds": ("histogram", "Latency of Kubernetes API calls by resource"),
+        "kubernetes_api_request_failures_total": ("counter", "Kubernetes API calls that could not be sent, by resource"),
+        "podman_seconds": ("histogram", "Latency of podman pull, tag and push by operation"),
+        "podman_failures_total": ("counter", "podman commands that failed, by operation"),
+        "local_storage_bytes": ("gauge", "Bytes of pulled images the sync is keeping in local podman storage"),
+        "local_images_removed_total": ("counter", "Images removed from local podman storage, by reason"),
+        "blob_copy_seconds": ("histogram", "Time to copy a blob registry to registry, by outcome"),
+        "blob_copy_failures_total": ("counter", "Blobs that could not be copied"),
+        "registry_bytes_total": ("counter", "Bytes copied between registries and bytes saved by skipping or mounting blobs"),
+        "image_mirror_seconds": ("histogram", "Time to mirror one image, by outcome"),
+        "image_mirror_failures_total": ("counter", "Images that raised an error while being mirrored"),
+        "images_total": ("counter", "Images handled by the sync, by outcome"),
+        "pipeline_stall_seconds": ("histogram", "Time a pipeline stage waited for room in the queue of the next stage, by stage"),
+        "destination_images_total": ("counter", "Images handled by the sync on each destination, by destination and outcome"),
+        "watcher_events_total": ("counter", "Changes on the primary seen by the sync daemon, by source"),
+        "watcher_poll_seconds": ("histogram", "Time to read new entries from the audit log"),
+        "watcher_poll_failures_total": ("counter", "Audit log polls that failed"),
+        "shards_total": ("counter", "Shards handled by this worker, by outcome"),
+        "journal_units_total": ("counter", "Images journaled as finished, by status"),
+        "journal_flush_seconds": ("histogram", "Time to commit a batch of journal entries"),
+        "verify_tags_total": ("counter", "Tags compared by --verify, by destination and result"),
+        "run_start_time_seconds": ("gauge", "Unix time the run started"),
+        "run_duration_seconds": ("gauge", "How long the run took"),
+    }
+    lock = threading.Lock()
+    # {(<name>, <labels as a sorted tuple>): <value>}
+    counters = {}
+    gauges = {}
+    # {(<name>, <labels as a sorted tuple>): {"buckets": [<count per bucket>], "sum": <float>, "count": <int>}}
+    histograms = {}
+    # The phase started by start_phase() which has not finished yet. (<name>, <start time>)
+    current_phase = None
+    start_time = time.time()
+    textfile = None
+    server = None
+
+    @classmethod
+    def configure(cls, namespace: str = None, textfile: str = None, port: int = None, address: str = "0.0.0.0") -> None:
+        """
+        Description:
+            Sets up exporting. The textfile is written when the program exits (including exit(1)) so the
+            node_exporter textfile collector always sees the last run. The HTTP endpoint serves /metrics while
+            the program is running
+        Args:
+            namespace (str, optional): The prefix for every metric name. Defaults to "quay_management".
+            textfile (str, optional): Where to write the Prometheus textfile. Defaults to None (not written).
+            port (int, optional): The port to serve /metrics on. Defaults to None (no HTTP endpoint).
+            address (str, optional): The address to listen on. Defaults to "0.0.0.0".
+        """
+        if namespace:
+            cls.namespace = namespace
+        cls.start_time = time.time()
+        cls.set_gauge("run_start_time_seconds", cls.start_time)
+        if textfile:
+            cls.textfile = textfile
+            atexit.register(cls.finish)
+        if port is not None:
+            cls.start_http_server(port=port, address=address)
+
+    @staticmethod
+    def label_key(labels: dict) -> tuple:
+        """
+        Description:
+            Turns labels into a hashable key. Values are converted to strings
+        Args:
+            labels (dict): The labels
+        Returns:
+            tuple: ((<label>, <value>), ...) sorted by label name
+        """
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @classmethod
+    def increment(cls, name: str, amount: float = 1, **labels) -> None:
+        """
+        Description:
+            Adds to a counter
+        Args:
+            name (str): The metric name without the namespace, for example images_total
+            amount (float, optional): How much to add. Defaults to 1.
+            **labels: The labels of the series
+        """
+        key = (name, cls.label_key(labels))
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + amount
+
+    @classmethod
+    def set_gauge(cls, name: str, value: float, **labels) -> None:
+        """
+        Description:
+            Sets a gauge to a value
+        Args:
+            name (str): The metric name without the namespace
+            value (float): The new value
+            **labels: The labels of the series
+        """
+        with cls.lock:
+            cls.gauges[(name, cls.label_key(labels))] = value
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels) -> None:
+        """
+        Description:
+            Records a value (usually seconds) in a histogram
+        Args:
+            name (str): The metric name without the namespace, for example oc_command_seconds
+            value (float): The value to record
+            **labels: The labels of the series
+        """
+        key = (name, cls.label_key(labels))
+        with cls.lock:
+            histogram = cls.histograms.get(key)
+            if histogram is None:
+                histogram = cls.histograms[key] = {"buckets": [0] * len(cls.buckets), "sum": 0.0, "count": 0}
+            for position, upper_bound in enumerate(cls.buckets):
+                if value <= upper_bound:
+                    histogram["buckets"][position] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name: str, **labels):
+        """
+        Description:
+            Context manager that records how long the block took in the <name> histogram. If the block
+            raises (including exit()) the matching <name without _seconds>_failures_total counter is incremented
+        Args:
+            name (str): A histogram name ending in _seconds
+            **labels: The labels of the series
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            cls.increment(name[:-len("_seconds")] + "_failures_total", **labels)
+            raise
+        finally:
+            cls.observe(name, time.perf_counter() - start_time, **labels)
+
+    @classmethod
+    def timed_iter(cls, iterable, name: str, **labels):
+        """
+        Description:
+            Generator that passes through every item of iterable and records the total time spent waiting
+            for items as a single observation, for example the time a lazy discovery spent on API calls
+        Args:
+            iterable: The iterable or generator to wrap
+            name (str): A histogram name ending in _seconds
+            **labels: The labels of the series
+        Yields:
+            The items of iterable
+        """
+        waited = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    waited += time.perf_counter() - start_time
+                    return
+                waited += time.perf_counter() - start_time
+                yield item
+        finally:
+            cls.observe(name, waited, **labels)
+
+    @classmethod
+    def start_phase(cls, phase: str) -> None:
+        """
+        Description:
+            Marks the start of a phase in a script that runs its phases one after the other. The previous
+            phase (if any) is recorded as finished
+        Args:
+            phase (str): The name of the phase, for example setup_quay_openshift
+        """
+        cls.end_phase()
+        cls.current_phase = (phase, time.perf_counter())
+
+    @classmethod
+    def end_phase(cls) -> None:
+        """
+        Description:
+            Records the phase started by start_phase() as finished
+        """
+        if cls.current_phase is not None:
+            phase, start_time = cls.current_phase
+            cls.current_phase = None
+            cls.observe("phase_seconds", time.perf_counter() - start_time, phase=phase)
+
+    @classmethod
+    def phase_totals(cls) -> dict:
+        """
+        Description:
+            Adds up the time spent in every phase
+        Returns:
+            dict: {<phase>: <seconds>}
+        """
+        totals = {}
+        with cls.lock:
+            for (name, labels), histogram in cls.histograms.items():
+                if name == "phase_seconds":
+                    phase = dict(labels).get("phase")
+                    totals[phase] = totals.get(phase, 0) + histogram["sum"]
+        return totals
+
+    @staticmethod
+    def escape(value: str) -> str:
+        """
+        Description:
+            Escapes a label value for the Prometheus text format
+        Args:
+            value (str): The label value
+        Returns:
+            str: The escaped value
+        """
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    @classmethod
+    def series(cls, name: str, labels: tuple, extra_label: tuple = None) -> str:
+        """
+        Description:
+            Formats the name and labels of one sample
+        Args:
+            name (str): The full metric name
+            labels (tuple): The labels from label_key()
+            extra_label (tuple, optional): One more (<label>, <value>), such as the histogram le. Defaults to None.
+        Returns:
+            str: <name>{<label>="<value>",...}
+        """
+        if extra_label:
+            labels = labels + (extra_label,)
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{cls.escape(value)}"' for key, value in labels) + "}"
+
+    @classmethod
+    def render(cls) -> str:
+        """
+        Description:
+            Renders every metric in the Prometheus text exposition format
+        Returns:
+            str: The metrics, ready to be served or written to a textfile
+        """
+        samples = {}
+        with cls.lock:
+            for (name, labels), value in list(cls.counters.items()) + list(cls.gauges.items()):
+                samples.setdefault(name, []).append(f"{cls.series(cls.namespace + '_' + name, labels)} {value}")
+            for (name, labels), histogram in cls.histograms.items():
+                full_name = f"{cls.namespace}_{name}"
+                cumulative = 0
+                for upper_bound, count in zip(cls.buckets, histogram["buckets"]):
+                    cumulative += count
+                    samples.setdefault(name, []).append(f"{cls.series(full_name + '_bucket', labels, ('le', str(upper_bound)))} {cumulative}")
+                samples[name].append(f"{cls.series(full_name + '_bucket', labels, ('le', '+Inf'))} {histogram['count']}")
+                samples[name].append(f"{cls.series(full_name + '_sum', labels)} {histogram['sum']}")
+                samples[name].append(f"{cls.series(full_name + '_count', labels)} {histogram['count']}")
+        lines = []
+        for name in sorted(samples):
+            metric_type, description = cls.descriptions.get(name, ("untyped", name))
+            lines.append(f"# HELP {cls.namespace}_{name} {description}")
+            lines.append(f"# TYPE {cls.namespace}_{name} {metric_type}")
+            lines.extend(sorted(samples[name]) if metric_type != "histogram" else samples[name])
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def write_textfile(cls, path: str) -> None:
+        """
+        Description:
+            Writes the metrics for the node_exporter textfile collector. The file is written next to its
+            final name and renamed so the collector never reads half a file
+        Args:
+            path (str): The .prom file to write
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, temporary_file = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as f:
+            f.write(cls.render())
+        os.chmod(temporary_file, 0o644)
+        os.replace(temporary_file, path)
+
+    @classmethod
+    def finish(cls) -> None:
+        """
+        Description:
+            Ends the current phase, records the run duration and writes the textfile if one was configured.
+            Registered with atexit by configure()
+        """
+        cls.end_phase()
+        cls.set_gauge("run_duration_seconds", time.time() - cls.start_time)
+        if cls.textfile:
+            try:
+                cls.write_textfile(cls.textfile)
+                logging.info(f"Wrote metrics to ---> {cls.textfile} <---")
+            except OSError as e:
+                logging.error(f"Could not write metrics to {cls.textfile}: {e}")
+
+    @classmethod
+    def start_http_server(cls, port: int = 9100, address: str = "0.0.0.0") -> None:
+        """
+        Description:
+            Serves the metrics on http://<address>:<port>/metrics from a background thread
+        Args:
+            port (int, optional): The port to listen on. Defaults to 9100.
+            address (str, optional): The address to listen on. Defaults to "0.0.0.0".
+        """
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = cls.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        cls.server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, name="metrics", daemon=True).start()
+        logging.info(f"Serving metrics on ---> http://{address}:{cls.server.server_address[1]}/metrics <---")
+
+    @classmethod
+    def log_summary(cls) -> None:
+        """
+        Description:
+            Logs how long each phase took, longest first
+        """
+        for phase, seconds in sorted(cls.phase_totals().items(), key=lambda item: item[1], reverse=True):
+            logging.info(f"Phase ---> {phase} <--- took {seconds:.1f} seconds")
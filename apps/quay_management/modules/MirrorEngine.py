@@ -0,0 +1,393 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .QuayOperations import PodmanCopyBackend
+from .ImagePipeline import ImagePipeline
+from .Metrics import Metrics
+
+
+class MirrorEngine:
+    def __init__(self, max_workers: int = 4, max_per_source: int = None, max_per_destination: int = None, args=None, backend=None, state=None,
+                 max_destination_failures: int = 5, pipeline_depth: int = 0) -> None:
+        """
+        Description:
+            Initialize a worker pool that mirrors images between registries.
+        Args:
+            max_workers (int, optional): How many images are started at the same time. A worker checks the state, reads the image from the
+                                         source and hands its copies to the destinations, which run on max_per_destination threads each.
+                                         Up to max_in_flight images are in flight while their copies finish. Defaults to 4.
+            max_per_source (int, optional): How many pulls can hit a single source registry at once. Defaults to max_workers.
+            max_per_destination (int, optional): How many pushes can hit a single destination registry at once. Defaults to max_workers.
+            args: An instance of arg parse so we know what options we are dealing with
+            backend (optional): The copy backend, PodmanCopyBackend or RegistryCopyBackend. Defaults to PodmanCopyBackend.
+            state (SyncState, optional): If set, tags whose source digest has not changed since they were last mirrored are skipped. Defaults to None.
+            max_destination_failures (int, optional): When mirroring to several destinations, a destination that fails this many images in a row
+                                                      is skipped for the rest of the run. 0 never skips. Defaults to 5.
+            pipeline_depth (int, optional): If set, images go through separate pull, tag and push stages (see ImagePipeline)
+                                            with this many images waiting between stages. Defaults to 0 (each worker copies a whole image).
+        """
+        self.backend = backend or PodmanCopyBackend(args=args)
+        self.max_workers = max(1, max_workers)
+        self.max_per_source = max_per_source or self.max_workers
+        self.max_per_destination = max_per_destination or self.max_workers
+        # Images run() has handed to the workers that are not done on every destination yet. A couple per worker keeps the
+        # workers busy, and a few per destination thread let a fast destination get that far ahead of a slow one
+        self.max_in_flight = self.max_workers * 2 + self.max_per_destination * 4
+        self.args = args
+        self.state = state
+        # --full-resync still records digests but ignores what was recorded before
+        self.full_resync = getattr(args, "full_resync", False)
+        # Semaphores are created lazily the first time a registry is seen
+        self.registry_limits = {}
+        # {<destination registry>: <ThreadPoolExecutor>} running the copies to each destination, also created lazily
+        self.destination_executors = {}
+        self.limits_lock = threading.Lock()
+        self.stop_requested = threading.Event()
+        self.succeeded = []
+        self.failed = []
+        self.unchanged = []
+        self.max_destination_failures = max_destination_failures
+        # {<destination registry>: {"mirrored": <int>, "unchanged": <int>, "failed": <int>}}
+        self.destination_results = {}
+        # {<destination registry>: <images that failed in a row>}
+        self.destination_failures = {}
+        self.skipped_destinations = set()
+        self.destinations_lock = threading.Lock()
+        # {<future>: <job>} of the images run() has handed to the workers and not collected yet
+        self.in_flight = {}
+        self.pipeline_depth = pipeline_depth
+        if self.pipeline_depth and not hasattr(self.backend, "pull_image"):
+            # The direct backend already uploads each blob while it is being downloaded
+            logging.warning(f"The {self.backend.name} backend can not be pipelined... copying whole images on each worker")
+            self.pipeline_depth = 0
+
+    @staticmethod
+    def registry_from_image(image_name: str) -> str:
+        """
+        Description:
+            Returns the registry portion of an image name (hostname and optional port)
+        Args:
+            image_name (str): A full image name such as https://quay.example.com/org/repo:tag
+        Returns:
+            str: The registry hostname, for example quay.example.com
+        """
+        if "//" in image_name:
+            image_name = image_name.split("//")[1:][0]
+        return image_name.split("/")[0]
+
+    def registry_limit(self, registry: str, role: str) -> threading.BoundedSemaphore:
+        """
+        Description:
+            Gets (or creates) the semaphore which caps the number of concurrent operations against a registry
+        Args:
+            registry (str): The registry hostname
+            role (str): Either "source" or "destination". The same registry can have a different limit in each role
+        Returns:
+            threading.BoundedSemaphore: The semaphore for this registry/role pair
+        """
+        with self.limits_lock:
+            if (role, registry) not in self.registry_limits:
+                limit = self.max_per_source if role == "source" else self.max_per_destination
+                self.registry_limits[(role, registry)] = threading.BoundedSemaphore(limit)
+            return self.registry_limits[(role, registry)]
+
+    def destination_executor(self, registry: str) -> ThreadPoolExecutor:
+        """
+        Description:
+            Gets (or creates) the executor that copies images to a destination registry. Each destination has its
+            own queue and max_per_destination threads, so a slow destination only holds up its own copies
+        Args:
+            registry (str): The destination registry hostname
+        Returns:
+            ThreadPoolExecutor: The executor for this destination
+        """
+        with self.limits_lock:
+            if registry not in self.destination_executors:
+                self.destination_executors[registry] = ThreadPoolExecutor(max_workers=self.max_per_destination, thread_name_prefix=f"copy-{registry}")
+            return self.destination_executors[registry]
+
+    def shutdown_destinations(self, cancel_futures: bool = False) -> None:
+        """
+        Description:
+            Waits for the copies queued on every destination executor and stops them
+        Args:
+            cancel_futures (bool, optional): Cancel the copies that have not started. Defaults to False.
+        """
+        with self.limits_lock:
+            executors, self.destination_executors = self.destination_executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=cancel_futures)
+
+    def record_destination(self, destination_registry: str, outcome: str, isolated: bool = False) -> None:
+        """
+        Description:
+            Counts the outcome of one image on one destination. A destination that keeps failing images the
+            other destinations accept is skipped for the rest of the run so the images are not held up retrying it
+        Args:
+            destination_registry (str): The destination registry hostname
+            outcome (str): "mirrored", "unchanged" or "failed"
+            isolated (bool, optional): The image failed here but not on another destination, so the destination
+                                       rather than the image is to blame. Defaults to False.
+        """
+        Metrics.increment("destination_images_total", destination=destination_registry, outcome=outcome)
+        with self.destinations_lock:
+            results = self.destination_results.setdefault(destination_registry, {"mirrored": 0, "unchanged": 0, "failed": 0})
+            results[outcome] += 1
+            if outcome != "failed":
+                self.destination_failures[destination_registry] = 0
+                return
+            if not isolated:
+                return
+            self.destination_failures[destination_registry] = self.destination_failures.get(destination_registry, 0) + 1
+            if (self.max_destination_failures and destination_registry not in self.skipped_destinations
+                    and self.destination_failures[destination_registry] >= self.max_destination_failures):
+                self.skipped_destinations.add(destination_registry)
+                logging.critical(f"Skipping ---> {destination_registry} <--- for the rest of the sync after {self.max_destination_failures} failed images in a row")
+
+    def destination_is_current(self, job: dict, image_destination: str) -> bool:
+        """
+        Description:
+            Checks if a destination already has the image. The sync state only records what was copied the last time,
+            so once it says the source has not changed a HEAD request confirms the tag is still on the destination
+            and was not deleted or overwritten there since
+        Args:
+            job (dict): A job as described in mirror_image(), with its source_digest
+            image_destination (str): The image on the destination
+        Returns:
+            bool: True if the copy can be skipped
+        """
+        source_registry = self.registry_from_image(job["image_source"])
+        destination_registry = self.registry_from_image(image_destination)
+        if not self.state.is_current(source_registry, destination_registry, job["image_and_tag"], job["source_digest"]):
+            return False
+        recorded = self.state.get_tag(source_registry, destination_registry, job["image_and_tag"])
+        destination_digest = self.backend.manifest_digest(image_destination)
+        if destination_digest != recorded["destination_digest"]:
+            logging.warning(f"---> {image_destination} <--- is {destination_digest or 'missing'} on the destination instead of "
+                            f"{recorded['destination_digest']}... copying it again")
+            return False
+        return True
+
+    def pending_destinations(self, job: dict) -> tuple[dict, list]:
+        """
+        Description:
+            Works out which destinations of an image need a copy. Destinations that are up to date in the
+            sync state, or that were skipped after repeated failures, do not
+        Args:
+            job (dict): A job as described in mirror_image()
+        Returns:
+            tuple: ({<destination image name>: "unchanged" or "failed"}, [<destination image names that need a copy>])
+        """
+        if self.state and not job.get("source_digest"):
+            job["source_digest"] = self.backend.manifest_digest(job["image_source"])
+        results = {}
+        pending = []
+        for image_destination in job.get("image_destinations") or [job["image_destination"]]:
+            destination_registry = self.registry_from_image(image_destination)
+            if destination_registry in self.skipped_destinations:
+                results[image_destination] = "failed"
+            elif self.state and not self.full_resync and self.destination_is_current(job, image_destination):
+                results[image_destination] = "unchanged"
+            else:
+                pending.append(image_destination)
+        return results, pending
+
+    def record_copies(self, job: dict, results: dict, copied: dict) -> str:
+        """
+        Description:
+            Records the copies of an image in the sync state and the per destination counts
+        Args:
+            job (dict): A job as described in mirror_image()
+            results (dict): The destinations that did not need a copy, from pending_destinations()
+            copied (dict): {<destination image name>: True if the copy worked} for the destinations that needed one
+        Returns:
+            str: "mirrored", "unchanged", "partial" (only some destinations could be mirrored) or "failed"
+        """
+        source_registry = self.registry_from_image(job["image_source"])
+        results = dict(results)
+        for image_destination, copy_worked in copied.items():
+            destination_registry = self.registry_from_image(image_destination)
+            results[image_destination] = "mirrored" if copy_worked else "failed"
+            if copy_worked and self.state and job.get("source_digest"):
+                destination_digest = job.get("destination_digests", {}).get(image_destination) or self.backend.manifest_digest(image_destination)
+                self.state.record_tag(source_registry, destination_registry, job["image_and_tag"], job["source_digest"], destination_digest)
+        outcomes = set(results.values())
+        for image_destination, outcome in results.items():
+            self.record_destination(self.registry_from_image(image_destination), outcome, isolated=len(outcomes) > 1)
+        if outcomes == {"unchanged"}:
+            return "unchanged"
+        if "failed" not in outcomes:
+            return "mirrored"
+        return "partial" if len(outcomes) > 1 else "failed"
+
+    def start_image(self, job: dict, future: Future) -> None:
+        """
+        Description:
+            Runs on a worker. Reads an image from the source and hands its copies to the executor of each destination
+            that is not up to date, then returns so the worker can start on the next image while the copies run.
+            The future is resolved once every destination is done
+        Args:
+            job (dict): A job as described in mirror_image()
+            future (Future): Resolves to the outcome of the image. Nothing is done if it was cancelled before the worker got to it
+        """
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            job["started"] = time.perf_counter()
+            results, pending = self.pending_destinations(job)
+            if not pending:
+                future.set_result(self.record_copies(job, results, {}))
+                return
+            source_limit = self.registry_limit(self.registry_from_image(job["image_source"]), "source")
+            copies = self.backend.copy_image_to(job, source_limit, [(image_destination, self.destination_executor(self.registry_from_image(image_destination)))
+                                                                    for image_destination in pending])
+        except Exception as e:
+            future.set_exception(e)
+            return
+
+        def copies_done(copies):
+            try:
+                future.set_result(self.record_copies(job, results, copies.result()))
+            except Exception as e:
+                future.set_exception(e)
+
+        copies.add_done_callback(copies_done)
+
+    def mirror_image(self, job: dict) -> str:
+        """
+        Description:
+            Hands a single image to the copy backend along with the limit for its source registry and the executors of its
+            destination registries, and waits for it. When a sync state is in use, images whose source digest has not changed
+            are skipped and successful copies are recorded. A job with several destinations is only copied to the ones that are
+            not up to date, and each destination is recorded on its own
+        Args:
+            job (dict): {"image_source": <str>, "image_destination": <str>, "image_and_tag": <str>, "source_digest": <str, optional>,
+                         "image_destinations": <list of str, optional. Every destination including image_destination>}
+        Returns:
+            str: "mirrored", "unchanged", "partial" (only some destinations could be mirrored) or "failed"
+        """
+        future = Future()
+        self.start_image(job, future)
+        return future.result()
+
+    def run(self, jobs, on_finished=None) -> dict:
+        """
+        Description:
+            Mirrors every job handed in. Jobs can be a list or a generator, only a small window of jobs
+            is pulled from the iterable at a time so generators are consumed lazily.
+            Unless --skip-broken-images is set, the first failure stops any new images from being started.
+        Args:
+            jobs (iterable): An iterable of job dicts as described in mirror_image()
+            on_finished (callable, optional): Called as on_finished(<job>, <outcome>) on the calling thread after each image finishes. Defaults to None.
+        Returns:
+            dict: {"succeeded": [<image_and_tag>], "failed": [<image_and_tag>], "unchanged": [<image_and_tag>]}
+        """
+        skip_broken_images = getattr(self.args, "skip_broken_images", False)
+        total = len(jobs) if hasattr(jobs, "__len__") else None
+        job_iterator = iter(jobs)
+        in_flight = self.in_flight = {}
+        completed = 0
+        start_time = time.perf_counter()
+        window = self.max_in_flight
+        if self.pipeline_depth:
+            executor = ImagePipeline(self, queue_depth=self.pipeline_depth, pull_workers=self.max_workers, push_workers=self.max_workers)
+            # Enough to fill every stage and both queues between them
+            window = self.max_workers * 3 + self.pipeline_depth * 2 + 1
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mirror")
+        try:
+            while True:
+                while not self.stop_requested.is_set() and len(in_flight) < window:
+                    job = next(job_iterator, None)
+                    if job is None:
+                        break
+                    if self.pipeline_depth:
+                        future = executor.submit(job)
+                    else:
+                        # The worker only reads the source, the future resolves once the destination executors are done
+                        future = Future()
+                        executor.submit(self.start_image, job, future)
+                    in_flight[future] = job
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    if future.cancelled():
+                        logging.warning(f"Skipped ---> {job['image_and_tag']} <--- because the sync is stopping")
+                        continue
+                    completed += 1
+                    progress = f"{completed}/{total}" if total else f"{completed}"
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        logging.error(f"Unexpected error mirroring {job['image_and_tag']}: {e}")
+                        Metrics.increment("image_mirror_failures_total")
+                        outcome = "failed"
+                    Metrics.increment("images_total", outcome=outcome)
+                    if "started" in job:
+                        Metrics.observe("image_mirror_seconds", time.perf_counter() - job["started"], outcome=outcome)
+                    if outcome == "unchanged":
+                        self.unchanged.append(job["image_and_tag"])
+                        logging.debug(f"[{progress}] Unchanged since the last sync ---> {job['image_and_tag']} <---")
+                    elif outcome == "mirrored":
+                        self.succeeded.append(job["image_and_tag"])
+                        logging.info(f"[{progress}] Mirrored ---> {job['image_and_tag']} <---")
+                    elif outcome == "partial":
+                        # The destinations that failed are counted and skipped on their own, the others carry on
+                        self.failed.append(job["image_and_tag"])
+                        logging.error(f"[{progress}] Mirrored ---> {job['image_and_tag']} <--- to some destinations only")
+                    else:
+                        self.failed.append(job["image_and_tag"])
+                        logging.error(f"[{progress}] FAILED to mirror ---> {job['image_and_tag']} <---")
+                        if not skip_broken_images and not self.stop_requested.is_set():
+                            logging.critical("--skip-broken-images was not used... waiting for in flight images and stopping")
+                            self.stop_requested.set()
+                            # Anything that has not started yet does not need to run
+                            for queued in in_flight:
+                                queued.cancel()
+                    if on_finished:
+                        on_finished(job, outcome)
+        except KeyboardInterrupt:
+            logging.critical("Interrupted... cancelling queued images")
+            self.stop_requested.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.shutdown_destinations(cancel_futures=self.stop_requested.is_set())
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"Mirrored {len(self.succeeded)} images with {len(self.failed)} failures in {elapsed:.1f} seconds")
+        if self.state:
+            logging.info(f"Skipped {len(self.unchanged)} images that had not changed since the last sync")
+        for image in self.failed:
+            logging.error(f"Failed image ---> {image} <---")
+        if len(self.destination_results) > 1:
+            for destination_registry, results in sorted(self.destination_results.items()):
+                logging.info(f"Destination ---> {destination_registry} <--- mirrored {results['mirrored']}, unchanged {results['unchanged']}, failed {results['failed']}"
+                             + (" (skipped after repeated failures)" if destination_registry in self.skipped_destinations else ""))
+        return {"succeeded": self.succeeded, "failed": self.failed, "unchanged": self.unchanged}
+
+    def stop(self) -> None:
+        """
+        Description:
+            Stops run() from starting any more images and cancels the ones that are queued. Images already being
+            copied are finished. Safe to call from a signal handler or another thread
+        """
+        if self.stop_requested.is_set():
+            return
+        logging.critical("Stopping... waiting for in flight images")
+        self.stop_requested.set()
+        for future in list(self.in_flight):
+            future.cancel()
+
+    def exit_code(self) -> int:
+        """
+        Description:
+            The status code the sync should exit with
+        Returns:
+            int: 0 if every image was mirrored, 1 if anything failed or the run was stopped early
+        """
+        if self.failed or self.stop_requested.is_set():
+            return 1
+        return 0
@@ -1,13 +1,31 @@
 from .BaseOperations import BaseOperations
-import yaml
+from .Metrics import Metrics
 import subprocess
 import logging
 import time
 import base64
+import codecs
+import json
+import os
+import select
 
 class OpenShiftCommands:
     def __init__(self) -> None:
         pass
+
+    @staticmethod
+    def run_oc(command: list, **kwargs) -> bytes:
+        """
+        Description:
+            Runs an `oc` command with subprocess.check_output and records how long it took, by verb, in the metrics
+        Args:
+            command (list): The full command, starting with "oc"
+            **kwargs: Passed to subprocess.check_output
+        Returns:
+            bytes: The output of the command. subprocess.CalledProcessError is raised if it fails
+        """
+        with Metrics.timer("oc_command_seconds", verb=command[1]):
+            return subprocess.check_output(command, **kwargs)
     
     @staticmethod
     def does_secret_exist(secret_name: str = None, namespace: str = None) -> bool:
@@ -26,7 +44,7 @@ class OpenShiftCommands:
         else:
             secret_command = ["oc", "get", "secret", secret_name, "-n", namespace]
         try:
-            subprocess.check_output(secret_command)
+            OpenShiftCommands.run_oc(secret_command)
             return True
         except:
             return False
@@ -45,7 +63,7 @@ class OpenShiftCommands:
         else:
             apply_command = ["oc", "apply", "-f", file_path]
         try:
-            subprocess.check_output(apply_command)
+            OpenShiftCommands.run_oc(apply_command)
         except:
             logging.critical(f"Failed to apply ---> {file_path}")
             logging.critical("Aborting")
@@ -53,7 +71,30 @@ class OpenShiftCommands:
 
 
     @staticmethod
-    def openshift_create_secret(file_path: str, namespace: str = None, secret_name: str = "init-config-bundle-secret", secret_type: str = "generic" ):
+    def openshift_apply_directory(directory: str = None, namespace: str = None, kubeconfig: str = None) -> None:
+        """
+        Description:
+            Uses `oc apply --server-side` to create or modify every manifest in a directory (and its subdirectories)
+            with a single command. Nothing waits for the objects to become ready
+        Args:
+            directory (str, optional): The directory with the manifests. Defaults to None.
+            namespace (str, optional): Which namespace to apply resources without a namespace to. Defaults to None.
+            kubeconfig (str, optional): The kubeconfig to use instead of the default one. Defaults to None.
+        """
+        apply_command = ["oc", "apply", "--server-side", "--force-conflicts", "--field-manager", "quay-management", "-R", "-f", directory]
+        if namespace:
+            apply_command.extend(["-n", namespace])
+        if kubeconfig:
+            apply_command.extend(["--kubeconfig", kubeconfig])
+        try:
+            OpenShiftCommands.run_oc(apply_command)
+        except:
+            logging.critical(f"Failed to apply ---> {directory}")
+            logging.critical("Aborting")
+            exit(1)
+
+    @classmethod
+    def openshift_create_secret(cls, file_path: str, namespace: str = None, secret_name: str = "init-config-bundle-secret", secret_type: str = "generic" ):
         """
         Description:
             Creates a secret from a file. The initial intent is to create the `init-config-bundle-secret`
@@ -68,13 +109,13 @@ class OpenShiftCommands:
             secret_command = ["oc", "create", "secret", secret_type, secret_name, f"--from-file=config.yaml={file_path}"]
         if namespace:
             secret_command.extend(["-n", namespace])
-            output = OpenShiftCommands.does_secret_exist(secret_name=secret_name, namespace=namespace)  
+            output = cls.does_secret_exist(secret_name=secret_name, namespace=namespace)  
         else:
-            output = OpenShiftCommands.does_secret_exist(secret_name=secret_name)
+            output = cls.does_secret_exist(secret_name=secret_name)
         # If output is false, the secret doesn't exist, go ahead and create it
         if not output:
             logging.info(f"The secret {secret_name} does not currently exist... creating")
-            subprocess.check_output(secret_command)
+            cls.run_oc(secret_command)
         else:
             logging.error(f"The secret {secret_name} already exists!")
 
@@ -97,14 +138,14 @@ class OpenShiftCommands:
         if grace_period != None:
             delete_command.extend(["--grace-period", grace_period])
         logging.debug(f"Running the following delete command: {delete_command}")
-        subprocess.check_output(delete_command)
+        OpenShiftCommands.run_oc(delete_command)
 
     @staticmethod
     def openshift_get_infrastructure_name(command_output):
         """
         Returns the current infrastructure ID of an OpenShift Cluster
         """
-        command_output = yaml.load(command_output.decode(), Loader=yaml.FullLoader)
+        command_output = BaseOperations.load_yaml(command_output.decode())
         get_infraID_cmd = command_output['status']['infrastructureName']
         return(get_infraID_cmd)
 
@@ -112,14 +153,45 @@ class OpenShiftCommands:
     def openshift_get_object(cls, **kwargs):
         """
         Description: 
-            Gets an object from openshift and returns the yaml output
+            Gets an object from openshift and returns the raw output. JSON is the default because it is
+            much quicker to parse than yaml on namespaces with hundreds of objects
 
         Args:
             Takes **kwargs but current expects
             object_type: usually pod, node, secret etc
             object_name: the name of the object if required/known
             label: A label used to identify the correct object
+            field_selector: A field selector such as status.phase=Running, filtered by the API server (if any)
             namespace: The namespace where the object resides (if any)
+            output: The output format passed to -o. Defaults to json
+            kubeconfig: The kubeconfig to use instead of the default one (if any)
+        """
+        check_command = cls.openshift_get_command(**kwargs)
+        check_command.extend(["-o", kwargs.get("output", "json")])
+        return(cls.run_oc(check_command))
+
+    @classmethod
+    def openshift_get_json(cls, **kwargs) -> dict:
+        """
+        Description:
+            Gets an object from openshift as JSON and parses it
+        Args:
+            Takes the same **kwargs as openshift_get_object except output
+        Returns:
+            dict: The object, or {"items": [...]} when listing
+        """
+        kwargs["output"] = "json"
+        return json.loads(cls.openshift_get_object(**kwargs))
+
+    @staticmethod
+    def openshift_get_command(**kwargs) -> list:
+        """
+        Description:
+            Builds the `oc get` command shared by openshift_get_object and openshift_watch
+        Args:
+            Takes the same **kwargs as openshift_get_object
+        Returns:
+            list: The command without an output format
         """
         check_command = ["oc", "get", kwargs["object_type"]]
         if kwargs.get("object_name"):
@@ -128,28 +200,14 @@ class OpenShiftCommands:
             check_command.extend(["-n", kwargs["namespace"]])
         if kwargs.get("label"):
             check_command.extend(["-l", kwargs["label"]])
-        check_command.extend(["-o", "yaml"])        
-        return(subprocess.check_output(check_command))
+        if kwargs.get("field_selector"):
+            check_command.extend(["--field-selector", kwargs["field_selector"]])
+        if kwargs.get("kubeconfig"):
+            check_command.extend(["--kubeconfig", kwargs["kubeconfig"]])
+        return check_command
 
-    @classmethod
-    def openshift_generic_wait(cls, counter: int = None, iterations: int = 10, delay_between_checks: int = 60, openshift_object: str = None):
-        """
-        Description:
-            Provides a generic wait function which provides logging and sleep
-        Args:
-            counter (int, optional): _description_. Defaults to None.
-            iterations (int, optional): _description_. Defaults to 10.
-            delay_between_checks (int, optional): _description_. Defaults to 60.
-            openshift_object (str, optional): _description_. Defaults to None.
-        """
-        remaining_time = (iterations-counter) * delay_between_checks /60
-        logging.info(f"Not all {openshift_object} are ready.")
-        logging.info(f"{(iterations-counter)} iterations remaining.")
-        logging.info(f"{remaining_time} minutes remaining before timing out")
-        time.sleep(delay_between_checks)
-        
     @staticmethod
-    def openshift_login(api_url: str, username: str, passwd: str) -> None:
+    def openshift_login(api_url: str, username: str, passwd: str, kubeconfig: str = None) -> None:
         """
         Description:
             Logs into the OpenShift Cluster with username and password
@@ -157,24 +215,19 @@ class OpenShiftCommands:
             api_url (str): The url including protocol (http/https) and port are expected
             username (str): OpenShift cluster admin user
             passwd (str): OpenShift cluster admin password
+            kubeconfig (str, optional): Write the login to this kubeconfig instead of the default one so
+                                        several clusters can be used at the same time. Defaults to None.
         """
         openshift_login_command = ["oc", "login", "-u", username, "-p", passwd, api_url]
+        if kubeconfig:
+            openshift_login_command.extend(["--kubeconfig", kubeconfig])
         openshift_login_command = BaseOperations.do_i_skip_tls(openshift_login_command)
         try:
-            subprocess.check_output(openshift_login_command)
+            OpenShiftCommands.run_oc(openshift_login_command)
         except:
             logging.critical(f"Failed to log into {api_url}")
             exit(1)
 
-    @staticmethod
-    def openshift_object_ready(object_dict: dict = None, openshift_object: str = None):
-        if all(value == True for value in object_dict.values()):
-            logging.info(f"All of the {openshift_object} are reporting ready")
-            logging.info("Continuing to the next step...")
-            return True
-        else:
-            return False
-
     @staticmethod
     def openshift_ready_check(output: dict = None, status: str = "conditions", crd: str = None):
         object_ready = {}
@@ -191,18 +244,22 @@ class OpenShiftCommands:
         else:
             for x in output['items']:         
                 object_name = x['metadata']['name']
+                if x['metadata'].get('deletionTimestamp'):
+                    # Objects that are terminating (for example pods that were just deleted) are on their way out
+                    continue
+                object_status = x.get('status', {})
                 if status == "phase":
-                    if x['status'][status] == "Succeeded":
+                    if object_status.get(status) == "Succeeded":
                         # Assuming any pod that has succeeded shouldn't be running anyways 
                         # as it is likely a job pod
                         continue
-                    elif x['status'][status] == "Running":
+                    elif object_status.get(status) == "Running":
                         object_ready[object_name] = True
                     else:
                         object_ready[object_name] = False
                 else:
                     object_ready[object_name] = False
-                    for y in x['status'][status]:
+                    for y in object_status.get(status, []):
                         if y['type'] == "Ready":
                             if y['status'] == "True":
                                 object_ready[object_name] = True
@@ -219,10 +276,10 @@ class OpenShiftCommands:
         Returns: 
             Nothing. This method performs an action with no returns
         """
-        openshift_create_secret_cmd = ["oc", "create", "secret", "generic", secret_name, f"--from-file=config.yaml={full_path_to_file}", "--dry-run=client", "-o", "yaml"]
-        new_secret_file_path = "/tmp/quay_new_secret.yaml"
+        openshift_create_secret_cmd = ["oc", "create", "secret", "generic", secret_name, f"--from-file=config.yaml={full_path_to_file}", "--dry-run=client", "-o", "json"]
+        new_secret_file_path = "/tmp/quay_new_secret.json"
         try:
-            secret_output = subprocess.check_output(openshift_create_secret_cmd)
+            secret_output = OpenShiftCommands.run_oc(openshift_create_secret_cmd)
         except Exception as e:
             copy_command = ", ".join(openshift_create_secret_cmd).replace(",", "")
             logging.error(f"Could not process {full_path_to_file} attempted to run {copy_command} but it failed")
@@ -230,123 +287,99 @@ class OpenShiftCommands:
             exit(1)
         
         with open(new_secret_file_path, "w") as file:
-            file.write(yaml.dump(yaml.load(secret_output, Loader=yaml.FullLoader)))
+            file.write(secret_output.decode())
             file.close()
         openshift_replace_secret_cmd = ["oc", "replace", "-f", new_secret_file_path, "-n", namespace]
         try:
-            output = (subprocess.check_output(openshift_replace_secret_cmd))
+            output = (OpenShiftCommands.run_oc(openshift_replace_secret_cmd))
         except:
             logging.critical(f"Failed to use this file {openshift_replace_secret_cmd} to replace object")
             exit(1)
 
-    @staticmethod 
-    def openshift_waitfor_pods(namespace: str = None, 
+    @classmethod
+    def openshift_waitfor_pods(cls, namespace: str = None, 
             openshift_object: str = "pods", 
             iterations: int = None, 
             delay_between_checks: int = None,
-            number_of_pods: int = None
+            number_of_pods: int = None,
+            timeout: int = 600
             ):
         """
         Description:
-            Wait for pods to become bound. We want to make sure they are all ready before proceeding
+            Wait for pods to become bound. We want to make sure they are all ready before proceeding.
+            The pods are watched so this returns as soon as they are running
         Args:
             namespace (str, optional): Which namespace (if any) the object resides in. Defaults to None.
             openshift_object (str, optional): What type of object is this. Defaults to pods.
-            iterations (int, optional): Number of checks to run . Defaults to None.
-            delay_between_checks (int, optional): The amount of time in seconds between each check. Defaults to None.
+            iterations (int, optional): Kept for compatibility, when given with delay_between_checks the deadline is iterations * delay_between_checks. Defaults to None.
+            delay_between_checks (int, optional): Kept for compatibility, see iterations. Defaults to None.
+            number_of_pods (int, optional): How many running pods are expected. Defaults to None.
+            timeout (int, optional): Seconds to wait before giving up when iterations and delay_between_checks are not given. Defaults to 600.
         """
-        openshift_cmd_arguments = {
-            "object_type": openshift_object,
-            "namespace": namespace,
-        }
-        object_ready = {}
-        counter = 0
-        while counter <= iterations:
-            OpenShiftCommands.openshift_generic_wait(
-                                                    counter=counter, 
-                                                    iterations=iterations, 
-                                                    delay_between_checks=delay_between_checks, 
-                                                    openshift_object=openshift_object
-                                                    )
-            try:
-                output = OpenShiftCommands.openshift_get_object(**openshift_cmd_arguments)
-            except subprocess.CalledProcessError:
-                # The error already gets printed to the screen
-                # We don't need to capture the exit code
-                counter += 1
-            output = yaml.load(output, Loader=yaml.FullLoader)
-            object_ready = OpenShiftCommands.openshift_ready_check(output=output, status="phase")
-            if len(object_ready) >= number_of_pods:
-                move_on = OpenShiftCommands.openshift_object_ready(object_dict=object_ready, openshift_object=openshift_object)
-                if move_on:
-                    return
-            counter +=1
-    
+        def pods_ready(output):
+            object_ready = cls.openshift_ready_check(output=output, status="phase")
+            return len(object_ready) >= (number_of_pods or 1) and all(object_ready.values())
 
-    @staticmethod
-    def openshift_waitfor_object(
+        if iterations and delay_between_checks:
+            timeout = iterations * delay_between_checks
+        # Completed job pods are filtered out by the API server instead of being sent and skipped
+        if cls.openshift_watch(pods_ready, timeout=timeout, object_type=openshift_object, namespace=namespace, field_selector="status.phase!=Succeeded"):
+            logging.info(f"All of the {openshift_object} are reporting ready")
+            logging.info("Continuing to the next step...")
+        else:
+            logging.warning(f"{openshift_object} did not become ready after {timeout/60} minutes... continuing")
+
+    @classmethod
+    def openshift_waitfor_object(cls, 
             namespace: str = None, 
             openshift_object: str = None, 
             iterations: int = None, 
             delay_between_checks: int = None, 
             label: str = None, 
             crd: str = None,
-            replicas: int = None
+            replicas: int = None,
+            timeout: int = 600
             ):
         """
         Description:
-            Waits for an object to become Ready for a given number of iterations
+            Waits for an object to become Ready. The object is watched so this returns as soon as it is ready.
+            If crd is set, waits for at least one object of that type to exist instead
         Args:
             namespace (str, optional): Which namespace (if any) the object resides in. Defaults to None.
             openshift_object (str, optional): What type of object is this. Defaults to None.
-            iterations (int, optional): Number of checks to run . Defaults to None.
-            delay_between_checks (int, optional): The amount of time in seconds between each check. Defaults to None.
-        """
-        openshift_cmd_arguments = {
-            "object_type": openshift_object,
-            "namespace": namespace,
-            "label": label
-        }
-        object_ready = {}
-        counter = 0
-        while counter <= iterations:
-            OpenShiftCommands.openshift_generic_wait(counter=counter, iterations=iterations, delay_between_checks=delay_between_checks, openshift_object=openshift_object)
-            try:
-                output = OpenShiftCommands.openshift_get_object(**openshift_cmd_arguments)
-            except subprocess.CalledProcessError:
-                # The error already gets printed to the screen
-                # We don't need to capture the exit code
-                counter += 1
-                continue
-            output = yaml.load(output, Loader=yaml.FullLoader)
-            object_ready = OpenShiftCommands.openshift_ready_check(output=output, crd=crd)
-            if object_ready:
-                if replicas:
-                    if len(object_ready) == replicas:
-                         complete = OpenShiftCommands.openshift_object_ready(object_dict=object_ready, openshift_object=openshift_object)
-                         counter += 1
-                         if complete:
-                             return
-                else:
-                    complete = OpenShiftCommands.openshift_object_ready(object_dict=object_ready, openshift_object=openshift_object)
-                    counter += 1
-                    if complete:
-                        return
+            iterations (int, optional): Kept for compatibility, when given with delay_between_checks the deadline is iterations * delay_between_checks. Defaults to None.
+            delay_between_checks (int, optional): Kept for compatibility, see iterations. Defaults to None.
+            label (str, optional): Only consider objects with this label. Defaults to None.
+            crd (str, optional): Only wait for the object to exist. Defaults to None.
+            replicas (int, optional): How many ready objects are expected. Defaults to None.
+            timeout (int, optional): Seconds to wait before giving up when iterations and delay_between_checks are not given. Defaults to 600.
+        """
+        def object_ready(output):
+            ready = cls.openshift_ready_check(output=output, crd=crd)
+            if replicas and len(ready) != replicas:
+                return False
+            return bool(ready) and all(ready.values())
+
+        if iterations and delay_between_checks:
+            timeout = iterations * delay_between_checks
+        if cls.openshift_watch(object_ready, timeout=timeout, object_type=openshift_object, namespace=namespace, label=label):
+            if crd:
+                logging.info(f"{crd} exists... continuing to the next step")
             else:
-                if crd:
-                    logging.info(f"{crd} exists... continuing to the next step")
-                    return
-                counter +=1
-        logging.critical(f"{openshift_object} did not become ready after {(iterations*delay_between_checks/60)} minutes")
+                logging.info(f"All of the {openshift_object} are reporting ready")
+                logging.info("Continuing to the next step...")
+            return
+        logging.critical(f"{openshift_object} did not become ready after {timeout/60} minutes")
         exit(1)
 
-    @staticmethod
-    def openshift_waitfor_storage(
+    @classmethod
+    def openshift_waitfor_storage(cls, 
             namespace: str = None, 
             openshift_object: str = None, 
             iterations: int = None, 
             delay_between_checks: int = None,
-            label: str = None
+            label: str = None,
+            timeout: int = 600
             ):
         """
         Description:
@@ -355,39 +388,129 @@ class OpenShiftCommands:
         Args:
             namespace (str, optional): Which namespace (if any) the object resides in. Defaults to None.
             openshift_object (str, optional): What type of object is this (pv or pvc). Defaults to None.
-            iterations (int, optional): Number of checks to run . Defaults to None.
-            delay_between_checks (int, optional): The amount of time in seconds between each check. Defaults to None.
-        """
-        openshift_cmd_arguments = {
-            "object_type": openshift_object,
-            "namespace": namespace,
-            "label": label
-        }
-        object_ready = {}
-        counter = 0
-        while counter <= iterations:
-            OpenShiftCommands.openshift_generic_wait(counter=counter, iterations=iterations, delay_between_checks=delay_between_checks, openshift_object=openshift_object)
-            output = OpenShiftCommands.openshift_get_object(**openshift_cmd_arguments)
-            output = yaml.load(output, Loader=yaml.FullLoader)
-            for x in output['items']:
-                object_name = x['metadata']['name']
-                object_ready[object_name] = False
-                if x['status']['phase'] == "Bound":
-                    object_ready[object_name] = True
-            if all(value == True for value in object_ready.values()):
-                logging.info(f"All of the {openshift_object} are reporting ready")
-                logging.info("Continuing to the next step...")
+            iterations (int, optional): Kept for compatibility, when given with delay_between_checks the deadline is iterations * delay_between_checks. Defaults to None.
+            delay_between_checks (int, optional): Kept for compatibility, see iterations. Defaults to None.
+            label (str, optional): Only consider objects with this label. Defaults to None.
+            timeout (int, optional): Seconds to wait before giving up when iterations and delay_between_checks are not given. Defaults to 600.
+        """
+        def storage_bound(output):
+            phases = [x.get('status', {}).get('phase') for x in output['items']]
+            return bool(phases) and all(phase == "Bound" for phase in phases)
+
+        if iterations and delay_between_checks:
+            timeout = iterations * delay_between_checks
+        if cls.openshift_watch(storage_bound, timeout=timeout, object_type=openshift_object, namespace=namespace, label=label):
+            logging.info(f"All of the {openshift_object} are reporting ready")
+            logging.info("Continuing to the next step...")
+            return
+        logging.critical(f"{openshift_object} did not become ready after {timeout/60} minutes")
+        exit(1)
+
+    @classmethod
+    def openshift_waitfor_subscription(cls, subscription_name: str = None, namespace: str = None, timeout: int = 900) -> None:
+        """
+        Description:
+            Waits for an operator subscription to install its ClusterServiceVersion and for that CSV to succeed
+        Args:
+            subscription_name (str, optional): The name of the Subscription. Defaults to None.
+            namespace (str, optional): The namespace of the Subscription. Defaults to None.
+            timeout (int, optional): Seconds to wait for both steps together. Defaults to 900.
+        """
+        deadline = time.monotonic() + timeout
+        installed_csv = {}
+
+        def csv_installed(output):
+            for subscription in output['items']:
+                if subscription.get('status', {}).get('installedCSV'):
+                    installed_csv['name'] = subscription['status']['installedCSV']
+                    return True
+            return False
+
+        def csv_succeeded(output):
+            return any(csv.get('status', {}).get('phase') == "Succeeded" for csv in output['items'])
+
+        logging.info(f"Waiting for the subscription ---> {subscription_name} <--- to install")
+        if cls.openshift_watch(csv_installed, timeout=timeout, object_type="subscription", object_name=subscription_name, namespace=namespace):
+            remaining = max(deadline - time.monotonic(), 1)
+            if cls.openshift_watch(csv_succeeded, timeout=remaining, object_type="csv", object_name=installed_csv['name'], namespace=namespace):
+                logging.info(f"The operator ---> {installed_csv['name']} <--- is installed")
                 return
-            else:
-                counter +=1
-        logging.critical(f"{openshift_object} did not become ready after {(iterations*delay_between_checks/60)} minutes")
+        logging.critical(f"The subscription {subscription_name} did not finish installing after {timeout/60} minutes")
         exit(1)
 
+    @staticmethod
+    def openshift_watch(is_ready, timeout: int = 600, retry_delay: int = 5, **kwargs) -> bool:
+        """
+        Description:
+            Watches objects with `oc get -w` and returns as soon as is_ready() is True. The objects seen so far
+            are kept up to date from the ADDED/MODIFIED/DELETED events and handed to is_ready() in the same
+            {"items": [...]} form `oc get -o json` returns. If the watch ends early (or the object type does
+            not exist yet) it is started again until the deadline
+        Args:
+            is_ready (callable): Takes {"items": [<object>]} and returns True when waiting can stop
+            timeout (int, optional): Seconds to wait before giving up. Defaults to 600.
+            retry_delay (int, optional): Seconds to wait before restarting a failed watch. Defaults to 5.
+            Takes the same **kwargs as openshift_get_object
+        Returns:
+            bool: True if is_ready() returned True before the deadline
+        """
+        deadline = time.monotonic() + timeout
+        watch_command = OpenShiftCommands.openshift_get_command(**kwargs)
+        watch_command.extend(["-w", "--output-watch-events", "-o", "json"])
+        decoder = json.JSONDecoder()
+        while time.monotonic() < deadline:
+            items = {}
+            # The watch starts by sending an ADDED event for every existing object
+            watch_started = time.perf_counter()
+            process = subprocess.Popen(watch_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            buffer = ""
+            # A read can end in the middle of a multi-byte character, the decoder keeps those bytes for the next read
+            utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    readable, _, _ = select.select([process.stdout], [], [], remaining)
+                    if not readable:
+                        return False
+                    chunk = os.read(process.stdout.fileno(), 65536)
+                    if not chunk:
+                        break
+                    buffer += utf8_decoder.decode(chunk)
+                    changed = False
+                    while True:
+                        buffer = buffer.lstrip()
+                        try:
+                            event, end = decoder.raw_decode(buffer)
+                        except ValueError:
+                            # Wait for the rest of the event
+                            break
+                        buffer = buffer[end:]
+                        watched_object = event.get('object', {})
+                        key = watched_object.get('metadata', {}).get('uid') or watched_object.get('metadata', {}).get('name')
+                        if event.get('type') == "DELETED":
+                            items.pop(key, None)
+                        elif event.get('type') in ("ADDED", "MODIFIED"):
+                            items[key] = watched_object
+                        changed = True
+                    if changed and is_ready({"items": list(items.values())}):
+                        return True
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+                Metrics.observe("oc_command_seconds", time.perf_counter() - watch_started, verb="watch")
+            logging.debug(f"The watch on {kwargs.get('object_type')} ended... restarting")
+            time.sleep(max(0, min(retry_delay, deadline - time.monotonic())))
+        return False
+
     @staticmethod
     def openshift_transfer_file(remote_filename: str = "/tmp/generic.py", 
                                 filename: str = None, 
                                 namespace: str = None, 
-                                pod_name: str = None):
+                                pod_name: str = None,
+                                kubeconfig: str = None):
         """
         Description: 
             Transfers a file to a pod
@@ -397,12 +520,15 @@ class OpenShiftCommands:
             filename (str, optional): The path to the local file you intend to transfer. Defaults to None.
             namespace (str, optional): Namespace where the pod resides. Defaults to None.
             pod_name (str, optional): Name of the pod to transfer files to. Defaults to None.
+            kubeconfig (str, optional): The kubeconfig to use instead of the default one. Defaults to None.
         """
         ocp_cmd = ["oc", "cp", filename, f"{namespace}/{pod_name}:{remote_filename}"]
-        return(subprocess.check_output(ocp_cmd))
+        if kubeconfig:
+            ocp_cmd.extend(["--kubeconfig", kubeconfig])
+        return(OpenShiftCommands.run_oc(ocp_cmd))
     
     @staticmethod
-    def openshift_exec_pod(command: list = None, pod_name: str = None, namespace: str = None):
+    def openshift_exec_pod(command: list = None, pod_name: str = None, namespace: str = None, kubeconfig: str = None):
         """
         Description: 
             Execs into a pod to run a command
@@ -411,14 +537,50 @@ class OpenShiftCommands:
             command (list, optional): A command broken into a list that subprocess can recognize. Defaults to None.
             pod_name (str, optional): Name of the pod to exec into. Defaults to None.
             namespace (str, optional): Namespace where the pod resides. Defaults to None.
+            kubeconfig (str, optional): The kubeconfig to use instead of the default one. Defaults to None.
         
         Returns: 
             the response from subprocess
         """
-        ocp_cmd = ["oc", "exec", "-n", namespace, "-it", pod_name, "--"]
+        ocp_cmd = ["oc", "exec", "-n", namespace, "-it", pod_name]
+        if kubeconfig:
+            ocp_cmd.extend(["--kubeconfig", kubeconfig])
+        ocp_cmd.append("--")
         ocp_cmd.extend(command)
-        return(subprocess.check_output(ocp_cmd))
+        return(OpenShiftCommands.run_oc(ocp_cmd))
     
+    @staticmethod
+    def openshift_exec_pod_script(script: str = None, pod_name: str = None, namespace: str = None,
+                                  interpreter: str = "/usr/bin/python", kubeconfig: str = None) -> dict:
+        """
+        Description:
+            Pipes a python script into a pod over stdin and runs it with a single `oc exec`.
+            Nothing is copied into the pod so concurrent runs cannot overwrite each other's scripts.
+            The script is expected to print JSON as the last line of its output
+        Args:
+            script (str, optional): The python script to run. Defaults to None.
+            pod_name (str, optional): Name of the pod to exec into. Defaults to None.
+            namespace (str, optional): Namespace where the pod resides. Defaults to None.
+            interpreter (str, optional): The python inside the pod. Defaults to "/usr/bin/python".
+            kubeconfig (str, optional): The kubeconfig to use instead of the default one. Defaults to None.
+        Returns:
+            dict: The JSON printed by the script. {"error": <str>} if the script failed without printing JSON
+        """
+        ocp_cmd = ["oc", "exec", "-i", "-n", namespace, pod_name]
+        if kubeconfig:
+            ocp_cmd.extend(["--kubeconfig", kubeconfig])
+        ocp_cmd.extend(["--", interpreter, "-"])
+        with Metrics.timer("oc_command_seconds", verb="exec"):
+            completed = subprocess.run(ocp_cmd, input=script.encode(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if completed.returncode:
+            Metrics.increment("oc_command_failures_total", verb="exec")
+        output_lines = [line for line in completed.stdout.decode().splitlines() if line.strip()]
+        try:
+            return json.loads(output_lines[-1])
+        except (IndexError, ValueError):
+            logging.debug(completed.stderr.decode())
+            return {"error": f"{pod_name} returned {completed.returncode}: {completed.stderr.decode().strip()}"}
+
     @staticmethod
     def openshift_process_secret(secret: dict = None) -> dict:
         """
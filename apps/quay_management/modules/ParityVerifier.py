@@ -0,0 +1,232 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .Metrics import Metrics
+from .MirrorEngine import MirrorEngine
+from .QuayAPI import QuayAPIError
+
+
+class ParityVerifier:
+    def __init__(self, primary_quay_api, destinations: list, digest_backend=None, state=None, max_workers: int = 16) -> None:
+        """
+        Description:
+            Checks that every destination has the same tags as the primary, pointing at the same manifests, without
+            copying anything. Tags and their manifest digests are read from the paged tag listing of each repository,
+            which costs one API call per 100 tags on each side. A registry HEAD request is only made for a tag whose
+            listing has no digest. Blobs are never downloaded. Repositories are checked by a pool of workers
+        Args:
+            primary_quay_api (QuayAPI): The primary's API
+            destinations (list): [{"name": <str>, "quay_api": <QuayAPI>}] for every destination
+            digest_backend (CopyBackend, optional): Used for the HEAD requests when a tag listing has no digest. Defaults to None (such tags are reported as stale).
+            state (SyncState, optional): When a destination digest differs from the primary, a tag that the state recorded as mirrored
+                                         from the current primary digest to the current destination digest counts as matching.
+                                         podman can rewrite a manifest when it pushes. Defaults to None.
+            max_workers (int, optional): How many repositories are checked at the same time. Defaults to 16.
+        """
+        self.primary_quay_api = primary_quay_api
+        self.destinations = destinations
+        self.digest_backend = digest_backend
+        self.state = state
+        self.max_workers = max(1, max_workers)
+        self.primary_registry = MirrorEngine.registry_from_image(primary_quay_api.base_url)
+
+    def list_tags(self, quay_api, repository: str, wanted_tags: set = None) -> dict:
+        """
+        Description:
+            Lists the tags of a repository with the digest each one points to
+        Args:
+            quay_api (QuayAPI): The API of the side to list
+            repository (str): <org>/<repo>
+            wanted_tags (set, optional): Only return these tags. Defaults to None (every tag).
+        Returns:
+            dict: {<tag>: <manifest digest or None>}
+        Raises:
+            QuayAPIError: If the listing could not be read to the end
+        """
+        tags = {}
+        for tag in quay_api.iter_tags(f"/repository/{repository}"):
+            if wanted_tags is not None and tag['name'] not in wanted_tags:
+                continue
+            digest = tag.get("manifest_digest")
+            if not digest and self.digest_backend:
+                digest = self.digest_backend.manifest_digest(f"{quay_api.base_url}/{repository}:{tag['name']}")
+            tags[tag['name']] = digest
+        return tags
+
+    @staticmethod
+    def list_repositories(quay_api, namespace: str) -> set:
+        """
+        Description:
+            Lists the repositories in a namespace on one side
+        Args:
+            quay_api (QuayAPI): The API of the side to list
+            namespace (str): The organization or user to look in
+        Returns:
+            set: <org>/<repo> of every repository found
+        Raises:
+            QuayAPIError: If the listing could not be read to the end
+        """
+        return {f"{namespace}/{repository['name']}" for repository in quay_api.iter_namespace_repositories(namespace)}
+
+    def matches(self, destination_registry: str, image: str, source_digest: str, destination_digest: str) -> bool:
+        """
+        Description:
+            Checks if a tag on a destination is the image the primary has
+        Args:
+            destination_registry (str): The destination's registry hostname
+            image (str): <org>/<repo>:<tag>
+            source_digest (str): The digest on the primary
+            destination_digest (str): The digest on the destination
+        Returns:
+            bool: True if the digests are the same, or the state recorded this exact pair as a successful copy
+        """
+        if not source_digest or not destination_digest:
+            return False
+        if source_digest == destination_digest:
+            return True
+        if not self.state:
+            return False
+        recorded = self.state.get_tag(self.primary_registry, destination_registry, image)
+        return bool(recorded) and recorded["source_digest"] == source_digest and recorded["destination_digest"] == destination_digest
+
+    def verify_repository(self, repository: str, present_on: list, wanted_tags: set = None, on_primary: bool = True, wanted_digests: set = None) -> dict:
+        """
+        Description:
+            Compares one repository on the primary with every destination
+        Args:
+            repository (str): <org>/<repo>
+            present_on (list): For each destination, True if the repository exists there, or None if that is not known
+            wanted_tags (set, optional): Only compare these tags and do not report extra tags. Defaults to None (every tag).
+            on_primary (bool, optional): False for a repository only the destinations have. Defaults to True.
+            wanted_digests (set, optional): Manifest digests pinned by <org>/<repo>@<digest> images. Each one matches if the destination
+                                            has that manifest, which needs a registry HEAD request. Defaults to None.
+        Returns:
+            dict: {<destination name>: {"matching": <int>, "missing": [<image>], "stale": [<image>], "extra": [<image>],
+                   "unverified": [<org>/<repo>] when the destination could not be listed, or [<org>/<repo>@<digest>] with no digest_backend}}
+        Raises:
+            QuayAPIError: If the primary's tags could not be listed
+        """
+        # A repository only wanted for pinned digests has no tags to list
+        list_wanted = wanted_tags is None or bool(wanted_tags)
+        source_tags = self.list_tags(self.primary_quay_api, repository, wanted_tags) if on_primary and list_wanted else {}
+        results = {}
+        for destination, present in zip(self.destinations, present_on):
+            result = results[destination["name"]] = {"matching": 0, "missing": [], "stale": [], "extra": [], "unverified": []}
+            if present is None:
+                result["unverified"].append(repository)
+                continue
+            try:
+                destination_tags = self.list_tags(destination["quay_api"], repository, wanted_tags) if present and list_wanted else {}
+            except QuayAPIError as e:
+                logging.error(f"Could not list ---> {repository} <--- on {destination['name']}: {e}")
+                result["unverified"].append(repository)
+                continue
+            destination_registry = MirrorEngine.registry_from_image(destination["quay_api"].base_url)
+            for tag, source_digest in source_tags.items():
+                image = f"{repository}:{tag}"
+                if tag not in destination_tags:
+                    result["missing"].append(image)
+                elif self.matches(destination_registry, image, source_digest, destination_tags[tag]):
+                    result["matching"] += 1
+                else:
+                    result["stale"].append(image)
+            for digest in wanted_digests or ():
+                image = f"{repository}@{digest}"
+                if not self.digest_backend:
+                    result["unverified"].append(image)
+                elif present and self.digest_backend.manifest_digest(f"{destination['quay_api'].base_url}/{image}"):
+                    result["matching"] += 1
+                else:
+                    result["missing"].append(image)
+            if wanted_tags is None:
+                result["extra"] = [f"{repository}:{tag}" for tag in destination_tags if tag not in source_tags]
+        return results
+
+    def verify(self, images: list = None) -> dict:
+        """
+        Description:
+            Compares the primary with every destination and logs each missing, stale and extra tag.
+            Missing means the primary has a tag the destination does not, stale that the tag points at a different
+            manifest, and extra that the destination has a tag the primary does not
+        Args:
+            images (list, optional): Only compare these <org>/<repo>:<tag> or <org>/<repo>@<digest> images, without looking for extra tags.
+                                     Defaults to None (every repository on the primary, and any repository a destination has in the same namespaces).
+        Returns:
+            dict: {<destination name>: {"matching": <int>, "missing": [<image>], "stale": [<image>], "extra": [<image>],
+                   "unverified": [<org>/<repo> that could not be listed, or <org>/<repo>@<digest> with no digest_backend to check it]}}
+        Raises:
+            QuayAPIError: If the repositories on the primary could not be listed
+        """
+        start_time = time.perf_counter()
+        wanted = None
+        wanted_digests = {}
+        if images is not None:
+            wanted = {}
+            for image in images:
+                # A digest contains a colon as well, so it is split off first
+                if "@" in image:
+                    repository, digest = image.split("@", 1)
+                    wanted.setdefault(repository, set())
+                    wanted_digests.setdefault(repository, set()).add(digest)
+                    continue
+                repository, tag = image.rsplit(":", 1) if ":" in image.split("/")[-1] else (image, "latest")
+                wanted.setdefault(repository, set()).add(tag)
+        report = {destination["name"]: {"matching": 0, "missing": [], "stale": [], "extra": [], "unverified": []} for destination in self.destinations}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="verify") as executor:
+            if wanted is None:
+                source_repositories = {repository['href'].split("/", 2)[-1] for repository in self.primary_quay_api.iter_repositories()}
+            else:
+                source_repositories = set(wanted)
+            namespaces = {repository.split("/")[0] for repository in source_repositories}
+            # Destinations are listed by namespace, so a destination that has none of the repositories yet is not an error
+            listings = [{namespace: executor.submit(self.list_repositories, destination["quay_api"], namespace)
+                         for namespace in (namespaces if wanted else namespaces | destination["quay_api"].get_org_names())}
+                        for destination in self.destinations]
+            # [(<repositories found>, <namespaces that could not be listed>)] for each destination
+            destination_repositories = []
+            for destination, destination_listings in zip(self.destinations, listings):
+                found, failed_namespaces = set(), set()
+                for namespace, listing in destination_listings.items():
+                    try:
+                        found.update(listing.result())
+                    except QuayAPIError as e:
+                        logging.error(f"Could not list the repositories in ---> {namespace} <--- on {destination['name']}: {e}")
+                        failed_namespaces.add(namespace)
+                destination_repositories.append((found, failed_namespaces))
+            repositories = set(source_repositories)
+            if wanted is None:
+                for found, _ in destination_repositories:
+                    repositories.update(found)
+
+            def present_on(repository):
+                # None when the namespace could not be listed, the repository can not be compared on that destination
+                return [True if repository in found else None if repository.split("/")[0] in failed_namespaces else False
+                        for found, failed_namespaces in destination_repositories]
+
+            logging.info(f"Comparing {len(repositories)} repositories on ---> {self.primary_quay_api.base_url} <--- with {len(self.destinations)} destinations")
+            futures = {executor.submit(self.verify_repository, repository, present_on(repository),
+                                       wanted.get(repository) if wanted else None, repository in source_repositories,
+                                       wanted_digests.get(repository)): repository
+                       for repository in sorted(repositories)}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logging.error(f"Could not compare ---> {futures[future]} <---: {e}")
+                    for result in report.values():
+                        result["unverified"].append(futures[future])
+                    continue
+                for name, result in results.items():
+                    report[name]["matching"] += result["matching"]
+                    for kind in ("missing", "stale", "extra", "unverified"):
+                        report[name][kind].extend(result[kind])
+        for name, result in report.items():
+            for kind in ("missing", "stale", "extra", "unverified"):
+                for image in sorted(result[kind]):
+                    logging.warning(f"{name} {kind} ---> {image} <---")
+            for kind in ("missing", "stale", "extra"):
+                Metrics.increment("verify_tags_total", len(result[kind]), destination=name, result=kind)
+            Metrics.increment("verify_tags_total", result["matching"], destination=name, result="matching")
+            logging.info(f"{name} ---> {result['matching']} matching, {len(result['missing'])} missing, {len(result['stale'])} stale, {len(result['extra'])} extra, {len(result['unverified'])} repositories unverified <---")
+        logging.info(f"Verified {len(repositories)} repositories in {time.perf_counter() - start_time:.1f} seconds")
+        return report
@@ -1,49 +1,205 @@
 import socket
+import ssl
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from .Metrics import Metrics
 
 class PreflightChecker:
+    # Seconds each step of a check may take before the endpoint is treated as unreachable
+    timeout = 5
+
     def __init__(self):
         pass
 
-    def check_dns(self, server: str) -> bool:
+    @staticmethod
+    def host_and_port(server: str) -> tuple:
+        """
+        Description:
+            Splits a server URL into the hostname and port. The port comes from the URL if it has one,
+            otherwise 80 for http:// and 443 for everything else
+        Args:
+            server: The server URL, with or without the scheme
+        Returns:
+            tuple: (<hostname>, <port>)
+        """
+        if "//" not in server:
+            server = "https://" + server
+        parsed = urlsplit(server)
+        return parsed.hostname, parsed.port or (80 if parsed.scheme == "http" else 443)
+
+    @classmethod
+    def resolve(cls, host: str, port: int, timeout: float = None) -> tuple:
+        """
+        Description:
+            Looks up a host with a timeout. getaddrinfo() has no timeout of its own, so it runs on a
+            daemon thread that is abandoned if the resolver does not answer in time
+        Args:
+            host (str): The hostname
+            port (int): The port, used to pick the address family and socket type
+            timeout (float, optional): Seconds to wait. Defaults to PreflightChecker.timeout.
+        Returns:
+            tuple: The first (<family>, <type>, <proto>, <canonname>, <sockaddr>) from getaddrinfo()
+        Raises:
+            socket.gaierror: If the name does not resolve
+            TimeoutError: If the resolver did not answer in time
+        """
+        result = {}
+
+        def lookup():
+            try:
+                result["addresses"] = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            except OSError as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=lookup, name=f"resolve-{host}", daemon=True)
+        thread.start()
+        thread.join(timeout or cls.timeout)
+        if thread.is_alive():
+            raise TimeoutError(f"DNS lookup for {host} timed out after {timeout or cls.timeout} seconds")
+        if "error" in result:
+            raise result["error"]
+        return result["addresses"][0]
+
+    def check_dns(self, server: str, timeout: float = None) -> bool:
         """
-        Description: 
+        Description:
             Checks if the specified server can be resolved by DNS.
         Args:
             server: The server to check.
+            timeout (float, optional): Seconds to wait for the resolver. Defaults to PreflightChecker.timeout.
         Returns:
             True if the server can be resolved, False otherwise.
         """
-        if "//" in server:
-            # If there is http:// or https:// we need to strip that to do dns lookups
-            server = server.split("//")[1:][0]
+        # If there is http:// or https:// or a port we need to strip that to do dns lookups
+        server, port = self.host_and_port(server)
         try:
-            ip_address = socket.gethostbyname(server)
+            ip_address = self.resolve(server, port, timeout)[4][0]
             logging.info(f"{server} resolves to --> {ip_address} <--")
             return True
-        except socket.gaierror:
+        except (socket.gaierror, TimeoutError):
             logging.critical(f"--> DNS lookup failed for host {server} <----")
             exit(1)
 
-    def check_port(self, server: str) -> bool:
+    def check_port(self, server: str, timeout: float = None) -> bool:
         """
         Description:
-            Checks if the specified server is listening on the specified port.
+            Checks if the specified server is listening on the port in its URL (443 if there is none).
         Args:
             server: The server to check.
-            port: The port to check.
+            timeout (float, optional): Seconds to wait for the connection. Defaults to PreflightChecker.timeout.
         Returns:
             True if the server is listening on the specified port, False otherwise.
         """
-        if "//" in server:
-            # If there is http:// or https:// we need to strip that to do dns lookups
-            server = server.split("//")[1:][0]
-        quay_port = 443
+        server, quay_port = self.host_and_port(server)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((server, quay_port))
+            sock = socket.create_connection((server, quay_port), timeout=timeout or self.timeout)
+            sock.close()
             logging.info(f"{server} is listening on port {quay_port}")
             return True
-        except ConnectionRefusedError:
-            logging.critical("%s refused the connection on port %s" % quay_port)
+        except OSError as e:
+            logging.critical("%s did not accept a connection on port %s: %s" % (server, quay_port, e))
+            exit(1)
+
+    @classmethod
+    def probe(cls, server: str, path: str = "/", timeout: float = None, verify_tls: bool = True) -> dict:
+        """
+        Description:
+            Times each step of reaching an HTTP(S) endpoint: the DNS lookup, the TCP connect, the TLS
+            handshake (https only) and the time from sending a GET to the first byte of the response.
+            Any HTTP response counts as reachable, even an error status. Every step has its own timeout
+        Args:
+            server (str): The server URL
+            path (str, optional): The path to request. Defaults to "/".
+            timeout (float, optional): Seconds each step may take. Defaults to PreflightChecker.timeout.
+            verify_tls (bool, optional): Verify the server certificate. Defaults to True.
+        Returns:
+            dict: {"server": <str>, "host": <str>, "port": <int>, "address": <str>, "dns_seconds": <float>, "connect_seconds": <float>,
+                   "tls_seconds": <float or None>, "first_byte_seconds": <float>, "status": <str>, "error": <str or None>}
+        """
+        timeout = timeout or cls.timeout
+        host, port = cls.host_and_port(server)
+        result = {"server": server, "host": host, "port": port, "address": None, "dns_seconds": None, "connect_seconds": None,
+                  "tls_seconds": None, "first_byte_seconds": None, "status": None, "error": None}
+        step = "dns"
+        sock = None
+        try:
+            start = time.perf_counter()
+            family, socket_type, proto, _, address = cls.resolve(host, port, timeout)
+            result["dns_seconds"] = time.perf_counter() - start
+            result["address"] = address[0]
+
+            step = "connect"
+            start = time.perf_counter()
+            sock = socket.socket(family, socket_type, proto)
+            sock.settimeout(timeout)
+            sock.connect(address)
+            result["connect_seconds"] = time.perf_counter() - start
+
+            if not server.startswith("http://"):
+                step = "tls"
+                context = ssl.create_default_context()
+                if not verify_tls:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                start = time.perf_counter()
+                sock = context.wrap_socket(sock, server_hostname=host)
+                result["tls_seconds"] = time.perf_counter() - start
+
+            step = "first_byte"
+            start = time.perf_counter()
+            sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: quay-sync-preflight\r\nConnection: close\r\n\r\n".encode())
+            status_line = sock.recv(64)
+            result["first_byte_seconds"] = time.perf_counter() - start
+            if not status_line:
+                raise ConnectionError("the server closed the connection without answering")
+            result["status"] = status_line.split(b"\r\n")[0].decode(errors="replace")
+        except (OSError, ssl.SSLError) as e:
+            result["error"] = f"{step} failed: {e}"
+        finally:
+            if sock:
+                sock.close()
+        return result
+
+    @classmethod
+    def probe_all(cls, endpoints: dict, timeout: float = None, verify_tls: bool = True, required: bool = True) -> dict:
+        """
+        Description:
+            Probes every endpoint at the same time, so a host that does not answer costs at most a few timeouts
+            instead of delaying each check after it. The timings are logged and exported as metrics
+        Args:
+            endpoints (dict): {<name>: <server URL> or (<server URL>, <path>)}
+            timeout (float, optional): Seconds each step may take. Defaults to PreflightChecker.timeout.
+            verify_tls (bool, optional): Verify server certificates. Defaults to True.
+            required (bool, optional): Exit if any endpoint can not be reached. Defaults to True.
+        Returns:
+            dict: {<name>: <the result of probe()>}
+        """
+        endpoints = {name: target if isinstance(target, tuple) else (target, "/") for name, target in endpoints.items() if target}
+        if not endpoints:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(endpoints), thread_name_prefix="preflight") as executor:
+            futures = {name: executor.submit(cls.probe, server, path, timeout, verify_tls) for name, (server, path) in endpoints.items()}
+            results = {name: future.result() for name, future in futures.items()}
+
+        def milliseconds(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+        failed = []
+        for name, result in results.items():
+            for stage in ("dns", "connect", "tls", "first_byte"):
+                if result[f"{stage}_seconds"] is not None:
+                    Metrics.set_gauge("preflight_seconds", result[f"{stage}_seconds"], endpoint=name, stage=stage)
+            if result["error"]:
+                failed.append(name)
+                logging.error(f"{name} ---> {result['host']}:{result['port']} <--- {result['error']}")
+                continue
+            logging.info(f"{name} ---> {result['host']}:{result['port']} ({result['address']}) <--- dns {milliseconds(result['dns_seconds'])}, "
+                         f"connect {milliseconds(result['connect_seconds'])}, tls {milliseconds(result['tls_seconds'])}, "
+                         f"first byte {milliseconds(result['first_byte_seconds'])}")
+        if failed and required:
+            logging.critical(f"Preflight failed for ---> {', '.join(failed)} <---")
             exit(1)
+        return results
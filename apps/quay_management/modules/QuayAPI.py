@@ -1,7 +1,69 @@
 import logging
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import json 
+from urllib.parse import urlsplit
+from .RequestScheduler import RequestScheduler
+from .Metrics import Metrics
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    Description:
+        A requests HTTPAdapter that calls on_connect() every time the pool has to open a brand new
+        TCP (and TLS) connection. Requests that go out over a kept-alive connection are not counted.
+    """
+    def __init__(self, on_connect=None, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_connect = self.on_connect
+
+        class CountingHTTPConnection(HTTPConnection):
+            def connect(self):
+                on_connect()
+                super().connect()
+
+        class CountingHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                on_connect()
+                super().connect()
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = CountingHTTPConnection
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = CountingHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+class QuayAPIError(Exception):
+    """
+    Description:
+        Raised when a listing could not be read to the end, so a partial listing is never mistaken for a complete one
+    """
+    pass
+
 class QuayAPI:
+    # A single pooled session is shared by every QuayAPI instance so that TCP/TLS connections
+    # are kept alive and reused between API calls instead of being renegotiated every time
+    session = None
+    session_lock = threading.Lock()
+    pool_size = 10
+    connect_timeout = 10
+    read_timeout = 60
+    connection_counters = {"requests": 0, "connections": 0}
+    # Paces requests per server and retries throttled or failed idempotent calls
+    scheduler = RequestScheduler()
+    # Path segments that are part of an endpoint rather than the name of an object. See endpoint_name()
+    endpoint_words = {"applications", "find", "initialize", "logs", "members", "organization", "organizations", "permissions",
+                      "proxycache", "repositories", "repository", "robots", "superuser", "tag", "team", "user", "users"}
+
     def __init__(self, base_url: str = None, api_token: str = None, robot_acct: dict = None) -> None:
         """
         Description: 
@@ -19,6 +81,7 @@ class QuayAPI:
         self.org_endpoint = "/api/v1/organization/"
         self.org_member_list_endpoint = f"{self.org_endpoint}/<org>/members"
         self.org_list_endpoint = "/api/v1/superuser/organizations/"
+        self.logs_endpoint = f"{self.base_url}/api/v1/superuser/logs"
         self.org_member_add_endpoint = "/api/v1/organization/<org>/team/<team_name>/members/<new_member>"
         # The <org> is a placeholder so that it can be replaced as needed
         self.proxycache_url = f"{self.base_url}/api/v1/organization/<org>/proxycache"
@@ -47,6 +110,123 @@ class QuayAPI:
         self.robot_acct = robot_acct
 
 
+    @classmethod
+    def configure_session(cls, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None) -> None:
+        """
+        Description:
+            Changes the settings of the shared HTTP session. Any existing session is closed and
+            a new one is created the next time a request is made
+        Args:
+            pool_size (int, optional): The maximum number of keep-alive connections kept per server. Defaults to None (unchanged).
+            connect_timeout (float, optional): Seconds to wait for a TCP/TLS connection to be established. Defaults to None (unchanged).
+            read_timeout (float, optional): Seconds to wait for the server to send a response. Defaults to None (unchanged).
+        """
+        with cls.session_lock:
+            if pool_size:
+                cls.pool_size = pool_size
+            if connect_timeout:
+                cls.connect_timeout = connect_timeout
+            if read_timeout:
+                cls.read_timeout = read_timeout
+            if cls.session is not None:
+                cls.session.close()
+                cls.session = None
+
+    @classmethod
+    def configure_scheduler(cls, rate: float = 0, max_concurrency: int = 32, max_retries: int = 4) -> None:
+        """
+        Description:
+            Replaces the request scheduler shared by every QuayAPI instance
+        Args:
+            rate (float, optional): Requests per second allowed to each Quay server. 0 means no rate limit. Defaults to 0.
+            max_concurrency (int, optional): The most concurrent requests allowed to one server. Lowered automatically on 429/503. Defaults to 32.
+            max_retries (int, optional): How many times an idempotent call is retried. Defaults to 4.
+        """
+        cls.scheduler = RequestScheduler(rate=rate, max_concurrency=max_concurrency, max_retries=max_retries)
+
+    @classmethod
+    def count_connection(cls, counter: str = "connections") -> None:
+        """
+        Description:
+            Increments one of the connection counters reported by connection_stats()
+        Args:
+            counter (str, optional): Either "requests" or "connections". Defaults to "connections".
+        """
+        with cls.session_lock:
+            cls.connection_counters[counter] += 1
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        """
+        Description:
+            Returns the shared HTTP session, creating it on first use
+        Returns:
+            requests.Session: A session with a connection pool mounted for http and https
+        """
+        with cls.session_lock:
+            if cls.session is None:
+                session = requests.Session()
+                adapter = CountingHTTPAdapter(on_connect=cls.count_connection, pool_connections=10, pool_maxsize=cls.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls.session = session
+            return cls.session
+
+    @classmethod
+    def connection_stats(cls) -> dict:
+        """
+        Description:
+            Reports how well the shared session is reusing connections
+        Returns:
+            dict: {"requests": <int>, "connections": <int>, "reused": <int>}. "reused" is the number of
+                  requests that did not need a new TCP/TLS handshake
+        """
+        with cls.session_lock:
+            counters = dict(cls.connection_counters)
+        counters["reused"] = max(counters["requests"] - counters["connections"], 0)
+        return counters
+
+    def request(self, method: str, url: str, headers: dict = None, data: dict = None, params: dict = None) -> requests.Response:
+        """
+        Description:
+            Sends a request through the shared session using the configured timeouts. The request is
+            paced by the scheduler and retried with backoff if Quay is overloaded
+        Args:
+            method (str): The HTTP method, GET, POST, PUT, DELETE etc
+            url (str): The full URL to send the request to
+            headers (dict, optional): The headers to send. Defaults to None.
+            data (dict, optional): A dict to send as the JSON body. Defaults to None.
+            params (dict, optional): Query string parameters. Defaults to None.
+        Returns:
+            requests.Response: The response object from the API
+        """
+        def send_request():
+            self.count_connection("requests")
+            return self.get_session().request(method, f'{url}', headers=headers, json=data, params=params,
+                                              timeout=(self.connect_timeout, self.read_timeout))
+        endpoint = self.endpoint_name(url)
+        with Metrics.timer("quay_api_request_seconds", method=method, endpoint=endpoint):
+            response = self.scheduler.send(urlsplit(f'{url}').netloc, method, send_request)
+        Metrics.increment("quay_api_responses_total", method=method, endpoint=endpoint, code=response.status_code)
+        return response
+
+    @classmethod
+    def endpoint_name(cls, url: str) -> str:
+        """
+        Description:
+            Turns a URL into an endpoint name for metrics by replacing the names of organizations, repositories,
+            users and so on with <name>, so every organization shares the same series
+        Args:
+            url (str): The full URL of the request
+        Returns:
+            str: The endpoint, for example /organization/<name>/team/<name>/members/<name>
+        """
+        path = urlsplit(f'{url}').path
+        if path.startswith("/api/v1"):
+            path = path[len("/api/v1"):]
+        segments = [segment if segment in cls.endpoint_words else "<name>" for segment in path.split("/") if segment]
+        return "/" + "/".join(segments)
+
     def assemble_org_url(self, org_name: str = None, url_to_replace: str = None) -> str:
         """
         Description: 
@@ -240,7 +420,7 @@ class QuayAPI:
     def delete_data(self, data: dict = None, url: str = None, headers_required=True, headers: str = None) -> dict:
         """
         Description:
-            Deletes data from a specified URL using the requests library.
+            Deletes data from a specified URL using the shared requests session.
         Args:
             data (dict): The data to be deleted.
             url (str): The URL to delete the data from.
@@ -251,9 +431,9 @@ class QuayAPI:
         if not headers:
             headers = self.headers
         if headers_required:
-            return(requests.delete(f'{url}', headers=headers, json=data))
+            return(self.request("DELETE", url, headers=headers, data=data))
         else:
-            return(requests.delete(f'{url}', json=data))
+            return(self.request("DELETE", url, data=data))
 
     def delete_proxycache(self, org_name: str = None):
         """
@@ -300,12 +480,13 @@ class QuayAPI:
             client_id = response_dict['client_id']
         return client_id
 
-    def get_data(self, url: str = None, override_headers: bool = False, additional_api_key: str = None) -> dict:
+    def get_data(self, url: str = None, override_headers: bool = False, additional_api_key: str = None, params: dict = None) -> dict:
         """
         Description: 
             Fetches data from the Quay API.
         Args:
             url (str): The URL to fetch data from. If not specified, uses the default Quay repository URI.
+            params (dict, optional): Query string parameters such as page. Defaults to None.
         Returns:
             dict: A dictionary containing the JSON response from the API.
         """
@@ -315,15 +496,20 @@ class QuayAPI:
             headers = {'Authorization': f'Bearer {additional_api_key}'}
         else:
             headers = self.headers
-        response = requests.get(f'{url}', headers=headers)
+        try:
+            response = self.request("GET", url, headers=headers, params=params)
+        except requests.exceptions.RequestException as e:
+            logging.error("Error getting data from %s: %s", url, e)
+            return None
         # Check the response status code
         if response.status_code != 200:
             logging.error("Error getting data from %s: %s", url, response.status_code)
             return None
         elif response.content:
             output = json.loads(response.content)
+            # An empty first page means the token can not see anything. A later page (numbered or from a next_page token) may be empty
             if "results" in output:
-                if not bool(output["results"]):
+                if not bool(output["results"]) and not (params and (params.get("page", 1) > 1 or params.get("next_page"))):
                     logging.critical("Problem getting information from the API... Check that your API key is correct")
                     exit(1)
 
@@ -335,18 +521,94 @@ class QuayAPI:
     def get_tag_info(self, href: str) -> list:
         """
         Description: 
-            Gets information about tags in a Quay repository.
+            Gets information about tags in a Quay repository. Every page of tags is read.
         Args:
             href (str): The href of the repository to fetch tag information for.
         Returns:
-            list: A list of dictionaries, each representing a tag in the repository.
+            list: A list of tag names in the repository.
         """
-        working_url = f"{self.base_url}/api/v1{href}/tag"
-        tag_info = self.get_data(url=working_url)
         tag_list = []
-        for tag in tag_info['tags']:
-            tag_list.append(tag['name'])
+        for tag in self.iter_tags(href):
+            if tag['name'] not in tag_list:
+                tag_list.append(tag['name'])
         return tag_list
+
+    def iter_pages(self, url: str = None, items_key: str = "results", params: dict = None):
+        """
+        Description:
+            Generator that follows Quay's pagination and yields each item as its page arrives.
+            Quay uses two styles of pagination, a numbered page with has_additional, and an
+            opaque next_page token. Both are followed. Only a single page is held in memory at a time.
+        Args:
+            url (str, optional): The paginated endpoint. Defaults to the repository search endpoint.
+            items_key (str, optional): The key in the response which holds the list of items. Defaults to "results".
+            params (dict, optional): Any extra query string parameters. Defaults to None.
+        Yields:
+            dict: One item from the list in items_key
+        Raises:
+            QuayAPIError: If a page could not be read
+        """
+        params = dict(params or {})
+        while True:
+            page = self.get_data(url=url, params=params)
+            if page is None:
+                raise QuayAPIError(f"Stopped reading {url or self.repo_endpoint} at page {params.get('page', 1)}")
+            for item in page.get(items_key, []):
+                yield item
+            if page.get("next_page"):
+                params["next_page"] = page["next_page"]
+            elif page.get("has_additional"):
+                params["page"] = page.get("page", params.get("page", 1)) + 1
+            else:
+                return
+
+    def iter_logs(self, start_date: str, end_date: str) -> dict:
+        """
+        Description:
+            Generator that yields the audit log entries of every organization, newest first, one page at a time.
+            Needs a superuser token
+        Args:
+            start_date (str): The first day to read, in UTC as MM/DD/YYYY
+            end_date (str): The last day to read, in UTC as MM/DD/YYYY
+        Yields:
+            dict: A log entry from the API, including 'kind', 'datetime' and 'metadata'
+        """
+        yield from self.iter_pages(url=self.logs_endpoint, items_key="logs", params={"starttime": start_date, "endtime": end_date})
+
+    def iter_repositories(self, query: str = "") -> dict:
+        """
+        Description:
+            Generator that yields every repository the token can see, one page at a time
+        Args:
+            query (str, optional): Search string passed to the find/repositories endpoint. Defaults to "" (everything).
+        Yields:
+            dict: A repository from the API, including 'namespace' and 'href'
+        """
+        yield from self.iter_pages(url=self.repo_endpoint, items_key="results", params={"query": query})
+
+    def iter_namespace_repositories(self, namespace: str) -> dict:
+        """
+        Description:
+            Generator that yields every repository in one organization or user namespace, one page at a time.
+            Unlike iter_repositories() an empty namespace is not treated as an error
+        Args:
+            namespace (str): The organization or user
+        Yields:
+            dict: A repository from the API, including 'namespace' (the name as a string) and 'name'
+        """
+        yield from self.iter_pages(url=f"{self.base_url}/api/v1/repository", items_key="repositories", params={"namespace": namespace})
+
+    def iter_tags(self, href: str) -> dict:
+        """
+        Description:
+            Generator that yields every active tag in a repository, one page at a time
+        Args:
+            href (str): The href of the repository, for example /repository/<org>/<repo>
+        Yields:
+            dict: A tag from the API, including 'name' and 'manifest_digest'
+        """
+        working_url = f"{self.base_url}/api/v1{href}/tag"
+        yield from self.iter_pages(url=working_url, items_key="tags", params={"onlyActiveTags": "true", "limit": 100})
     
     def get_org(self, override_headers: bool = False, additional_api_key: str = None) -> dict:
         """
@@ -367,6 +629,20 @@ class QuayAPI:
         url = f'{self.base_url}{self.org_list_endpoint}'
         return self.get_data(url=url)
     
+    def get_org_names(self) -> set:
+        """
+        Description:
+            Gets the names of every organization in a single pass. The superuser organization list is
+            used when the token allows it, otherwise the namespaces of the visible repositories are used
+        Returns:
+            set: The organization names
+        """
+        orgs = self.get_org()
+        if orgs and "organizations" in orgs:
+            return {org['name'] for org in orgs['organizations']}
+        logging.warning(f"Could not list organizations on {self.base_url}... falling back to repository namespaces")
+        return {repository['namespace']['name'] for repository in self.iter_repositories()}
+
     def get_org_members(self, org_name: str = None) -> dict:
         """
         Description:
@@ -412,7 +688,7 @@ class QuayAPI:
     def post_data(self, data: dict = None, url: str = None, headers_required=True, headers: str = None ) -> dict:
         """
         Description: 
-            Posts data to a specified URL using the requests library.
+            Posts data to a specified URL using the shared requests session.
         Args:
             data (dict): The data to be posted.
             url (str): The URL to post the data to.
@@ -425,9 +701,9 @@ class QuayAPI:
         if not headers:
             headers = self.headers
         if headers_required:
-            output = requests.post(f'{url}', headers=headers, json=data)
+            output = self.request("POST", url, headers=headers, data=data)
         else:
-            output = requests.post(f'{url}', json=data)
+            output = self.request("POST", url, data=data)
         return(output)
  
     def put_data(self, data: dict = None, url: str = None, headers_required=True ) -> dict:
@@ -444,4 +720,29 @@ class QuayAPI:
         """
         if not data:
             data = {}
-        return(requests.put(f'{url}', headers=self.headers, json=data))
+        return(self.request("PUT", url, headers=self.headers, data=data))
+
+    def wait_for_org(self, org_name: str = None, timeout: float = 30, interval: float = 0.5) -> bool:
+        """
+        Description:
+            Polls the API until an organization can be read back. Used to confirm a create instead of sleeping
+        Args:
+            org_name (str, optional): The name of the organization. Defaults to None.
+            timeout (float, optional): How many seconds to keep polling. Defaults to 30.
+            interval (float, optional): Seconds before the first retry. The wait doubles up to 5 seconds. Defaults to 0.5.
+        Returns:
+            bool: True if the organization exists, False if it did not appear before the timeout
+        """
+        url = f"{self.base_url}{self.org_endpoint}{org_name}"
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if self.request("GET", url, headers=self.headers).status_code == 200:
+                    return True
+            except requests.exceptions.RequestException as e:
+                logging.debug(f"Error polling {url}: {e}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 5)
@@ -2,9 +2,23 @@ from .BaseOperations import BaseOperations
 import subprocess
 import logging
 from .QuayAPI import QuayAPI
+from .Metrics import Metrics
 from random import SystemRandom as Random
-import yaml
 import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlencode
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Union
 
 class ImageMover(BaseOperations):
@@ -38,7 +52,7 @@ class ImageMover(BaseOperations):
         logging.info(f"Logged in to: {server}")
  
     @classmethod
-    def podman_operations(cls, operation: str, image_source: str=None, image_destination: str=None, image_and_tag: str=None, args=None):
+    def podman_operations(cls, operation: str, image_source: str=None, image_destination: str=None, image_and_tag: str=None, args=None, exit_on_error: bool = True) -> bool:
         """
         Description: 
             Performs a Podman operation on an image.
@@ -48,8 +62,10 @@ class ImageMover(BaseOperations):
             image_destination (str): The destination image for the operation.
             image_and_tag (str): The image and tag to use for the operation.
             args: An instance of arg parse so we know what options we are dealing with
+            exit_on_error (bool, optional): Exit the program on a failure unless --skip-broken-images is set.
+                                            Worker threads set this to False and handle the failure themselves. Defaults to True.
         Returns:
-            None
+            bool: True if the operation succeeded, False otherwise
         """
         if image_source and "//" in image_source:
             image_source = image_source.split("//")[1:][0]
@@ -67,17 +83,1061 @@ class ImageMover(BaseOperations):
             podman_command = ["podman", operation, image_source]
             podman_command = cls.do_i_skip_tls(podman_command, skip_tls_verify=args.skip_tls_verify)
             log_msg = f"Image pulled from {image_source} <---"
-        try:        
-            subprocess.check_output(podman_command)
-            logging.info(log_msg) 
+        # Pushes are retried once as the registry can drop the odd upload under load
+        attempts = 2 if operation == "push" else 1
+        for attempt in range(attempts):
+            try:
+                with Metrics.timer("podman_seconds", operation=operation):
+                    subprocess.check_output(podman_command)
+                logging.info(log_msg)
+                return True
+            except subprocess.CalledProcessError as e:
+                logging.debug(f"Attempt {attempt + 1} to {operation} {image_and_tag} failed: {e}")
+        logging.critical(
+            f"Error while attempting to {operation} the image: {image_and_tag} <---"
+        )
+        if exit_on_error and not args.skip_broken_images:
+            exit(1)
+        return False
+
+    @staticmethod
+    def local_name(image_name: str) -> str:
+        """
+        Description:
+            Strips the protocol from an image name, which is how podman names the image in local storage
+        Args:
+            image_name (str): For example https://quay.example.com/org/repo:tag
+        Returns:
+            str: For example quay.example.com/org/repo:tag
+        """
+        if "//" in image_name:
+            return image_name.split("//")[1:][0]
+        return image_name
+
+    @classmethod
+    def image_usage(cls, image_name: str) -> tuple[int, set]:
+        """
+        Description:
+            Reads the size and layers of an image in local storage
+        Args:
+            image_name (str): The image name
+        Returns:
+            tuple: (<size in bytes>, <set of layer digests>)
+        Raises:
+            subprocess.CalledProcessError: If the image is not in local storage
+        """
+        output = subprocess.check_output(["podman", "image", "inspect", "--format", "{{.Size}} {{json .RootFS.Layers}}", cls.local_name(image_name)], text=True)
+        size, layers = output.strip().split(" ", 1)
+        return int(size), set(json.loads(layers) or [])
+
+    @classmethod
+    def remove_images(cls, image_names: list) -> bool:
+        """
+        Description:
+            Removes images from local storage. An image with other names left is only untagged
+        Args:
+            image_names (list): The names to remove
+        Returns:
+            bool: True if every name was removed
+        """
+        try:
+            with Metrics.timer("podman_seconds", operation="rmi"):
+                subprocess.check_output(["podman", "rmi"] + [cls.local_name(image_name) for image_name in image_names], stderr=subprocess.STDOUT)
+            return True
         except subprocess.CalledProcessError as e:
-            if operation == "push":
-                subprocess.check_output(podman_command)
-            logging.critical(
-                f"Error while attempting to {operation} the image: {image_and_tag} <---"
-            )
-            if not args.skip_broken_images:
-                exit(1)
+            logging.warning(f"Could not remove ---> {' '.join(image_names)} <--- from local storage: {e.output.decode(errors='replace').strip() if e.output else e}")
+            return False
+
+class StorageBudget:
+    def __init__(self, limit_bytes: int = 0) -> None:
+        """
+        Description:
+            Keeps the images the podman backend leaves in local storage under a size limit. An image is pinned
+            from the moment it is pulled until it has been pushed to every destination. After that it is kept as a
+            cache of its layers, since later pulls of images with the same base layers skip them, and removed least
+            recently used first once the images tracked add up to more than the limit. Pulling an image whose layers
+            are already cached counts as using the cached image. Pulls wait while the limit is used up by pinned images.
+            `podman rmi` runs without holding the lock so pulls and releases carry on while images are removed
+        Args:
+            limit_bytes (int, optional): The most bytes of images to keep. 0 removes every image as soon as it has been pushed
+                                         and never holds back a pull. Defaults to 0.
+        """
+        self.limit_bytes = max(0, limit_bytes)
+        # {<source image name>: {"names": set, "size": <int>, "layers": set, "pinned": <bool>, "removing": <bool>, "remove_failed": <bool>}},
+        # least recently used first. An image stays tracked until podman has removed it
+        self.images = OrderedDict()
+        self.condition = threading.Condition()
+        self.stats = {"peak_bytes": 0, "removed_pushed": 0, "removed_evicted": 0}
+
+    def usage(self) -> int:
+        """
+        Description:
+            Adds up the size of the tracked images. Layers shared between images are counted for each image,
+            so this is never less than the space they use. Must be called while holding self.condition
+        Returns:
+            int: Bytes
+        """
+        return sum(image["size"] for image in self.images.values())
+
+    def wait_for_room(self) -> None:
+        """
+        Description:
+            Called before a pull. Evicts cached images and, if the limit is still used up by images that have not
+            been pushed yet, waits until one of them is released. With a limit of 0 this returns straight away,
+            since every image is removed once it has been pushed
+        """
+        if not self.limit_bytes:
+            return
+        while True:
+            with self.condition:
+                removals = self.evict(self.limit_bytes - 1)
+                if not removals:
+                    if self.usage() < self.limit_bytes or not any(image["pinned"] for image in self.images.values()):
+                        return
+                    # Woken up by release() or once another pull's removals have finished
+                    self.condition.wait()
+                    continue
+            for name in removals:
+                self.remove(name, "evicted")
+
+    def add(self, job: dict) -> None:
+        """
+        Description:
+            Starts tracking an image that was just pulled and pins it until release()
+        Args:
+            job (dict): {"image_source": <str>}
+        """
+        try:
+            size, layers = ImageMover.image_usage(job["image_source"])
+        except (subprocess.CalledProcessError, ValueError) as e:
+            logging.warning(f"Could not read the size of ---> {job['image_source']} <--- so it is not counted against the storage limit: {e}")
+            size, layers = 0, set()
+        with self.condition:
+            for name, image in list(self.images.items()):
+                if layers & image["layers"]:
+                    # The new image is built on the cached one's layers, which makes it recently used
+                    self.images.move_to_end(name)
+            image = self.images.setdefault(job["image_source"], {"names": {job["image_source"]}, "size": size, "layers": layers,
+                                                                 "pinned": True, "removing": False, "remove_failed": False})
+            image.update(size=size, layers=layers, pinned=True, remove_failed=False)
+            self.images.move_to_end(job["image_source"])
+            usage = self.usage()
+            self.stats["peak_bytes"] = max(self.stats["peak_bytes"], usage)
+        Metrics.set_gauge("local_storage_bytes", usage)
+
+    def add_name(self, job: dict, image_name: str) -> None:
+        """
+        Description:
+            Remembers a tag given to a tracked image so it is removed along with it
+        Args:
+            job (dict): {"image_source": <str>}
+            image_name (str): The new name
+        """
+        with self.condition:
+            if job["image_source"] in self.images:
+                self.images[job["image_source"]]["names"].add(image_name)
+
+    def release(self, job: dict) -> None:
+        """
+        Description:
+            Unpins an image once it has been pushed to every destination, or could not be. It is removed right away
+            with a limit of 0, otherwise it stays cached until the limit is reached
+        Args:
+            job (dict): {"image_source": <str>}
+        """
+        with self.condition:
+            image = self.images.get(job["image_source"])
+            if not image:
+                return
+            image["pinned"] = False
+            removals = []
+            if not self.limit_bytes and not image["removing"]:
+                image["removing"] = True
+                removals.append((job["image_source"], "pushed"))
+            removals.extend((name, "evicted") for name in self.evict(self.limit_bytes))
+            self.condition.notify_all()
+        for name, reason in removals:
+            self.remove(name, reason)
+        if not removals:
+            with self.condition:
+                usage = self.usage()
+            Metrics.set_gauge("local_storage_bytes", usage)
+
+    def evict(self, target_bytes: int) -> list:
+        """
+        Description:
+            Picks cached images to remove, least recently used first, until the tracked images fit in target_bytes.
+            Images being removed by another thread already count as gone. Pinned images, and images podman refused
+            to remove, are never picked. Must be called while holding self.condition, and every image returned
+            must then be passed to remove() after letting go of it
+        Args:
+            target_bytes (int): The most bytes to keep
+        Returns:
+            list: The source image names that were picked
+        """
+        usage = sum(image["size"] for image in self.images.values() if not image["removing"])
+        picked = []
+        for name, image in self.images.items():
+            if usage <= target_bytes:
+                break
+            if image["pinned"] or image["removing"] or image["remove_failed"]:
+                continue
+            image["removing"] = True
+            usage -= image["size"]
+            picked.append(name)
+        return picked
+
+    def remove(self, name: str, reason: str) -> bool:
+        """
+        Description:
+            Removes every name of an image picked by evict() or release() from local storage and stops tracking it.
+            An image podman could not remove is still on disk, so it stays tracked and counts against the limit.
+            Must be called without holding self.condition
+        Args:
+            name (str): The source image name the image is tracked under
+            reason (str): "pushed" or "evicted"
+        Returns:
+            bool: True if the image was removed
+        """
+        with self.condition:
+            image = self.images[name]
+            names, size = sorted(image["names"]), image["size"]
+        removed = ImageMover.remove_images(names)
+        with self.condition:
+            image["removing"] = False
+            if not removed:
+                image["remove_failed"] = True
+            else:
+                self.stats[f"removed_{reason}"] += 1
+                # An image pulled again while it was being removed is tracked as the new pull
+                if not image["pinned"]:
+                    self.images.pop(name)
+            self.condition.notify_all()
+            usage = self.usage()
+        Metrics.set_gauge("local_storage_bytes", usage)
+        if not removed:
+            logging.warning(f"---> {name} <--- is still in local storage and keeps counting against the storage limit")
+            return False
+        logging.debug(f"Removed ---> {name} <--- from local storage ({BaseOperations.human_readable_bytes(size)}, {reason})")
+        Metrics.increment("local_images_removed_total", reason=reason)
+        return True
+
+    def storage_stats(self) -> dict:
+        """
+        Description:
+            Returns the storage counters for this run
+        Returns:
+            dict: {"peak_bytes", "removed_pushed", "removed_evicted", "cached_bytes"}
+        """
+        with self.condition:
+            return dict(self.stats, cached_bytes=self.usage())
+
+class RegistryError(Exception):
+    """
+    Description:
+        Raised when a registry returns something the direct copy backend cannot handle
+    """
+    pass
+
+class BlobStream:
+    def __init__(self, raw, size: int) -> None:
+        """
+        Description:
+            Wraps a streaming download so requests uploads it with a fixed Content-Length
+            instead of chunked encoding, which not every registry accepts
+        Args:
+            raw: A file like object to read from, usually requests.Response.raw
+            size (int): The number of bytes that will be read
+        """
+        self.raw = raw
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        while chunk := self.read(1024 * 1024):
+            yield chunk
+
+    def read(self, amount: int = -1) -> bytes:
+        return self.raw.read(amount if amount and amount > 0 else None)
+
+class RegistryClient:
+    # Manifest types we know how to copy. Schema 1 manifests are not supported and fall back to podman
+    manifest_list_types = ["application/vnd.oci.image.index.v1+json", "application/vnd.docker.distribution.manifest.list.v2+json"]
+    manifest_types = ["application/vnd.oci.image.manifest.v1+json", "application/vnd.docker.distribution.manifest.v2+json"]
+
+    def __init__(self, registry_url: str, username: str = None, password: str = None, skip_tls_verify: bool = False, pool_size: int = 10) -> None:
+        """
+        Description:
+            A small client for the OCI distribution (/v2) API of a single registry
+        Args:
+            registry_url (str): The registry including the protocol, for example https://quay.example.com
+            username (str, optional): Username used to request bearer tokens. Defaults to None (anonymous).
+            password (str, optional): Password used to request bearer tokens. Defaults to None.
+            skip_tls_verify (bool, optional): Ignore self signed certs. Defaults to False.
+            pool_size (int, optional): The maximum number of keep-alive connections to the registry. Defaults to 10.
+        """
+        self.registry_url = registry_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.session = requests.Session()
+        self.session.verify = not skip_tls_verify
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Bearer tokens are cached per scope along with the time they expire
+        self.tokens = {}
+        self.tokens_lock = threading.Lock()
+
+    def get_token(self, challenge: str, scopes: list[str]) -> str:
+        """
+        Description:
+            Requests a bearer token from the realm the registry sent back in its WWW-Authenticate header
+        Args:
+            challenge (str): The WWW-Authenticate header value
+            scopes (list[str]): The scopes required, for example ["repository:org/repo:pull"]
+        Returns:
+            str: The Authorization header value to use
+        """
+        if challenge.lower().startswith("basic"):
+            return "Basic " + base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+        challenge_params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        if "realm" not in challenge_params:
+            raise RegistryError(f"Unsupported authentication challenge from {self.registry_url}: {challenge}")
+        params = [("service", challenge_params.get("service", ""))]
+        params.extend(("scope", scope) for scope in scopes)
+        auth = (self.username, self.password) if self.username else None
+        response = self.session.get(challenge_params["realm"], params=params, auth=auth, timeout=(10, 60))
+        if response.status_code != 200:
+            raise RegistryError(f"Could not get a token from {challenge_params['realm']}: {response.status_code}")
+        token_info = response.json()
+        token = token_info.get("token") or token_info.get("access_token")
+        with self.tokens_lock:
+            # Refresh a little early so a token does not expire part way through a blob upload
+            self.tokens[" ".join(scopes)] = (f"Bearer {token}", time.monotonic() + int(token_info.get("expires_in", 60)) - 10)
+        return f"Bearer {token}"
+
+    def request(self, method: str, repository: str, path: str, actions: str = "pull", scopes: list[str] = None, **kwargs) -> requests.Response:
+        """
+        Description:
+            Sends a request to /v2/<repository>/<path>, fetching a token and retrying once if the registry asks for authentication
+        Args:
+            method (str): The HTTP method
+            repository (str): The repository, for example org/repo
+            path (str): The rest of the path, for example manifests/latest. Full URLs (such as upload locations) are used as is
+            actions (str, optional): The actions needed on the repository, "pull" or "pull,push". Defaults to "pull".
+            scopes (list[str], optional): Any additional token scopes. Defaults to None.
+            **kwargs: Passed to requests
+        Returns:
+            requests.Response: The response from the registry
+        """
+        if path.startswith("http"):
+            url = path
+        elif path.startswith("/"):
+            url = f"{self.registry_url}{path}"
+        else:
+            url = f"{self.registry_url}/v2/{repository}/{path}"
+        scopes = [f"repository:{repository}:{actions}"] + (scopes or [])
+        headers = kwargs.pop("headers", {})
+        kwargs.setdefault("timeout", (10, 300))
+        with self.tokens_lock:
+            cached = self.tokens.get(" ".join(scopes))
+        if cached and cached[1] > time.monotonic():
+            headers["Authorization"] = cached[0]
+        response = self.session.request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401 and "WWW-Authenticate" in response.headers and not hasattr(kwargs.get("data"), "read"):
+            response.close()
+            headers["Authorization"] = self.get_token(response.headers["WWW-Authenticate"], scopes)
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        return response
+
+    def get_manifest(self, repository: str, reference: str) -> tuple[bytes, str, str]:
+        """
+        Description:
+            Downloads a manifest
+        Args:
+            repository (str): The repository, for example org/repo
+            reference (str): A tag or a digest
+        Returns:
+            tuple: (manifest bytes, media type, digest)
+        """
+        accept = ", ".join(self.manifest_list_types + self.manifest_types)
+        response = self.request("GET", repository, f"manifests/{reference}", headers={"Accept": accept})
+        if response.status_code != 200:
+            raise RegistryError(f"Could not get manifest {repository}:{reference} from {self.registry_url}: {response.status_code}")
+        media_type = response.headers.get("Content-Type", "").split(";")[0]
+        if not media_type or media_type == "application/json":
+            media_type = json.loads(response.content).get("mediaType", "")
+        digest = response.headers.get("Docker-Content-Digest") or "sha256:" + hashlib.sha256(response.content).hexdigest()
+        return response.content, media_type, digest
+
+    def head_manifest(self, repository: str, reference: str) -> str:
+        """
+        Description:
+            Uses a HEAD request to find the digest a tag points to without downloading the manifest
+        Args:
+            repository (str): The repository, for example org/repo
+            reference (str): A tag or a digest
+        Returns:
+            str: The manifest digest, or None if the tag does not exist
+        """
+        accept = ", ".join(self.manifest_list_types + self.manifest_types)
+        response = self.request("HEAD", repository, f"manifests/{reference}", headers={"Accept": accept})
+        if response.status_code != 200:
+            return None
+        return response.headers.get("Docker-Content-Digest")
+
+    def put_manifest(self, repository: str, reference: str, manifest: bytes, media_type: str) -> None:
+        """
+        Description:
+            Uploads a manifest, which is what creates (or moves) a tag
+        Args:
+            repository (str): The repository, for example org/repo
+            reference (str): A tag or a digest
+            manifest (bytes): The raw manifest, it must be byte for byte the same so the digest does not change
+            media_type (str): The media type of the manifest
+        """
+        response = self.request("PUT", repository, f"manifests/{reference}", actions="pull,push", data=manifest, headers={"Content-Type": media_type})
+        if response.status_code not in (200, 201, 202):
+            raise RegistryError(f"Could not push manifest {repository}:{reference} to {self.registry_url}: {response.status_code} {response.text}")
+
+    def get_blob(self, repository: str, digest: str) -> requests.Response:
+        """
+        Description:
+            Opens a streaming download of a blob. The caller must close the response
+        Args:
+            repository (str): The repository, for example org/repo
+            digest (str): The digest of the blob
+        Returns:
+            requests.Response: A response whose body has not been read yet
+        """
+        response = self.request("GET", repository, f"blobs/{digest}", stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise RegistryError(f"Could not get blob {digest} from {self.registry_url}/{repository}: {response.status_code}")
+        return response
+
+    def blob_exists(self, repository: str, digest: str) -> bool:
+        """
+        Description:
+            Uses a HEAD request to check if a repository already has a blob
+        Args:
+            repository (str): The repository, for example org/repo
+            digest (str): The digest of the blob
+        Returns:
+            bool: True if the blob is already in the repository
+        """
+        response = self.request("HEAD", repository, f"blobs/{digest}", actions="pull,push")
+        return response.status_code == 200
+
+    def mount_blob(self, repository: str, digest: str, from_repository: str) -> tuple[bool, str]:
+        """
+        Description:
+            Asks the registry to link a blob it already stores in another repository (cross repository blob mount)
+            so the bytes do not need to be uploaded again
+        Args:
+            repository (str): The repository to mount the blob into
+            digest (str): The digest of the blob
+            from_repository (str): A repository on this registry that already has the blob
+        Returns:
+            tuple: (True, None) if the blob was mounted. (False, <upload location>) if the registry
+                   declined and opened a regular upload instead
+        """
+        response = self.request("POST", repository, "blobs/uploads/", actions="pull,push",
+                                scopes=[f"repository:{from_repository}:pull"],
+                                params={"mount": digest, "from": from_repository}, data=b"")
+        if response.status_code == 201:
+            return True, None
+        if response.status_code == 202 and "Location" in response.headers:
+            return False, response.headers["Location"]
+        return False, None
+
+    def put_blob(self, repository: str, digest: str, size: int, body, location: str = None) -> None:
+        """
+        Description:
+            Uploads a blob in a single monolithic request, streaming it from body
+        Args:
+            repository (str): The repository, for example org/repo
+            digest (str): The digest of the blob
+            size (int): The size of the blob in bytes
+            body: A file like object to read the blob from. It is wrapped in a BlobStream
+            location (str, optional): An upload that was already opened, for example by a declined mount. Defaults to None.
+        """
+        if location is None:
+            response = self.request("POST", repository, "blobs/uploads/", actions="pull,push", data=b"")
+            if response.status_code != 202 or "Location" not in response.headers:
+                raise RegistryError(f"Could not start an upload to {self.registry_url}/{repository}: {response.status_code}")
+            location = response.headers["Location"]
+        location = urljoin(self.registry_url + "/", location)
+        location += ("&" if "?" in location else "?") + urlencode({"digest": digest})
+        response = self.request("PUT", repository, location, actions="pull,push", data=BlobStream(body, size),
+                                headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)})
+        if response.status_code != 201:
+            raise RegistryError(f"Could not upload blob {digest} to {self.registry_url}/{repository}: {response.status_code} {response.text}")
+
+    @staticmethod
+    def parse_image_name(image_name: str) -> tuple[str, str, str]:
+        """
+        Description:
+            Splits a full image name into the registry URL, the repository and the tag or digest
+        Args:
+            image_name (str): For example https://quay.example.com/org/repo:tag
+        Returns:
+            tuple: (registry url, repository, reference). For example ("https://quay.example.com", "org/repo", "tag")
+        """
+        scheme = "https"
+        if "//" in image_name:
+            scheme = image_name.split("//")[0].rstrip(":") or scheme
+            image_name = image_name.split("//")[1:][0]
+        registry, repository = image_name.split("/", 1)
+        if "@" in repository:
+            repository, reference = repository.split("@", 1)
+        elif ":" in repository.split("/")[-1]:
+            repository, reference = repository.rsplit(":", 1)
+        else:
+            reference = "latest"
+        return f"{scheme}://{registry}", repository, reference
+
+class SourceCache:
+    def __init__(self, source: RegistryClient, repository: str, spool_dir: str = None, source_limit=None) -> None:
+        """
+        Description:
+            Shares what is read from the source between the destinations of one image, so an image mirrored to
+            several registries is only downloaded once. Manifests are kept in memory. A blob is spooled to a
+            temporary file by the first destination that is missing it and the others upload from that file
+        Args:
+            source (RegistryClient): The source registry
+            repository (str): The repository on the source
+            spool_dir (str, optional): Where blobs are spooled. Defaults to None ($TMPDIR or /tmp).
+            source_limit (optional): A context manager (semaphore) held only while reading from the source, so the
+                                     uploads from the spool do not count against the source. Defaults to None.
+        """
+        self.source = source
+        self.repository = repository
+        self.spool_dir = spool_dir
+        self.source_limit = source_limit or nullcontext()
+        self.manifests = {}
+        # {<digest>: <path of the spooled blob>}
+        self.blobs = {}
+        # One lock per manifest or blob so destinations only wait on each other for the same download
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def entry_lock(self, key: tuple) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get_manifest(self, reference: str) -> tuple[bytes, str, str]:
+        """
+        Description:
+            RegistryClient.get_manifest() for the source repository, fetched once per reference
+        Args:
+            reference (str): A tag or a digest
+        Returns:
+            tuple: (<raw manifest bytes>, <media type>, <digest>)
+        """
+        with self.entry_lock(("manifest", reference)):
+            if reference not in self.manifests:
+                with self.source_limit:
+                    self.manifests[reference] = self.source.get_manifest(self.repository, reference)
+            return self.manifests[reference]
+
+    def blob_file(self, descriptor: dict) -> tuple[str, int]:
+        """
+        Description:
+            Downloads a blob to the spool directory the first time it is asked for. Destinations asking for a
+            blob that is still downloading wait for it. If the download fails the next caller tries again
+        Args:
+            descriptor (dict): The descriptor from the manifest with 'digest' and 'size'
+        Returns:
+            tuple: (<path of the spooled blob>, <size in bytes>)
+        """
+        digest = descriptor["digest"]
+        with self.entry_lock(("blob", digest)):
+            if digest not in self.blobs:
+                with self.source_limit:
+                    blob_response = self.source.get_blob(self.repository, digest)
+                    file_descriptor, spool_path = tempfile.mkstemp(dir=self.spool_dir, prefix="quay-sync-blob-")
+                    try:
+                        with os.fdopen(file_descriptor, "wb") as spool_file:
+                            # Read from raw so the bytes are spooled exactly as they were stored
+                            shutil.copyfileobj(blob_response.raw, spool_file, 1024 * 1024)
+                    except Exception:
+                        os.remove(spool_path)
+                        raise
+                    finally:
+                        blob_response.close()
+                self.blobs[digest] = spool_path
+            spool_path = self.blobs[digest]
+        return spool_path, os.path.getsize(spool_path)
+
+    def close(self) -> None:
+        """
+        Description:
+            Removes the spooled blobs
+        """
+        with self.lock:
+            for spool_path in self.blobs.values():
+                try:
+                    os.remove(spool_path)
+                except OSError as e:
+                    logging.warning(f"Could not remove spooled blob {spool_path}: {e}")
+            self.blobs = {}
+
+class CopyBackend:
+    name = None
+
+    def __init__(self, credentials: dict = None, args=None, pool_size: int = 10) -> None:
+        """
+        Description:
+            Shared plumbing for the copy backends. Keeps one RegistryClient per registry so
+            connections and tokens are reused between workers
+        Args:
+            credentials (dict, optional): {"<registry hostname>": {"username": <str>, "password": <str>}}. Defaults to None.
+            args: An instance of arg parse so we know what options we are dealing with
+            pool_size (int, optional): Keep-alive connections per registry. Should match the number of workers. Defaults to 10.
+        """
+        self.credentials = credentials or {}
+        self.args = args
+        self.pool_size = pool_size
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+    def client_for(self, registry_url: str) -> RegistryClient:
+        """
+        Description:
+            Returns the RegistryClient for a registry, creating it on first use so connections and tokens are shared between workers
+        Args:
+            registry_url (str): The registry including the protocol
+        Returns:
+            RegistryClient: The client for that registry
+        """
+        with self.clients_lock:
+            if registry_url not in self.clients:
+                hostname = registry_url.split("//")[-1]
+                credentials = self.credentials.get(hostname, {})
+                self.clients[registry_url] = RegistryClient(registry_url,
+                                                            username=credentials.get("username"),
+                                                            password=credentials.get("password"),
+                                                            skip_tls_verify=getattr(self.args, "skip_tls_verify", False),
+                                                            pool_size=self.pool_size)
+            return self.clients[registry_url]
+
+    def manifest_digest(self, image_name: str) -> str:
+        """
+        Description:
+            Finds the digest an image currently points to with a single HEAD request
+        Args:
+            image_name (str): A full image name such as https://quay.example.com/org/repo:tag
+        Returns:
+            str: The manifest digest, or None if it could not be found
+        """
+        registry_url, repository, reference = RegistryClient.parse_image_name(image_name)
+        try:
+            return self.client_for(registry_url).head_manifest(repository, reference)
+        except (RegistryError, requests.exceptions.RequestException) as e:
+            logging.debug(f"Could not get the digest of {image_name}: {e}")
+            return None
+
+    @staticmethod
+    def gather(copies: dict, cleanup=None) -> Future:
+        """
+        Description:
+            Combines the copies of an image to each of its destinations into one Future without blocking the
+            calling thread. A copy that raised counts as failed
+        Args:
+            copies (dict): {<destination image name>: <Future resolving to True if the copy worked>}
+            cleanup (callable, optional): Called once every copy is done, before the combined Future resolves. Defaults to None.
+        Returns:
+            Future: Resolves to {<destination image name>: True if the image was mirrored there, False otherwise}
+        """
+        combined = Future()
+        remaining = [len(copies)]
+        remaining_lock = threading.Lock()
+
+        def copy_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            results = {}
+            for image_destination, copy in copies.items():
+                try:
+                    results[image_destination] = copy.result()
+                except Exception as e:
+                    logging.error(f"Copy to {image_destination} failed: {e}")
+                    results[image_destination] = False
+            try:
+                if cleanup:
+                    cleanup()
+            finally:
+                combined.set_result(results)
+
+        for copy in copies.values():
+            copy.add_done_callback(copy_done)
+        return combined
+
+class PodmanCopyBackend(CopyBackend):
+    name = "podman"
+
+    def __init__(self, credentials: dict = None, args=None, pool_size: int = 10, storage_budget: StorageBudget = None) -> None:
+        """
+        Description:
+            Copies images with podman pull, tag and push. Images are stored on the sync host in between
+        Args:
+            credentials (dict, optional): Only used to look up digests. See CopyBackend. Defaults to None.
+            args: An instance of arg parse so we know what options we are dealing with
+            pool_size (int, optional): Keep-alive connections per registry for digest lookups. Defaults to 10.
+            storage_budget (StorageBudget, optional): If set, pulled images are removed from local storage to stay under its limit.
+                                                      Defaults to None (images are left in local storage).
+        """
+        super().__init__(credentials=credentials, args=args, pool_size=pool_size)
+        self.storage_budget = storage_budget
+
+    def pull_image(self, job: dict, source_limit) -> bool:
+        """
+        Description:
+            Pulls an image into local storage while holding the source limit
+        Args:
+            job (dict): {"image_source": <str>, "image_and_tag": <str>}
+            source_limit: A context manager (semaphore) limiting operations against the source registry
+        Returns:
+            bool: True if the image was pulled, False otherwise
+        """
+        if self.storage_budget:
+            # Waits before taking the source limit so images already pulled can be pushed and released
+            self.storage_budget.wait_for_room()
+        with source_limit:
+            if not ImageMover.podman_operations(operation="pull", image_source=job["image_source"], image_and_tag=job["image_and_tag"], args=self.args, exit_on_error=False):
+                return False
+        if self.storage_budget:
+            self.storage_budget.add(job)
+        return True
+
+    def tag_image(self, job: dict, image_destination: str) -> bool:
+        """
+        Description:
+            Tags a pulled image with its name on a destination. This only touches local storage
+        Args:
+            job (dict): {"image_source": <str>, "image_and_tag": <str>}
+            image_destination (str): The image name on the destination
+        Returns:
+            bool: True if the image was tagged, False otherwise
+        """
+        if self.storage_budget:
+            self.storage_budget.add_name(job, image_destination)
+        return ImageMover.podman_operations(operation="tag", image_source=job["image_source"], image_destination=image_destination, image_and_tag=job["image_and_tag"], args=self.args, exit_on_error=False)
+
+    def push_image(self, job: dict, image_destination: str, destination_limit) -> bool:
+        """
+        Description:
+            Pushes a tagged image to a destination while holding the destination limit
+        Args:
+            job (dict): {"image_source": <str>, "image_and_tag": <str>}
+            image_destination (str): The image name on the destination
+            destination_limit: A context manager (semaphore) limiting operations against the destination registry
+        Returns:
+            bool: True if the image was pushed, False otherwise
+        """
+        with destination_limit:
+            return ImageMover.podman_operations(operation="push", image_source=job["image_source"], image_destination=image_destination, image_and_tag=job["image_and_tag"], args=self.args, exit_on_error=False)
+
+    def release_image(self, job: dict) -> None:
+        """
+        Description:
+            Called once an image is done with every destination so the storage budget can remove it
+        Args:
+            job (dict): {"image_source": <str>}
+        """
+        if self.storage_budget:
+            self.storage_budget.release(job)
+
+    def copy_image(self, job: dict, source_limit, destination_limit) -> bool:
+        """
+        Description:
+            Pulls, tags and pushes a single image. The source limit is only held for the pull
+            and the destination limit is only held for the push
+        Args:
+            job (dict): {"image_source": <str>, "image_destination": <str>, "image_and_tag": <str>}
+            source_limit: A context manager (semaphore) limiting operations against the source registry
+            destination_limit: A context manager (semaphore) limiting operations against the destination registry
+        Returns:
+            bool: True if the image was mirrored, False otherwise
+        """
+        if not self.pull_image(job, source_limit):
+            return False
+        try:
+            return self.tag_image(job, job["image_destination"]) and self.push_image(job, job["image_destination"], destination_limit)
+        finally:
+            self.release_image(job)
+
+    def copy_image_to(self, job: dict, source_limit, destinations: list) -> Future:
+        """
+        Description:
+            Pulls an image once, then tags and pushes it on the executor of each destination. Returns as soon as
+            the pull is done, so the calling worker and the source limit are free for the next image while the
+            pushes run, and a slow destination only holds up its own queue
+        Args:
+            job (dict): {"image_source": <str>, "image_and_tag": <str>}
+            source_limit: A context manager (semaphore) limiting operations against the source registry
+            destinations (list): [(<destination image name>, <executor that runs the copies to that destination registry>)]
+        Returns:
+            Future: Resolves to {<destination image name>: True if the image was mirrored there, False otherwise}
+        """
+        if not self.pull_image(job, source_limit):
+            failed = Future()
+            failed.set_result(False)
+            return self.gather({image_destination: failed for image_destination, _ in destinations})
+
+        def push_to(image_destination):
+            # The executor caps the pushes to each destination registry
+            return self.tag_image(job, image_destination) and self.push_image(job, image_destination, nullcontext())
+
+        return self.gather({image_destination: executor.submit(push_to, image_destination) for image_destination, executor in destinations},
+                           cleanup=lambda: self.release_image(job))
+
+class RegistryCopyBackend(CopyBackend):
+    name = "direct"
+
+    def __init__(self, credentials: dict = None, args=None, pool_size: int = 10, fallback: PodmanCopyBackend = None, state=None,
+                 spool_dir: str = None) -> None:
+        """
+        Description:
+            Copies images straight from the source registry to the destination registry over the
+            OCI distribution API. Blobs are never written to local container storage. With one destination they are
+            streamed through memory. With several, each blob a destination is missing is downloaded once to a
+            temporary file in spool_dir that every destination uploads from, and removed once the image is done (see SourceCache)
+        Args:
+            credentials (dict, optional): {"<registry hostname>": {"username": <str>, "password": <str>}}. Defaults to None.
+            args: An instance of arg parse so we know what options we are dealing with
+            pool_size (int, optional): Keep-alive connections per registry. Should match the number of workers. Defaults to 10.
+            fallback (PodmanCopyBackend, optional): If set, images that fail to copy directly are retried with this backend. Defaults to None.
+            state (SyncState, optional): If set, where blobs were uploaded is kept between runs, so a layer uploaded by an
+                                         earlier run is mounted instead of uploaded again. Defaults to None (this run only).
+            spool_dir (str, optional): Where blobs are spooled for images with several destinations. Defaults to None ($TMPDIR or /tmp).
+        """
+        super().__init__(credentials=credentials, args=args, pool_size=pool_size)
+        self.fallback = fallback
+        self.state = state
+        self.spool_dir = spool_dir
+        # Remembers one repository on each destination that is known to hold a blob so
+        # other repositories can mount it instead of uploading it again
+        self.blob_locations = {}
+        # Blobs currently being uploaded, so two workers never upload the same layer at once
+        self.blob_uploads = {}
+        self.blobs_lock = threading.Lock()
+        self.stats = {"bytes_transferred": 0, "bytes_saved": 0, "blobs_uploaded": 0, "blobs_existing": 0, "blobs_mounted": 0}
+
+    def copy_blob(self, source: RegistryClient, destination: RegistryClient, source_repository: str, destination_repository: str, descriptor: dict,
+                  source_cache: SourceCache = None) -> None:
+        """
+        Description:
+            Makes sure a single blob is in the destination repository. Blobs the repository already has are
+            skipped, blobs that another repository on the destination has are mounted, and only blobs the
+            destination does not have at all are streamed from the source
+        Args:
+            source (RegistryClient): The source registry
+            destination (RegistryClient): The destination registry
+            source_repository (str): The repository on the source
+            destination_repository (str): The repository on the destination
+            descriptor (dict): The descriptor from the manifest with 'digest' and 'size'
+            source_cache (SourceCache, optional): Upload from a spooled copy shared with the other destinations
+                                                  instead of streaming from the source. Defaults to None.
+        """
+        digest = descriptor["digest"]
+        blob_key = (destination.registry_url, digest)
+        while True:
+            with self.blobs_lock:
+                upload_in_progress = self.blob_uploads.get(blob_key)
+                if upload_in_progress is None:
+                    # Nobody else is uploading this blob, claim it
+                    upload_done = self.blob_uploads[blob_key] = threading.Event()
+                    known_repository = self.blob_locations.get(blob_key)
+                    break
+            # Another worker is uploading the same layer. Wait for it and then mount its copy
+            upload_in_progress.wait()
+        start_time = time.perf_counter()
+        try:
+            if known_repository is None and self.state:
+                # An earlier run may have put it somewhere. If that repository lost it since, the mount fails and it is uploaded
+                known_repository = self.state.get_blob_location(destination.registry_url, digest)
+            if destination.blob_exists(destination_repository, digest):
+                self.record_blob(blob_key, destination_repository, descriptor["size"], "blobs_existing", start_time)
+                return
+            upload_location = None
+            if known_repository and known_repository != destination_repository:
+                mounted, upload_location = destination.mount_blob(destination_repository, digest, known_repository)
+                if mounted:
+                    logging.debug(f"Mounted {digest} from {known_repository} into {destination_repository}")
+                    self.record_blob(blob_key, destination_repository, descriptor["size"], "blobs_mounted", start_time)
+                    return
+            if source_cache:
+                spool_path, size = source_cache.blob_file(descriptor)
+                with open(spool_path, "rb") as spool_file:
+                    destination.put_blob(destination_repository, digest, size, spool_file, location=upload_location)
+            else:
+                blob_response = source.get_blob(source_repository, digest)
+                try:
+                    size = int(blob_response.headers.get("Content-Length", descriptor["size"]))
+                    # decode_content stays False so the bytes are uploaded exactly as they were stored
+                    destination.put_blob(destination_repository, digest, size, blob_response.raw, location=upload_location)
+                finally:
+                    blob_response.close()
+            self.record_blob(blob_key, destination_repository, size, "blobs_uploaded", start_time)
+        except Exception:
+            Metrics.increment("blob_copy_failures_total")
+            raise
+        finally:
+            with self.blobs_lock:
+                self.blob_uploads.pop(blob_key, None)
+            upload_done.set()
+
+    def record_blob(self, blob_key: tuple, repository: str, size: int, outcome: str, start_time: float = None) -> None:
+        """
+        Description:
+            Remembers where a blob lives on the destination, also in the sync state the first time this run sees the blob,
+            and updates the transfer counters and metrics
+        Args:
+            blob_key (tuple): (destination registry url, digest)
+            repository (str): The destination repository that now has the blob
+            size (int): The size of the blob in bytes
+            outcome (str): One of blobs_uploaded, blobs_existing or blobs_mounted
+            start_time (float, optional): time.perf_counter() when the copy of the blob started. Defaults to None.
+        """
+        with self.blobs_lock:
+            known_repository = self.blob_locations.get(blob_key)
+            self.blob_locations[blob_key] = repository
+            self.stats[outcome] += 1
+            if outcome == "blobs_uploaded":
+                self.stats["bytes_transferred"] += size
+            else:
+                self.stats["bytes_saved"] += size
+        if self.state and known_repository is None:
+            self.state.record_blob_location(*blob_key, repository)
+        Metrics.increment("registry_bytes_total", size, direction="transferred" if outcome == "blobs_uploaded" else "saved")
+        if start_time is not None:
+            Metrics.observe("blob_copy_seconds", time.perf_counter() - start_time, outcome=outcome[len("blobs_"):])
+
+    def transfer_stats(self) -> dict:
+        """
+        Description:
+            Returns the blob and byte counters for this run
+        Returns:
+            dict: {"bytes_transferred", "bytes_saved", "blobs_uploaded", "blobs_existing", "blobs_mounted"}
+        """
+        with self.blobs_lock:
+            return dict(self.stats)
+
+    def copy_manifest(self, source: RegistryClient, destination: RegistryClient, source_repository: str, destination_repository: str, reference: str,
+                      source_cache: SourceCache = None) -> str:
+        """
+        Description:
+            Copies a manifest and everything it references. Manifest lists have each of their
+            child manifests copied first
+        Args:
+            source (RegistryClient): The source registry
+            destination (RegistryClient): The destination registry
+            source_repository (str): The repository on the source
+            destination_repository (str): The repository on the destination
+            reference (str): The tag or digest to copy. The same reference is used on the destination
+            source_cache (SourceCache, optional): Read the source through a cache shared with the other destinations. Defaults to None.
+        Returns:
+            str: The digest of the manifest that was copied
+        """
+        if source_cache:
+            manifest, media_type, digest = source_cache.get_manifest(reference)
+        else:
+            manifest, media_type, digest = source.get_manifest(source_repository, reference)
+        manifest_dict = json.loads(manifest)
+        if media_type in RegistryClient.manifest_list_types:
+            for child in manifest_dict.get("manifests", []):
+                self.copy_manifest(source, destination, source_repository, destination_repository, child["digest"], source_cache=source_cache)
+        elif media_type in RegistryClient.manifest_types:
+            for descriptor in [manifest_dict["config"]] + manifest_dict.get("layers", []):
+                self.copy_blob(source, destination, source_repository, destination_repository, descriptor, source_cache=source_cache)
+        else:
+            raise RegistryError(f"Unsupported manifest type {media_type} for {source_repository}:{reference}")
+        destination.put_manifest(destination_repository, reference, manifest, media_type)
+        return digest
+
+    def copy_image(self, job: dict, source_limit, destination_limit) -> bool:
+        """
+        Description:
+            Copies a single image registry to registry. Both registry limits are held for the whole copy
+            because the download and the upload happen at the same time
+        Args:
+            job (dict): {"image_source": <str>, "image_destination": <str>, "image_and_tag": <str>}
+            source_limit: A context manager (semaphore) limiting operations against the source registry
+            destination_limit: A context manager (semaphore) limiting operations against the destination registry
+        Returns:
+            bool: True if the image was mirrored, False otherwise
+        """
+        source_url, source_repository, reference = RegistryClient.parse_image_name(job["image_source"])
+        destination_url, destination_repository, _ = RegistryClient.parse_image_name(job["image_destination"])
+        try:
+            with source_limit, destination_limit:
+                digest = self.copy_manifest(self.client_for(source_url), self.client_for(destination_url), source_repository, destination_repository, reference)
+            # The manifest is copied byte for byte so the destination ends up with the same digest
+            job["source_digest"] = job["destination_digest"] = digest
+            logging.info(f"Image copied from {job['image_source']} to {job['image_destination']} <---")
+            return True
+        except (RegistryError, requests.exceptions.RequestException, KeyError, ValueError) as e:
+            logging.error(f"Direct copy of {job['image_and_tag']} failed: {e}")
+        if self.fallback:
+            logging.warning(f"Falling back to {self.fallback.name} for ---> {job['image_and_tag']} <---")
+            return self.fallback.copy_image(job, source_limit, destination_limit)
+        return False
+
+    def copy_image_to(self, job: dict, source_limit, destinations: list) -> Future:
+        """
+        Description:
+            Copies a single image to its destinations, each one on the executor of its destination registry, and
+            returns without waiting for them. An image with one destination is streamed straight through. With
+            several, the manifests are read from the source once and every blob that at least one destination is
+            missing is downloaded once into a spool file the destinations upload from. The source limit is only
+            held while reading from the source, not while uploading, so a slow destination holds up neither the
+            source nor the other destinations. Destinations that fail are retried with the fallback backend
+        Args:
+            job (dict): {"image_source": <str>, "image_and_tag": <str>}
+            source_limit: A context manager (semaphore) limiting operations against the source registry
+            destinations (list): [(<destination image name>, <executor that runs the copies to that destination registry>)]
+        Returns:
+            Future: Resolves to {<destination image name>: True if the image was mirrored there, False otherwise}
+        """
+        source_url, source_repository, reference = RegistryClient.parse_image_name(job["image_source"])
+        destination_digests = job.setdefault("destination_digests", {})
+        if len(destinations) == 1:
+            image_destination, executor = destinations[0]
+
+            def copy_one():
+                destination_job = dict(job, image_destination=image_destination)
+                # The executor caps the copies to each destination registry
+                copied = self.copy_image(destination_job, source_limit, nullcontext())
+                job["source_digest"] = destination_job.get("source_digest")
+                destination_digests[image_destination] = destination_job.get("destination_digest")
+                return copied
+
+            return self.gather({image_destination: executor.submit(copy_one)})
+        source_cache = SourceCache(self.client_for(source_url), source_repository, spool_dir=self.spool_dir, source_limit=source_limit)
+
+        def copy_to(image_destination):
+            destination_url, destination_repository, _ = RegistryClient.parse_image_name(image_destination)
+            try:
+                digest = self.copy_manifest(source_cache.source, self.client_for(destination_url), source_repository, destination_repository,
+                                            reference, source_cache=source_cache)
+                job["source_digest"] = destination_digests[image_destination] = digest
+                logging.info(f"Image copied from {job['image_source']} to {image_destination} <---")
+                return True
+            except (RegistryError, requests.exceptions.RequestException, OSError, KeyError, ValueError) as e:
+                logging.error(f"Direct copy of {job['image_and_tag']} to {image_destination} failed: {e}")
+            if not self.fallback:
+                return False
+            logging.warning(f"Falling back to {self.fallback.name} for ---> {job['image_and_tag']} <--- on {image_destination}")
+            return self.fallback.copy_image(dict(job, image_destination=image_destination), source_limit, nullcontext())
+
+        return self.gather({image_destination: executor.submit(copy_to, image_destination) for image_destination, executor in destinations},
+                           cleanup=source_cache.close)
 
 class QuayManagement():
     def __init__(self, quay_url: str = None, quay_config: dict = None) -> None:
@@ -199,7 +1259,7 @@ class QuayManagement():
         Returns:
             dict: Returns the full quay config.yaml file so it can be used in another process
         """
-        quay_init_secret_decoded = yaml.load(base64.b64decode(quay_init_secret['data']['config.yaml']), Loader=yaml.FullLoader)
+        quay_init_secret_decoded = BaseOperations.load_yaml(base64.b64decode(quay_init_secret['data']['config.yaml']))
         if quay_secret_section == "SUPER_USERS":
             for user in quay_config.quay_secret_options['super_users']:
                 if user in quay_init_secret_decoded[quay_secret_section]:
@@ -210,43 +1270,127 @@ class QuayManagement():
             return(quay_init_secret_decoded)
      
     @staticmethod
-    def take_org_ownership(orgs: dict = None, quay_server_api: QuayAPI = None, quay_username: Union[str,list[str]] = "quayadmin") -> None:
+    def reconcile_orgs(source_orgs: set = None, destination_quay_api: QuayAPI = None, destination_orgs: set = None, max_workers: int = 8, timeout: float = 30) -> dict:
+        """
+        Description: This staticmethod makes sure every organization in {source_orgs} exists on the destination.
+                    The destination is listed once and the difference is computed in memory. Missing organizations
+                    are created concurrently and each create is confirmed by polling the API
+        Args:
+            source_orgs (set, optional): The organization names that should exist, probably from source_quay_api.get_org_names(). Defaults to None.
+            destination_quay_api (QuayAPI, optional): An instantiation of the QuayAPI class for the destination. Defaults to None.
+            destination_orgs (set, optional): The organizations already on the destination. Listed from the API if not given. Defaults to None.
+            max_workers (int, optional): How many organizations are created at the same time. Defaults to 8.
+            timeout (float, optional): How many seconds to wait for each new organization to appear. Defaults to 30.
+        Returns:
+            dict: {"created": [<org>], "existing": [<org>], "failed": [<org>]}
+        """
+        if destination_orgs is None:
+            destination_orgs = destination_quay_api.get_org_names()
+        missing_orgs = sorted(set(source_orgs) - set(destination_orgs))
+        result = {"created": [], "existing": sorted(set(source_orgs) & set(destination_orgs)), "failed": []}
+        logging.info(f"{len(result['existing'])} organizations already exist on the destination, {len(missing_orgs)} to create")
+
+        def create_and_confirm(org):
+            logging.info(f"Organization does not exist: {org} <---")
+            try:
+                destination_quay_api.create_org(org)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error creating organization {org}: {e}")
+            # The create may report an error if the org was created in the meantime, so trust the read back
+            return destination_quay_api.wait_for_org(org, timeout=timeout)
+
+        if missing_orgs:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="reconcile") as executor:
+                for org, confirmed in zip(missing_orgs, executor.map(create_and_confirm, missing_orgs)):
+                    if confirmed:
+                        result["created"].append(org)
+                    else:
+                        logging.error(f"Organization ---> {org} <--- did not appear on the destination within {timeout} seconds")
+                        result["failed"].append(org)
+        return result
+
+    @staticmethod
+    def take_org_ownership(orgs: dict = None, quay_server_api: QuayAPI = None, quay_username: Union[str,list[str]] = "quayadmin", 
+                           max_workers: int = 8, team_name: str = "owners", async_api: "AsyncQuayAPI" = None) -> dict:
         """
         Description: This staticmethod checks each of the organizations in quay. By default there is
                     a "owners" team on each org. If the {quay_username} is not in the owners team, it is added.
+                    The members of every org are fetched once and at the same time, the missing owners are worked
+                    out with set operations and the additions are sent concurrently. A summary is logged at the end.
+                    With async_api every organization is read and every owner added in one asyncio batch instead
         Args:
             orgs (dict, optional): A dict with organization attributes probably generated from quay_server_api.get_org(). Defaults to None.
             quay_server_api (QuayAPI, optional): An instantiation of the QuayAPI class probably done with 
                                                 QuayAPI(base_url=quay_url, api_token=quay_api_token). Defaults to None.
             quay_username (str or list, optional): A username (or list of usernames) which you want to ensure is the owner of all orgs. 
                                                 Defaults to quayadmin.
+            max_workers (int, optional): How many API calls are in flight at the same time. Defaults to 8.
+            team_name (str, optional): The team that makes a user an owner. Defaults to "owners".
+            async_api (AsyncQuayAPI, optional): Makes the API calls with asyncio instead of max_workers threads, capped by the
+                                                per-host limit of AsyncQuayAPI.configure_session(). Defaults to None.
+        Returns:
+            dict: {"added": [(<org>, <user>)], "already_owner": <int>, "failed": [(<org>, <user or None>)]}
         """
-        
-        def is_not_member(user, members):
+        def team_members(members):
             # expected dict example: {'members': [{'name': 'user1', 'kind': 'user', 'avatar': {'name': 'user1', 'hash': 'xxx', 'color': '#98df8a', 'kind': 'user'}, 'teams': [{'name': 'owners', 'avatar': {'name': 'owners', 'hash': 'xxx', 'color': '#c7c7c7', 'kind': 'team'}}], 'repositories': []}]}
-            for member in members['members']:
-                if member['name'] == user:
-                    return False
+            if not members or "members" not in members:
+                return None
+            return {member['name'] for member in members['members'] if any(team['name'] == team_name for team in member.get('teams', []))}
+
+        def add_owner(org_name, user):
+            try:
+                response = quay_server_api.create_org_member(org_name=org_name, new_member=user, team_name=team_name)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Failed to add {user} as an owner of --> {org_name} <--: {e}")
+                return False
+            if response.status_code != 200:
+                logging.error(f"Failed to add {user} as an owner of --> {org_name} <--: {response.status_code} {response.text}")
+                return False
+            logging.info(f"Added {user} as an owner of --> {org_name} <--")
             return True
-        
+
+        async def add_owner_async(org_name, user):
+            try:
+                response = await async_api.create_org_member(org_name=org_name, new_member=user, team_name=team_name)
+            except async_api.request_errors as e:
+                logging.error(f"Failed to add {user} as an owner of --> {org_name} <--: {e}")
+                return False
+            if response.status != 200:
+                logging.error(f"Failed to add {user} as an owner of --> {org_name} <--: {response.status} {await response.text()}")
+                return False
+            logging.info(f"Added {user} as an owner of --> {org_name} <--")
+            return True
+
+        def missing_owners_of(all_members):
+            missing_owners = []
+            for org_name, members in zip(org_names, all_members):
+                owners = team_members(members)
+                if owners is None:
+                    logging.error(f"Could not read the members of --> {org_name} <--")
+                    result["failed"].append((org_name, None))
+                    continue
+                result["already_owner"] += len(wanted_owners & owners)
+                missing_owners.extend((org_name, user) for user in sorted(wanted_owners - owners))
+            logging.info(f"{len(missing_owners)} owners to add across {len(org_names)} organizations")
+            return missing_owners
+
         if isinstance(quay_username, str):
             quay_username = [quay_username]
-        for org in orgs['organizations']:
-            # Start by assuming we are not the owner of the org
-            members = quay_server_api.get_org_members(org['name'])
-            for user in quay_username:
-                if is_not_member(user, members):
-                    logging.info(f"Adding {user} as an owner of --> {org['name']} <--")
-                    response = yaml.load(quay_server_api.create_org_member(org_name=org['name'], new_member=user, team_name="owners").content, Loader=yaml.FullLoader)
-                    try:
-                        logging.debug(f"Error Message from Server: \t\t---> {response['error_message']}")
-                        logging.debug(f"Error Type from Server: \t\t---> {response['error_type']}")
-                        logging.debug(f"Error Status Code from Server: \t---> {response['status']}")
-                    except Exception as e:
-                        logging.error("Failed to get a proper response from the Quay API when trying to process ---> {user} <---")
-                        print()
-                        print("==================================================")
-                        logging.error(e)
-                else:
-                    logging.info(f"{user} is already an owner of {org['name']}")
-            
\ No newline at end of file
+        wanted_owners = set(quay_username)
+        org_names = [org['name'] for org in (orgs or {}).get('organizations', [])]
+        result = {"added": [], "already_owner": 0, "failed": []}
+        start_time = time.perf_counter()
+        if async_api is not None:
+            missing_owners = missing_owners_of(async_api.run_all([async_api.get_org_members(org_name) for org_name in org_names]))
+            for pair, added in zip(missing_owners, async_api.run_all([add_owner_async(*pair) for pair in missing_owners])):
+                result["added" if added else "failed"].append(pair)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ownership") as executor:
+                missing_owners = missing_owners_of(executor.map(quay_server_api.get_org_members, org_names))
+                for pair, added in zip(missing_owners, executor.map(lambda pair: add_owner(*pair), missing_owners)):
+                    result["added" if added else "failed"].append(pair)
+        logging.info(f"Ownership summary after {time.perf_counter() - start_time:.1f} seconds: {len(org_names)} organizations, "
+                     f"{len(result['added'])} owners added, {result['already_owner']} already owners, {len(result['failed'])} failures")
+        for org_name, user in result["failed"]:
+            logging.error(f"Failed ---> {org_name} <--- {user or ''}")
+        return result
@@ -0,0 +1,227 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+
+
+class RequestScheduler:
+    # Retrying these cannot apply a change twice
+    idempotent_methods = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+    # Statuses that mean the server is overloaded or briefly unavailable
+    retry_statuses = {429, 500, 502, 503, 504}
+    throttle_statuses = {429, 503}
+
+    def __init__(self, rate: float = 0, burst: int = None, max_concurrency: int = 32, min_concurrency: int = 1,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30) -> None:
+        """
+        Description:
+            Paces the requests sent to each server. Every server gets a token bucket which limits the request
+            rate and an AIMD (additive increase, multiplicative decrease) limit on concurrent requests.
+            The concurrent limit grows slowly while the server keeps up and is halved whenever it answers
+            with 429/503. A Retry-After header pauses all new requests to that server until it has passed
+        Args:
+            rate (float, optional): Requests per second allowed to each server. 0 disables the token bucket. Defaults to 0.
+            burst (int, optional): How many requests can be sent at once when the bucket is full. Defaults to rate (minimum 1).
+            max_concurrency (int, optional): The highest concurrent limit AIMD can reach per server. Defaults to 32.
+            min_concurrency (int, optional): The lowest concurrent limit AIMD can fall to. Defaults to 1.
+            max_retries (int, optional): How many times an idempotent request is retried. Defaults to 4.
+            backoff_base (float, optional): Seconds of backoff before the first retry. Doubles on every retry. Defaults to 0.5.
+            backoff_max (float, optional): The longest backoff between two retries. Defaults to 30.
+        """
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.servers = {}
+        self.condition = threading.Condition()
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def server_state(self, server: str) -> dict:
+        """
+        Description:
+            Gets (or creates) the bucket and concurrency state for a server. The caller must hold self.condition
+        Args:
+            server (str): The hostname (and port) of the server
+        Returns:
+            dict: {"tokens": <float>, "updated": <float>, "limit": <float>, "in_flight": <int>, "paused_until": <float>}
+        """
+        if server not in self.servers:
+            # Start in the middle so the first burst of work neither crawls nor floods the server
+            starting_limit = max(self.min_concurrency, self.max_concurrency / 2)
+            self.servers[server] = {"tokens": float(self.burst), "updated": time.monotonic(),
+                                    "limit": starting_limit, "in_flight": 0, "paused_until": 0.0}
+        return self.servers[server]
+
+    def seed_limit(self, server: str, response_seconds: float, reference_seconds: float = 0.05) -> int:
+        """
+        Description:
+            Picks the starting concurrent limit for a server from a measured response time instead of starting
+            every server in the middle. On a nearby server a request finishes quickly, so a few requests in flight
+            keep it busy. On a far away server most of each request is spent waiting on the round trip, so more
+            requests need to be in flight to get the same throughput. The limit starts between a quarter of
+            max_concurrency and max_concurrency, and AIMD adjusts it from there
+        Args:
+            server (str): The hostname (and port) of the server
+            response_seconds (float): How long the server took to answer, for example the preflight first byte time.
+                                      None means the server could not be measured and it starts at the lowest limit
+            reference_seconds (float, optional): The response time that starts halfway between the lowest and highest starting limit. Defaults to 0.05.
+        Returns:
+            int: The starting limit
+        """
+        with self.condition:
+            state = self.server_state(server)
+            if response_seconds is None:
+                state["limit"] = float(self.min_concurrency)
+            else:
+                # Even a fast server answers heavier calls more slowly than the probe, so never start too low
+                floor = max(self.min_concurrency, self.max_concurrency // 4)
+                share = response_seconds / (response_seconds + reference_seconds)
+                state["limit"] = float(min(self.max_concurrency, round(floor + (self.max_concurrency - floor) * share)))
+            self.condition.notify_all()
+            return int(state["limit"])
+
+    def acquire(self, server: str) -> None:
+        """
+        Description:
+            Blocks until a request can be sent to the server: it must not be paused by Retry-After,
+            a concurrency slot must be free and the token bucket must have a token
+        Args:
+            server (str): The hostname (and port) of the server
+        """
+        with self.condition:
+            state = self.server_state(server)
+            while True:
+                now = time.monotonic()
+                if self.rate:
+                    state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated"]) * self.rate)
+                    state["updated"] = now
+                wait_for = 0.0
+                if now < state["paused_until"]:
+                    wait_for = state["paused_until"] - now
+                elif state["in_flight"] >= int(state["limit"]):
+                    # Woken up by release()
+                    wait_for = None
+                elif self.rate and state["tokens"] < 1:
+                    wait_for = (1 - state["tokens"]) / self.rate
+                else:
+                    if self.rate:
+                        state["tokens"] -= 1
+                    state["in_flight"] += 1
+                    self.stats["requests"] += 1
+                    return
+                self.condition.wait(wait_for)
+
+    def release(self, server: str, status_code: int = None, retry_after: float = None) -> None:
+        """
+        Description:
+            Frees the concurrency slot and adjusts the limit for the server based on how the request went
+        Args:
+            server (str): The hostname (and port) of the server
+            status_code (int, optional): The status of the response, None if the request failed to connect. Defaults to None.
+            retry_after (float, optional): Seconds from a Retry-After header. Defaults to None.
+        """
+        with self.condition:
+            state = self.server_state(server)
+            state["in_flight"] -= 1
+            if status_code in self.throttle_statuses:
+                self.stats["throttled"] += 1
+                state["limit"] = max(self.min_concurrency, state["limit"] / 2)
+                if retry_after:
+                    state["paused_until"] = max(state["paused_until"], time.monotonic() + retry_after)
+                logging.debug(f"{server} answered {status_code}... concurrency limit lowered to {int(state['limit'])}")
+            elif status_code is not None and status_code < 500:
+                # Roughly +1 for every full window of successful requests
+                state["limit"] = min(self.max_concurrency, state["limit"] + 1 / state["limit"])
+            self.condition.notify_all()
+
+    @staticmethod
+    def parse_retry_after(value: str) -> float:
+        """
+        Description:
+            Converts a Retry-After header to seconds. The header can be a number of seconds or an HTTP date
+        Args:
+            value (str): The header value
+        Returns:
+            float: The number of seconds to wait, or None if the header is missing or invalid
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Description:
+            Works out how long to wait before a retry. Uses exponential backoff with full jitter so
+            workers that failed together do not all retry at the same moment
+        Args:
+            attempt (int): The retry number, starting at 0
+            retry_after (float, optional): Seconds the server asked us to wait. Used as the minimum. Defaults to None.
+        Returns:
+            float: Seconds to wait
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        return max(delay, retry_after or 0)
+
+    def send(self, server: str, method: str, send_request) -> requests.Response:
+        """
+        Description:
+            Sends a request through the scheduler. Idempotent requests are retried with jittered backoff
+            on connection errors and 429/5xx responses. Other requests are only retried on 429 since the
+            server did not act on them
+        Args:
+            server (str): The hostname (and port) of the server
+            method (str): The HTTP method, used to decide if the request can be retried
+            send_request (callable): Sends the request and returns a requests.Response
+        Returns:
+            requests.Response: The last response. Connection errors are raised once the retries are used up
+        """
+        method = method.upper()
+        attempt = 0
+        while True:
+            self.acquire(server)
+            response = None
+            try:
+                response = send_request()
+            except requests.exceptions.RequestException as e:
+                self.release(server)
+                if method not in self.idempotent_methods or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logging.warning(f"{method} to {server} failed ({e})... retrying in {delay:.1f} seconds")
+            else:
+                retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                self.release(server, response.status_code, retry_after)
+                can_retry = method in self.idempotent_methods or response.status_code == 429
+                if response.status_code not in self.retry_statuses or not can_retry or attempt >= self.max_retries:
+                    return response
+                delay = self.backoff(attempt, retry_after)
+                logging.warning(f"{method} to {server} returned {response.status_code}... retrying in {delay:.1f} seconds")
+                response.close()
+            with self.condition:
+                self.stats["retries"] += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def scheduler_stats(self) -> dict:
+        """
+        Description:
+            Reports how many requests were sent, retried and throttled along with the current limit for each server
+        Returns:
+            dict: {"requests": <int>, "retries": <int>, "throttled": <int>, "limits": {<server>: <int>}}
+        """
+        with self.condition:
+            stats = dict(self.stats)
+            stats["limits"] = {server: int(state["limit"]) for server, state in self.servers.items()}
+        return stats
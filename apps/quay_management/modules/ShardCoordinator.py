@@ -0,0 +1,358 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from .Metrics import Metrics
+
+
+class ShardCoordinator:
+    # Points each worker gets on the hash ring. More points spread the shards more evenly between workers
+    ring_points = 64
+
+    def __init__(self, store_file: str, worker_id: str = None, shard_count: int = 64, lease_seconds: float = 60, max_attempts: int = 3) -> None:
+        """
+        Description:
+            Splits a sync between several quay_sync.py workers, possibly on different hosts. Every repository
+            belongs to one of shard_count shards (a hash of <org>/<repo>). The live workers are placed on a
+            consistent hash ring which decides the preferred worker of each shard, so adding or removing a
+            worker only moves the shards next to it on the ring. A worker has to hold a lease on a shard
+            before mirroring it. Leases and worker heartbeats are renewed in the background; when a worker
+            crashes its leases expire and the shards it had not finished are taken over by the others.
+            The store is a SQLite file, which can live on local disk for workers on one host or on a
+            shared filesystem with working locks (such as NFSv4) for workers on several hosts
+        Args:
+            store_file (str): The SQLite file shared by every worker. It is created if it does not exist
+            worker_id (str, optional): A name unique to this worker. Defaults to <hostname>-<pid>.
+            shard_count (int, optional): How many shards the repositories are split into. Every worker must use the same number. Defaults to 64.
+            lease_seconds (float, optional): How long a lease or heartbeat lasts without being renewed. Defaults to 60.
+            max_attempts (int, optional): How many times a shard with failed images is mirrored before it is marked done
+                                          with its failures. Defaults to 3.
+        """
+        self.store_file = store_file
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.shard_count = max(1, shard_count)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.run_id = None
+        self.held_shards = set()
+        self.stop_heartbeat = threading.Event()
+        self.heartbeat_thread = None
+        store_directory = os.path.dirname(os.path.abspath(store_file))
+        os.makedirs(store_directory, exist_ok=True)
+        # isolation_level=None lets every write use an explicit BEGIN IMMEDIATE so only one worker changes the leases at a time.
+        # WAL is not used because it does not work on network filesystems
+        self.connection = sqlite3.connect(store_file, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.transaction() as cursor:
+            cursor.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                shard_count INTEGER NOT NULL,
+                                started REAL NOT NULL,
+                                finished REAL)""")
+            cursor.execute("""CREATE TABLE IF NOT EXISTS members (
+                                run_id INTEGER NOT NULL,
+                                worker_id TEXT NOT NULL,
+                                expires REAL NOT NULL,
+                                PRIMARY KEY (run_id, worker_id))""")
+            cursor.execute("""CREATE TABLE IF NOT EXISTS shards (
+                                run_id INTEGER NOT NULL,
+                                shard INTEGER NOT NULL,
+                                owner TEXT,
+                                lease_expires REAL NOT NULL DEFAULT 0,
+                                done INTEGER NOT NULL DEFAULT 0,
+                                completed_by TEXT,
+                                PRIMARY KEY (run_id, shard))""")
+            # One row for every attempt at a shard that had failed images
+            cursor.execute("""CREATE TABLE IF NOT EXISTS shard_failures (
+                                run_id INTEGER NOT NULL,
+                                shard INTEGER NOT NULL,
+                                worker_id TEXT NOT NULL,
+                                failed_images INTEGER NOT NULL,
+                                failed_at REAL NOT NULL)""")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Description:
+            Context manager for a write transaction. BEGIN IMMEDIATE takes the database write lock straight away
+            so two workers can never read the same free lease and both claim it. The transaction is committed
+            when the block finishes and rolled back if it raises
+        Yields:
+            sqlite3.Cursor: The cursor to run the statements with
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    @staticmethod
+    def hash_value(key: str) -> int:
+        """
+        Description:
+            Hashes a string to a 64 bit position. The same key gives the same position on every host
+        Args:
+            key (str): The string to hash
+        Returns:
+            int: The position
+        """
+        return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+    def shard_for(self, repository: str) -> int:
+        """
+        Description:
+            Finds the shard a repository belongs to. Every tag of a repository lands in the same shard
+        Args:
+            repository (str): <org>/<repo>
+        Returns:
+            int: The shard number
+        """
+        return self.hash_value(repository) % self.shard_count
+
+    @classmethod
+    def build_ring(cls, members: list) -> list:
+        """
+        Description:
+            Places every worker on the hash ring ring_points times
+        Args:
+            members (list): The live worker ids
+        Returns:
+            list: Sorted (<position>, <worker id>) points
+        """
+        return sorted((cls.hash_value(f"{member}#{point}"), member) for member in members for point in range(cls.ring_points))
+
+    def ring_owner(self, shard: int, ring: list) -> str:
+        """
+        Description:
+            Finds the preferred worker for a shard: the first worker point clockwise from the shard on the ring
+        Args:
+            shard (int): The shard number
+            ring (list): The ring from build_ring()
+        Returns:
+            str: The worker id, or None if the ring is empty
+        """
+        if not ring:
+            return None
+        position = bisect.bisect(ring, (self.hash_value(f"shard-{shard}"), ""))
+        return ring[position % len(ring)][1]
+
+    def join(self) -> int:
+        """
+        Description:
+            Joins the run in progress or starts a new one, registers this worker and starts renewing its
+            heartbeat and leases. A run in progress whose workers have all stopped renewing for longer than
+            a lease is treated as abandoned and a new run is started
+        Returns:
+            int: The run id
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            run = cursor.execute("SELECT run_id, shard_count, started FROM runs WHERE finished IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+            if run:
+                live_members = cursor.execute("SELECT COUNT(*) FROM members WHERE run_id=? AND expires>?", (run[0], now)).fetchone()[0]
+                if not live_members and run[2] < now - self.lease_seconds:
+                    logging.warning(f"Shard run {run[0]} was abandoned by its workers... starting a new run")
+                    cursor.execute("UPDATE runs SET finished=? WHERE run_id=?", (now, run[0]))
+                    run = None
+            if run is None:
+                cursor.execute("INSERT INTO runs (shard_count, started) VALUES (?, ?)", (self.shard_count, now))
+                run = (cursor.lastrowid, self.shard_count, now)
+                cursor.executemany("INSERT INTO shards (run_id, shard) VALUES (?, ?)", [(run[0], shard) for shard in range(self.shard_count)])
+            if run[1] != self.shard_count:
+                logging.critical(f"Shard run {run[0]} uses {run[1]} shards but this worker was started with {self.shard_count}")
+                exit(1)
+            self.run_id = run[0]
+            cursor.execute("INSERT OR REPLACE INTO members (run_id, worker_id, expires) VALUES (?, ?, ?)",
+                           (self.run_id, self.worker_id, now + self.lease_seconds))
+        logging.info(f"Worker ---> {self.worker_id} <--- joined shard run {self.run_id} ({self.shard_count} shards)")
+        self.stop_heartbeat.clear()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, name="shard-heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+        return self.run_id
+
+    def heartbeat(self) -> None:
+        """
+        Description:
+            Renews this worker's membership and every lease it holds three times per lease period until leave() is called
+        """
+        while not self.stop_heartbeat.wait(self.lease_seconds / 3):
+            expires = time.time() + self.lease_seconds
+            try:
+                # held_shards only changes inside a transaction so it cannot change while the leases are renewed
+                with self.transaction() as cursor:
+                    cursor.execute("UPDATE members SET expires=? WHERE run_id=? AND worker_id=?", (expires, self.run_id, self.worker_id))
+                    for shard in list(self.held_shards):
+                        cursor.execute("UPDATE shards SET lease_expires=? WHERE run_id=? AND shard=? AND owner=? AND done=0",
+                                       (expires, self.run_id, shard, self.worker_id))
+                        if not cursor.rowcount:
+                            # Another worker took it over after the lease expired. The copies are idempotent so carrying on is safe
+                            logging.warning(f"Lost the lease on shard {shard}... another worker may mirror it as well")
+                            self.held_shards.discard(shard)
+            except sqlite3.Error as e:
+                logging.error(f"Could not renew the shard leases in {self.store_file}: {e}")
+
+    def live_members(self, cursor) -> list:
+        """
+        Description:
+            Lists the workers whose heartbeat has not expired. Must be called inside a transaction
+        Args:
+            cursor: The cursor of the current transaction
+        Returns:
+            list: The worker ids, always including this worker
+        """
+        rows = cursor.execute("SELECT worker_id FROM members WHERE run_id=? AND expires>?", (self.run_id, time.time())).fetchall()
+        return sorted({row[0] for row in rows} | {self.worker_id})
+
+    def claim_next(self) -> int:
+        """
+        Description:
+            Claims the next shard to mirror. Shards this worker is the preferred owner of come first. After that,
+            shards nobody holds a lease on (or whose lease expired because the worker crashed) are taken over
+        Returns:
+            int: The shard number, or None if there is nothing left that can be claimed right now
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            ring = self.build_ring(self.live_members(cursor))
+            rows = cursor.execute("SELECT shard, owner, lease_expires FROM shards WHERE run_id=? AND done=0", (self.run_id,)).fetchall()
+            free = [(shard, owner) for shard, owner, lease_expires in rows if owner is None or lease_expires <= now]
+            if not free:
+                return None
+            preferred = [(shard, owner) for shard, owner in free if self.ring_owner(shard, ring) == self.worker_id]
+            # Owners work through their shards from the lowest number, so helpers start from the highest to
+            # take the shards the owner would reach last and keep most shards on the worker with their sync state
+            shard, previous_owner = preferred[0] if preferred else free[-1]
+            cursor.execute("UPDATE shards SET owner=?, lease_expires=? WHERE run_id=? AND shard=?",
+                           (self.worker_id, now + self.lease_seconds, self.run_id, shard))
+            self.held_shards.add(shard)
+        if previous_owner and previous_owner != self.worker_id:
+            logging.warning(f"Taking over shard {shard} from ---> {previous_owner} <--- whose lease expired")
+            Metrics.increment("shards_total", outcome="taken_over")
+        elif not preferred:
+            logging.info(f"Helping with shard {shard}, which belongs to another worker that has not started it yet")
+        return shard
+
+    def wait_for_shards(self, poll_interval: float = 1) -> bool:
+        """
+        Description:
+            Blocks while every shard that is not done is leased by another worker. Polling continues so the
+            shards of a worker that crashes are taken over once its leases expire
+        Args:
+            poll_interval (float, optional): Seconds between checks. Defaults to 1.
+        Returns:
+            bool: True when a shard can be claimed, False once every shard of the run is done
+        """
+        waiting_logged = False
+        while True:
+            progress = self.progress()
+            if progress["done"] >= self.shard_count:
+                return False
+            if progress["free"]:
+                return True
+            if not waiting_logged:
+                logging.info(f"Waiting on other workers: {progress['done']}/{self.shard_count} shards done, {progress['leased']} in progress")
+                waiting_logged = True
+            time.sleep(poll_interval)
+
+    def complete(self, shard: int) -> None:
+        """
+        Description:
+            Marks a shard as done. The run is finished once every shard is done
+        Args:
+            shard (int): The shard number
+        """
+        with self.transaction() as cursor:
+            self.mark_done(cursor, shard)
+        Metrics.increment("shards_total", outcome="completed")
+
+    def mark_done(self, cursor, shard: int) -> None:
+        """
+        Description:
+            Marks a shard as done and the run as finished if it was the last one. Must be called inside a transaction
+        Args:
+            cursor: The cursor of the current transaction
+            shard (int): The shard number
+        """
+        cursor.execute("UPDATE shards SET done=1, completed_by=?, lease_expires=0 WHERE run_id=? AND shard=?", (self.worker_id, self.run_id, shard))
+        remaining = cursor.execute("SELECT COUNT(*) FROM shards WHERE run_id=? AND done=0", (self.run_id,)).fetchone()[0]
+        if not remaining:
+            cursor.execute("UPDATE runs SET finished=? WHERE run_id=? AND finished IS NULL", (time.time(), self.run_id))
+        self.held_shards.discard(shard)
+
+    def fail(self, shard: int, failed_images: int) -> bool:
+        """
+        Description:
+            Records that a shard finished with failed images. The shard is given back without being marked done so
+            it is mirrored again, by this worker or another one, until it has failed max_attempts times. After that
+            it is marked done so the run can finish, and its images are left for the next run
+        Args:
+            shard (int): The shard number
+            failed_images (int): How many images or repositories of the shard could not be mirrored
+        Returns:
+            bool: True if the shard will be retried, False if it was given up on
+        """
+        with self.transaction() as cursor:
+            cursor.execute("INSERT INTO shard_failures VALUES (?, ?, ?, ?, ?)", (self.run_id, shard, self.worker_id, failed_images, time.time()))
+            attempts = cursor.execute("SELECT COUNT(*) FROM shard_failures WHERE run_id=? AND shard=?", (self.run_id, shard)).fetchone()[0]
+            retry = attempts < self.max_attempts
+            if retry:
+                cursor.execute("UPDATE shards SET owner=NULL, lease_expires=0 WHERE run_id=? AND shard=? AND owner=?", (self.run_id, shard, self.worker_id))
+                self.held_shards.discard(shard)
+            else:
+                self.mark_done(cursor, shard)
+        if retry:
+            logging.warning(f"Shard {shard} had {failed_images} failures on attempt {attempts} of {self.max_attempts}... handing it back to be mirrored again")
+            Metrics.increment("shards_total", outcome="retried")
+        else:
+            logging.error(f"Giving up on shard {shard} after {attempts} attempts... its {failed_images} failures are left for the next run")
+            Metrics.increment("shards_total", outcome="failed")
+        return retry
+
+    def release(self, shard: int) -> None:
+        """
+        Description:
+            Gives a shard back without marking it done so another worker can pick it up straight away
+        Args:
+            shard (int): The shard number
+        """
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE shards SET owner=NULL, lease_expires=0 WHERE run_id=? AND shard=? AND owner=?", (self.run_id, shard, self.worker_id))
+            self.held_shards.discard(shard)
+        Metrics.increment("shards_total", outcome="released")
+
+    def progress(self) -> dict:
+        """
+        Description:
+            Counts the shards of the run by state
+        Returns:
+            dict: {"done": <int>, "leased": <int>, "free": <int>, "members": <int>}
+        """
+        now = time.time()
+        with self.lock:
+            done, leased = self.connection.execute("SELECT COALESCE(SUM(done), 0), COALESCE(SUM(done=0 AND owner IS NOT NULL AND lease_expires>?), 0) FROM shards WHERE run_id=?",
+                                                   (now, self.run_id)).fetchone()
+            members = self.connection.execute("SELECT COUNT(*) FROM members WHERE run_id=? AND expires>?", (self.run_id, now)).fetchone()[0]
+        return {"done": done, "leased": leased, "free": self.shard_count - done - leased, "members": members}
+
+    def leave(self) -> None:
+        """
+        Description:
+            Stops the heartbeat, gives back any shard still held and removes this worker from the ring
+        """
+        self.stop_heartbeat.set()
+        if self.heartbeat_thread:
+            self.heartbeat_thread.join()
+        for shard in list(self.held_shards):
+            self.release(shard)
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM members WHERE run_id=? AND worker_id=?", (self.run_id, self.worker_id))
+        self.connection.close()
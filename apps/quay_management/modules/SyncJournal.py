@@ -0,0 +1,228 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from .Metrics import Metrics
+
+
+class SyncJournal:
+    # Seconds between commits of the buffered entries. A crash loses at most this much of the journal,
+    # and the images in it are simply mirrored again by --resume
+    flush_interval = 2
+    # Commit early once this many entries are buffered
+    flush_entries = 1000
+
+    def __init__(self, journal_file: str, flush_interval: float = None) -> None:
+        """
+        Description:
+            A durable record of the images a sync has handed to the MirrorEngine and the ones that finished, so a
+            sync that is killed partway through can be resumed. The MirrorEngine threads only add entries to a
+            buffer, which a background thread commits every flush_interval seconds in a single transaction
+        Args:
+            journal_file (str): The full path to the SQLite database. It is created if it does not exist
+            flush_interval (float, optional): Seconds between commits. Defaults to SyncJournal.flush_interval.
+        """
+        self.journal_file = journal_file
+        self.flush_interval = flush_interval or self.flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(journal_file)), exist_ok=True)
+        self.connection = sqlite3.connect(journal_file, check_same_thread=False)
+        # connection_lock is held while committing, lock only while touching the buffer, so adding entries never waits on the disk
+        self.connection_lock = threading.Lock()
+        self.lock = threading.Lock()
+        # [(<sql>, <parameters>)] waiting for the next commit
+        self.buffer = []
+        self.buffer_ready = threading.Condition(self.lock)
+        self.run_id = None
+        # {<org>/<repo>: {"open": <images not finished>, "listed": <bool>, "failed": <bool>}}. Only used on the thread running the sync
+        self.repositories = {}
+        self.stop_requested = threading.Event()
+        self.flush_thread = None
+        with self.connection_lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        started REAL NOT NULL,
+                                        finished REAL)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS units (
+                                        run_id INTEGER NOT NULL,
+                                        image TEXT NOT NULL,
+                                        source_digest TEXT,
+                                        status TEXT NOT NULL,
+                                        updated REAL NOT NULL,
+                                        PRIMARY KEY (run_id, image))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS repositories (
+                                        run_id INTEGER NOT NULL,
+                                        repository TEXT NOT NULL,
+                                        PRIMARY KEY (run_id, repository))""")
+            self.connection.commit()
+
+    @staticmethod
+    def repository_of(image: str) -> str:
+        """
+        Description:
+            Returns the repository of an image
+        Args:
+            image (str): <org>/<repo>:<tag> or <org>/<repo>@<digest>
+        Returns:
+            str: <org>/<repo>
+        """
+        return image.split("@")[0].split(":")[0]
+
+    def start_run(self, resume: bool = False) -> dict:
+        """
+        Description:
+            Starts journaling a sync. With resume the last run that did not finish is continued, otherwise any
+            unfinished run is closed and a new one is started. Entries of closed runs are deleted
+        Args:
+            resume (bool, optional): Continue the last unfinished run. Defaults to False.
+        Returns:
+            dict: What the resumed run already did. {"done": {<image>: <source digest>}, "in_flight": {<image>: <source digest>},
+                  "repositories": <set of <org>/<repo> whose every image finished>}. Empty when a new run is started
+        """
+        resumed = {"done": {}, "in_flight": {}, "repositories": set()}
+        with self.connection_lock:
+            run = self.connection.execute("SELECT run_id, started FROM runs WHERE finished IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+            if run and resume:
+                self.run_id = run[0]
+                for image, source_digest, status in self.connection.execute("SELECT image, source_digest, status FROM units WHERE run_id=?", (self.run_id,)):
+                    if status == "done":
+                        resumed["done"][image] = source_digest
+                    elif status == "in_flight":
+                        resumed["in_flight"][image] = source_digest
+                resumed["repositories"] = {row[0] for row in self.connection.execute("SELECT repository FROM repositories WHERE run_id=?", (self.run_id,))}
+                self.connection.execute("UPDATE runs SET finished=? WHERE finished IS NULL AND run_id<>?", (time.time(), self.run_id))
+                started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run[1]))
+                logging.info(f"Resuming the sync started at {started} ---> {len(resumed['done'])} images done, {len(resumed['in_flight'])} in flight <---")
+            else:
+                if resume:
+                    logging.warning("There is no unfinished sync to resume... starting a new one")
+                self.connection.execute("UPDATE runs SET finished=? WHERE finished IS NULL", (time.time(),))
+                self.run_id = self.connection.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),)).lastrowid
+            for table in ("units", "repositories"):
+                self.connection.execute(f"DELETE FROM {table} WHERE run_id IN (SELECT run_id FROM runs WHERE finished IS NOT NULL)")
+            self.connection.commit()
+        self.stop_requested.clear()
+        self.flush_thread = threading.Thread(target=self.flush_loop, name="journal-flush", daemon=True)
+        self.flush_thread.start()
+        return resumed
+
+    def write(self, sql: str, parameters: tuple) -> None:
+        """
+        Description:
+            Buffers a write for the next commit
+        Args:
+            sql (str): The statement
+            parameters (tuple): Its parameters
+        """
+        with self.lock:
+            self.buffer.append((sql, parameters))
+            if len(self.buffer) >= self.flush_entries:
+                self.buffer_ready.notify()
+
+    def track(self, jobs):
+        """
+        Description:
+            Passes jobs through to the MirrorEngine, journaling each one as in flight as it is handed over
+        Args:
+            jobs (iterable): MirrorEngine jobs
+        Yields:
+            dict: The same jobs
+        """
+        for job in jobs:
+            if self.run_id is not None:
+                repository = self.repositories.setdefault(self.repository_of(job["image_and_tag"]), {"open": 0, "listed": False, "failed": False})
+                repository["open"] += 1
+                self.write("INSERT OR REPLACE INTO units VALUES (?, ?, ?, 'in_flight', ?)", (self.run_id, job["image_and_tag"], job.get("source_digest"), time.time()))
+            yield job
+
+    def unit_finished(self, job: dict, outcome: str) -> None:
+        """
+        Description:
+            Journals an image as done, or as failed so a resume tries it again. Passed to MirrorEngine.run() as on_finished
+        Args:
+            job (dict): The job that finished
+            outcome (str): "mirrored", "unchanged", "partial" or "failed"
+        """
+        if self.run_id is None:
+            return
+        done = outcome in ("mirrored", "unchanged")
+        self.write("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?)",
+                   (self.run_id, job["image_and_tag"], job.get("source_digest"), "done" if done else "failed", time.time()))
+        Metrics.increment("journal_units_total", status="done" if done else "failed")
+        name = self.repository_of(job["image_and_tag"])
+        repository = self.repositories.get(name)
+        if repository:
+            repository["open"] -= 1
+            repository["failed"] = repository["failed"] or not done
+            self.repository_finished(name)
+
+    def repository_listed(self, name: str) -> None:
+        """
+        Description:
+            Called once every tag of a repository has been handed over. The repository is journaled as done when its images finish
+        Args:
+            name (str): <org>/<repo>
+        """
+        if self.run_id is None:
+            return
+        self.repositories.setdefault(name, {"open": 0, "listed": False, "failed": False})["listed"] = True
+        self.repository_finished(name)
+
+    def repository_finished(self, name: str) -> None:
+        repository = self.repositories[name]
+        if repository["listed"] and not repository["open"]:
+            del self.repositories[name]
+            if not repository["failed"]:
+                self.write("INSERT OR REPLACE INTO repositories VALUES (?, ?)", (self.run_id, name))
+
+    def flush(self) -> None:
+        """
+        Description:
+            Commits the buffered entries in a single transaction
+        """
+        with self.connection_lock:
+            # Swapped while holding connection_lock so batches are committed in the order they were written
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+            if not buffer:
+                return
+            with Metrics.timer("journal_flush_seconds"):
+                for sql, parameters in buffer:
+                    self.connection.execute(sql, parameters)
+                self.connection.commit()
+
+    def flush_loop(self) -> None:
+        while not self.stop_requested.is_set():
+            with self.lock:
+                self.buffer_ready.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Could not write the sync journal: {e}")
+
+    def finish_run(self) -> None:
+        """
+        Description:
+            Marks the run as finished so it is not resumed. Later calls to the journal are ignored
+        """
+        if self.run_id is None:
+            return
+        self.write("UPDATE runs SET finished=? WHERE run_id=?", (time.time(), self.run_id))
+        self.flush()
+        self.run_id = None
+        self.repositories = {}
+
+    def close(self) -> None:
+        """
+        Description:
+            Commits anything still buffered and closes the database. A run that was not finished can be resumed
+        """
+        self.stop_requested.set()
+        with self.lock:
+            self.buffer_ready.notify()
+        if self.flush_thread:
+            self.flush_thread.join()
+        self.flush()
+        with self.connection_lock:
+            self.connection.close()
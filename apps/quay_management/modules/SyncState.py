@@ -0,0 +1,148 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class SyncState:
+    # How many recorded tags are buffered before they are committed to disk
+    commit_every = 50
+
+    def __init__(self, state_file: str) -> None:
+        """
+        Description:
+            A small SQLite store that remembers the manifest digest of every tag that has been mirrored so
+            later runs only need to copy tags that are new or have changed. It also remembers a repository on
+            each destination that holds every blob uploaded, so later runs can mount a layer instead of uploading it
+        Args:
+            state_file (str): The full path to the SQLite database. It is created if it does not exist
+        """
+        self.state_file = state_file
+        state_directory = os.path.dirname(os.path.abspath(state_file))
+        os.makedirs(state_directory, exist_ok=True)
+        # Worker threads record results so the connection is shared and guarded by a lock
+        self.connection = sqlite3.connect(state_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS tags (
+                                        source_server TEXT NOT NULL,
+                                        destination_server TEXT NOT NULL,
+                                        image TEXT NOT NULL,
+                                        source_digest TEXT,
+                                        destination_digest TEXT,
+                                        synced_at REAL,
+                                        PRIMARY KEY (source_server, destination_server, image))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS blobs (
+                                        destination_server TEXT NOT NULL,
+                                        digest TEXT NOT NULL,
+                                        repository TEXT NOT NULL,
+                                        PRIMARY KEY (destination_server, digest))""")
+            self.connection.commit()
+        logging.info(f"Using sync state from ---> {state_file} <---")
+
+    def get_tag(self, source_server: str, destination_server: str, image: str) -> dict:
+        """
+        Description:
+            Looks up what was recorded the last time a tag was mirrored
+        Args:
+            source_server (str): The registry the tag was mirrored from
+            destination_server (str): The registry the tag was mirrored to
+            image (str): The image in the format <org>/<repo>:<tag>
+        Returns:
+            dict: {"source_digest": <str>, "destination_digest": <str>, "synced_at": <float>} or None if the tag has never been mirrored
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT source_digest, destination_digest, synced_at FROM tags WHERE source_server=? AND destination_server=? AND image=?",
+                                          (source_server, destination_server, image)).fetchone()
+        if row is None:
+            return None
+        return {"source_digest": row[0], "destination_digest": row[1], "synced_at": row[2]}
+
+    def is_current(self, source_server: str, destination_server: str, image: str, source_digest: str) -> bool:
+        """
+        Description:
+            Checks if a tag was already mirrored at the digest it currently has on the source
+        Args:
+            source_server (str): The registry the tag is mirrored from
+            destination_server (str): The registry the tag is mirrored to
+            image (str): The image in the format <org>/<repo>:<tag>
+            source_digest (str): The manifest digest the tag currently points to on the source
+        Returns:
+            bool: True if nothing changed since the last successful copy
+        """
+        if not source_digest:
+            return False
+        recorded = self.get_tag(source_server, destination_server, image)
+        if recorded is None:
+            return False
+        return recorded["source_digest"] == source_digest and bool(recorded["destination_digest"])
+
+    def record_tag(self, source_server: str, destination_server: str, image: str, source_digest: str, destination_digest: str) -> None:
+        """
+        Description:
+            Records a successful copy. Writes are committed in batches, call close() to flush the rest
+        Args:
+            source_server (str): The registry the tag was mirrored from
+            destination_server (str): The registry the tag was mirrored to
+            image (str): The image in the format <org>/<repo>:<tag>
+            source_digest (str): The manifest digest on the source
+            destination_digest (str): The manifest digest on the destination
+        """
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?)",
+                                    (source_server, destination_server, image, source_digest, destination_digest, time.time()))
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def get_blob_location(self, destination_server: str, digest: str) -> str:
+        """
+        Description:
+            Looks up a repository on a destination that was recorded as holding a blob
+        Args:
+            destination_server (str): The destination registry
+            digest (str): The digest of the blob
+        Returns:
+            str: <org>/<repo>, or None if the blob was never recorded on that destination
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT repository FROM blobs WHERE destination_server=? AND digest=?", (destination_server, digest)).fetchone()
+        return row[0] if row else None
+
+    def record_blob_location(self, destination_server: str, digest: str, repository: str) -> None:
+        """
+        Description:
+            Records that a repository on a destination holds a blob. Writes are batched with the tags
+        Args:
+            destination_server (str): The destination registry
+            digest (str): The digest of the blob
+            repository (str): <org>/<repo> that holds the blob
+        """
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (destination_server, digest, repository))
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def flush(self) -> None:
+        """
+        Description:
+            Commits anything still buffered without closing the database
+        """
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self) -> None:
+        """
+        Description:
+            Commits anything still buffered and closes the database
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -1,30 +1,47 @@
 #!/usr/bin/env python
 import logging
 import argparse
+from modules.AsyncQuayAPI import AsyncQuayAPI
 from modules.QuayAPI import QuayAPI
 from modules.BaseOperations import BaseOperations
 from modules.QuayOperations import QuayManagement
 from modules.OpenShiftOperations import OpenShiftCommands
+from modules.KubernetesAPI import KubernetesAPI
+from modules.ManifestScheduler import ManifestScheduler
+from modules.Metrics import Metrics
+from modules.PreflightChecker import PreflightChecker
 import time
 import math
 import datetime
 import ast
 import yaml
 import base64
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 parser = argparse.ArgumentParser(description='Process some integers.')
 parser.add_argument("--add-admin-org", action="store_true", help="Create the administrative organization")
 parser.add_argument("--add-proxycache", action="store_true", help="Add ProxyCache to an organization", default=False)
 parser.add_argument("--add-robot-account", action="store_true", help="Adds robot accounts to a personal account or an organization", default=False)
 parser.add_argument("--add-super-user", action="store_true", help="Whether or not to add the super user for Quay", default=False)
+parser.add_argument("--all-quay-servers", action="store_true", help="With --initialize-oauth, create the OAUTH token on the primary and secondary Quay servers at the same time", default=False)
+parser.add_argument("--async-api", action="store_true", help="Make the Quay API calls of --take-ownership and --take-ownership-all-super-users with asyncio (needs aiohttp), --ownership-workers at a time", default=False)
 parser.add_argument('--config-file', help="The full path to the config file", required=True)
 parser.add_argument("--configure-secondary-quay-server", action="store_true", help="If this flag is set, assume that you are installing a quay mirror. The quay sync program will activate assuming this server is the secondary.")
 parser.add_argument("--debug", action="store_true", help="Should debug be turned on. Files will be written to disk and not cleaned up")
 parser.add_argument("--initialize-user", action="store_true", help="Create the first user for Quay")
 parser.add_argument("--initialize-oauth", action="store_true", help="Create the first OAUTH token for Quay")
 parser.add_argument("--manage-orgs", action="store_true", help="Whether or not this program should create/remove orgs in the config.yaml")
+parser.add_argument("--manifest-workers", type=int, default=4, help="How many independent OpenShift manifests can be applied at the same time with --setup-quay-openshift")
+parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on http://<host>:<port>/metrics while the tasks are running")
+parser.add_argument("--metrics-textfile", help="Write Prometheus metrics to this file when the tasks finish, for the node_exporter textfile collector")
+parser.add_argument("--openshift-api-client", action="store_true", help="Talk to the OpenShift API directly over one connection instead of running `oc` for every call", default=False)
 parser.add_argument("--openshift-yaml-dir", help="The full path to the YAML files to apply to the cluster. They should be prefixed with the a number associated with the order to apply them.")
 parser.add_argument("--overwrite-proxycache", action="store_true", help="Should any current proxycache be overridden?")
+parser.add_argument("--ownership-workers", type=int, default=8, help="How many Quay API calls --take-ownership and --take-ownership-all-super-users make at the same time")
+parser.add_argument("--preflight-timeout", type=float, default=5, help="Seconds each preflight step (DNS, connect, TLS, first byte) may take before a server is treated as unreachable")
 parser.add_argument("--setup-quay-openshift", action="store_true", help="Have the management script apply OpenShift Quay configs")
 parser.add_argument("--skip-tls-verify", action="store_true", help="Ignore self signed certs on registries", default=False)
 parser.add_argument("--take-ownership", action="store_true", help="Ensure that the quay user used in the automation has ownership over all orgs")
@@ -41,7 +58,14 @@ else:
 if __name__ == "__main__":
     logging.info(f"----> Starting at {datetime.datetime.now()}")
     start_time = time.perf_counter()
+    Metrics.configure(namespace="quay_management", textfile=args.metrics_textfile, port=args.metrics_port)
+    Metrics.start_phase("load_config")
     quay_config = BaseOperations(args.config_file, args=args)
+    # Every OpenShift call goes through this class so the `oc` and API clients are interchangeable
+    openshift = OpenShiftCommands
+    if args.openshift_api_client:
+        KubernetesAPI.configure(skip_tls_verify=args.skip_tls_verify)
+        openshift = KubernetesAPI
     
     check_quay_options = True
     openshift_logged_in = False
@@ -52,8 +76,8 @@ if __name__ == "__main__":
         number_of_args_passed_in = 0
         for user_args in vars(args):
             if getattr(args, user_args):
-                # Debug options should not be counted as it doesn't influence the required options
-                if user_args == "debug":
+                # Debug and tuning options should not be counted as they don't influence the required options
+                if user_args in ["async_api", "debug", "manifest_workers", "metrics_port", "metrics_textfile", "openshift_api_client", "ownership_workers", "preflight_timeout"]:
                     continue
                 number_of_args_passed_in +=1
         # If there are only the config file and a single option probably can skip the quay info parsing
@@ -74,7 +98,7 @@ if __name__ == "__main__":
             quay_secret_config = "primary_quay_init_config"
         
         # These options don't need Quay Information
-        dont_need_quay = ["initialize_oauth", "setup_quay_openshift", "add_super_user"]
+        dont_need_quay = ["initialize_oauth", "setup_quay_openshift", "add_super_user", "all_quay_servers", "openshift_api_client"]
         
         # We want to capture any arguments passed in by the user
         # which will be True
@@ -107,47 +131,49 @@ if __name__ == "__main__":
         if args.initialize_oauth:
             quay_url = eval("quay_config.%s" % quay_server)
 
+    # Check everything this run will talk to at once, so an unreachable host fails the run in seconds
+    Metrics.start_phase("preflight")
+    preflight_endpoints = {}
+    if args.add_super_user or args.setup_quay_openshift or args.initialize_oauth or args.take_ownership_all_super_users:
+        preflight_endpoints["openshift api"] = (quay_config.config.get("openshift_api_url"), "/readyz")
+        if args.initialize_oauth and args.all_quay_servers:
+            for server_type in ("primary", "secondary"):
+                preflight_endpoints[f"{server_type} openshift api"] = (quay_config.config.get(f"{server_type}_openshift_api_url"), "/readyz")
+    if check_quay_options and need_quay_info:
+        preflight_endpoints["quay"] = (quay_url, "/health/instance")
+    PreflightChecker.probe_all({name: target for name, target in preflight_endpoints.items() if target[0]},
+                               timeout=args.preflight_timeout, verify_tls=not args.skip_tls_verify)
+
     # The order might matter. We need to make sure quay is setup first, if that option is passed in
     # After quay is setup, if we are initializing a user that has to happen next
     # If neither of these options are passed in, we assume that we have a valid username and token
     # as well as the appropriate permissions to make modifications to Quay (i.e. we are a super user)
     if args.setup_quay_openshift:
-        quay_init_config = eval("quay_config.%s" % quay_secret_config)
-        quay_config.primary_quay_init_config
-        OpenShiftCommands.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
+        Metrics.start_phase("setup_quay_openshift")
+        openshift.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
         openshift_logged_in = True
         yaml_list = BaseOperations.yaml_file_list(quay_config.openshift_yaml_dir)
-        for yaml_file in yaml_list:
-            delay = False
-            logging.info(f"Apply ---> {yaml_file} \n")
-            which_yaml_file = BaseOperations.load_config(config_file=yaml_file)
-            try:
-                number_of_replicas = which_yaml_file['spec']['replicas']
-            except:
-                # Its possible that the yaml doesn't have replicas, so ignore that error
-                pass
+
+        def apply_manifest(yaml_file, which_yaml_file):
+            """
+            Description:
+                Local function that applies a single manifest and waits for whatever it creates to be ready.
+                Called by the ManifestScheduler once everything the manifest depends on has finished
+            Args:
+                yaml_file (str): The full path to the manifest
+                which_yaml_file (dict): The loaded manifest
+            """
+            number_of_replicas = which_yaml_file.get('spec', {}).get('replicas')
             if which_yaml_file['kind'] == "Subscription":
                 if which_yaml_file['metadata']['name'] == "quay-operator":
-                    # We need to strip out LDAP in order to initialize the user
-                    ldap_in_config = any("ldap" in key.lower() for key in BaseOperations.load_config(config_file=quay_init_config))
-                    if ldap_in_config:
-                        quay_init_config_origin = quay_init_config
-                        # This config file has the LDAP bits removed as it is a copy of the original config
-                        quay_init_config = BaseOperations.strip_ldap_from_config(quay_init_config)
-                    OpenShiftCommands.openshift_create_secret(namespace=quay_namespace, file_path=quay_init_config)
-                    OpenShiftCommands.openshift_apply_file(yaml_file)
-                    logging.debug("----> Waiting for the Quay Registry to be created...")
-                    OpenShiftCommands.openshift_waitfor_object(
-                                                                openshift_object="quayregistry", 
-                                                                iterations=10, 
-                                                                delay_between_checks=100, 
-                                                                namespace=quay_namespace, 
-                                                                crd="quayregistry"
-                                                                )
+                    openshift.openshift_apply_file(yaml_file)
+                    logging.debug("----> Waiting for the Quay operator (and the QuayRegistry CRD) to be installed...")
+                    openshift.openshift_waitfor_subscription(subscription_name=which_yaml_file['metadata']['name'], 
+                                                                    namespace=which_yaml_file['metadata'].get('namespace'), 
+                                                                    timeout=1000)
                 elif which_yaml_file['metadata']['name'] == "odf-operator":
-                    OpenShiftCommands.openshift_apply_file(yaml_file)
-                    namespace: str = None, 
-                    OpenShiftCommands.openshift_waitfor_pods(
+                    openshift.openshift_apply_file(yaml_file)
+                    openshift.openshift_waitfor_pods(
                                                             openshift_object="pods", 
                                                             iterations=15, 
                                                             delay_between_checks=60, 
@@ -155,16 +181,28 @@ if __name__ == "__main__":
                                                             namespace="openshift-storage"
                                                             )     
                 else:
-                    delay = True
-                    OpenShiftCommands.openshift_apply_file(yaml_file)
+                    openshift.openshift_apply_file(yaml_file)
+                    openshift.openshift_waitfor_subscription(subscription_name=which_yaml_file['metadata']['name'], 
+                                                                    namespace=which_yaml_file['metadata'].get('namespace'), 
+                                                                    timeout=900)
+            elif which_yaml_file['kind'] == "QuayRegistry":
+                quay_init_config = eval("quay_config.%s" % quay_secret_config)
+                # We need to strip out LDAP in order to initialize the user
+                ldap_in_config = any("ldap" in key.lower() for key in BaseOperations.load_config(config_file=quay_init_config))
+                if ldap_in_config:
+                    # This config file has the LDAP bits removed as it is a copy of the original config
+                    quay_init_config = BaseOperations.strip_ldap_from_config(quay_init_config)
+                # The config bundle has to exist before the registry that references it
+                openshift.openshift_create_secret(namespace=quay_namespace, file_path=quay_init_config)
+                openshift.openshift_apply_file(yaml_file)
             elif which_yaml_file['kind'] == "MachineSet":
-                infraID_output = OpenShiftCommands.openshift_get_object(object_type="infrastructure", object_name="cluster")
-                current_infraID = OpenShiftCommands.openshift_get_infrastructure_name(command_output=infraID_output)
+                infraID_output = openshift.openshift_get_object(object_type="infrastructure", object_name="cluster")
+                current_infraID = openshift.openshift_get_infrastructure_name(command_output=infraID_output)
                 new_machineset_location = BaseOperations.replace_infraID(path_to_original_file=yaml_file, new_infra_id=current_infraID)
                 
-                OpenShiftCommands.openshift_apply_file(new_machineset_location)
+                openshift.openshift_apply_file(new_machineset_location)
                 logging.debug("----> Waiting for the nodes to be created")
-                OpenShiftCommands.openshift_waitfor_object(
+                openshift.openshift_waitfor_object(
                                                             openshift_object="node", 
                                                             iterations=20, 
                                                             delay_between_checks=60, 
@@ -172,19 +210,24 @@ if __name__ == "__main__":
                                                             replicas=number_of_replicas
                                                             )
             elif which_yaml_file['kind'] == "StorageCluster":
-                OpenShiftCommands.openshift_apply_file(yaml_file)
+                openshift.openshift_apply_file(yaml_file)
                 logging.debug("----> Waiting for the ODF PVCs to be ready...")
-                OpenShiftCommands.openshift_waitfor_storage(namespace="openshift-storage", openshift_object="pvc", iterations=35, delay_between_checks=60)
+                openshift.openshift_waitfor_storage(namespace="openshift-storage", openshift_object="pvc", iterations=35, delay_between_checks=60)
             else:           
-                OpenShiftCommands.openshift_apply_file(yaml_file)
-            if delay:
-                    time.sleep(700)
-        # Introduce a small delay after the quay registry object is detected to make sure that the deployment objects are created
-        time.sleep(60)
-        quay_deployment = yaml.load(OpenShiftCommands.openshift_get_object(namespace=quay_namespace, object_type="deployment", label="quay-component=quay"), Loader=yaml.FullLoader)
+                openshift.openshift_apply_file(yaml_file)
+
+        # Independent manifests (for example the ODF and Quay operators) are applied at the same time
+        ManifestScheduler(yaml_list, max_workers=args.manifest_workers).run(apply_manifest)
+        # The operator creates the deployment shortly after the quay registry object is detected
+        openshift.openshift_waitfor_object(openshift_object="deployment", 
+                                                    label="quay-component=quay", 
+                                                    namespace=quay_namespace, 
+                                                    crd="deployment", 
+                                                    timeout=600)
+        quay_deployment = openshift.openshift_get_json(namespace=quay_namespace, object_type="deployment", label="quay-component=quay")
         number_of_replicas = quay_deployment['items'][0]['spec']['replicas']
         logging.debug("----> Waiting for the Quay Pods with the label 'quay-component=quay' to become ready ...")
-        OpenShiftCommands.openshift_waitfor_object(
+        openshift.openshift_waitfor_object(
                                                         openshift_object="pod", 
                                                         iterations=20, 
                                                         delay_between_checks=90, 
@@ -192,10 +235,10 @@ if __name__ == "__main__":
                                                         replicas=number_of_replicas,
                                                         namespace=quay_namespace
                                                         )
-        # Just because the container says running doesn't mean its warmed up so give it another bit of time
-        time.sleep(90)
+        # The Ready condition comes from Quay's readiness probe so the pods are serving once this returns
 
     if args.initialize_user:
+        Metrics.start_phase("initialize_user")
         # Do we create the first user via the one-time use API endpoint Quay has?
         new_config_line = {}
         user_info = {"username": quay_config.initialize_username, "password": quay_config.initialize_password, "email": quay_config.initialize_email, "access_token": "true"}
@@ -228,36 +271,39 @@ if __name__ == "__main__":
             ldap_in_config = any("ldap" in key.lower() for key in BaseOperations.load_config(config_file=quay_init_config))
             if ldap_in_config:
                 # dig out the secret name from the quay registry object incase the cluster was installed values other than defaults
-                quay_registry_object = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace,  
-                                                                                "object_type": "quayregistry"}), Loader=yaml.FullLoader)
+                quay_registry_object = openshift.openshift_get_json(**{"namespace": quay_namespace,  
+                                                                    "object_type": "quayregistry"})
                 registry_object_secret = quay_registry_object['items'][0]['spec']['configBundleSecret']
                 # Regenerate the original secret with LDAP information
-                OpenShiftCommands.openshift_replace_quay_init_secret(full_path_to_file=quay_init_config, secret_name=registry_object_secret, namespace=quay_namespace)
+                openshift.openshift_replace_quay_init_secret(full_path_to_file=quay_init_config, secret_name=registry_object_secret, namespace=quay_namespace)
                 logging.info("Pausing to let the secret rotate fully")
                 time.sleep(15)
                 # Roll the pods automatically so that the ldap stuff gets picked up again
-                quay_deployment = yaml.load(OpenShiftCommands.openshift_get_object(namespace=quay_namespace, object_type="deployment", label="quay-component=quay"), Loader=yaml.FullLoader)
+                quay_deployment = openshift.openshift_get_json(namespace=quay_namespace, object_type="deployment", label="quay-component=quay")
                 number_of_replicas = quay_deployment['items'][0]['spec']['replicas']
-                OpenShiftCommands.openshift_delete_object(object_type="pods", namespace=quay_namespace, label="quay-component=quay-app", grace_period="0")
-                time.sleep(60)
-                OpenShiftCommands.openshift_waitfor_pods(namespace=quay_namespace, iterations=10, delay_between_checks=90, number_of_pods=number_of_replicas)
-                # just becasue the pods are ready doesn't mean they are warmed up
-                time.sleep(90)
+                openshift.openshift_delete_object(object_type="pods", namespace=quay_namespace, label="quay-component=quay-app", grace_period="0")
+                # Terminating pods are ignored, so this waits for the replacement pods to pass their readiness probe
+                openshift.openshift_waitfor_object(openshift_object="pod", 
+                                                            label="quay-component=quay-app", 
+                                                            replicas=number_of_replicas, 
+                                                            namespace=quay_namespace, 
+                                                            timeout=900)
 
     if args.add_super_user:
+        Metrics.start_phase("add_super_user")
         # If we haven't logged into OpenShift yet, do so now
         if not openshift_logged_in:
             logging.debug(f"Attempting to login into {quay_config.openshift_api_url} as {quay_config.openshift_username}")
-            OpenShiftCommands.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
+            openshift.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
             openshift_logged_in = True
         logging.info("Attempting to add super users to OpenShift secret")
-        quay_registry_object = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace,  
-                                                                            "object_type": "quayregistry"}), Loader=yaml.FullLoader)
+        quay_registry_object = openshift.openshift_get_json(**{"namespace": quay_namespace,  
+                                                                "object_type": "quayregistry"})
         registry_object_name = quay_registry_object['items'][0]['metadata']['name']
         registry_object_secret = quay_registry_object['items'][0]['spec']['configBundleSecret']
-        quay_init_secret = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace, 
-                                                                                    "object_name": registry_object_secret, 
-                                                                                    "object_type": "secret"}), Loader=yaml.FullLoader)
+        quay_init_secret = openshift.openshift_get_json(**{"namespace": quay_namespace, 
+                                                                        "object_name": registry_object_secret, 
+                                                                        "object_type": "secret"})
         quay_init_secret_decoded = QuayManagement.process_quay_secret(quay_init_secret=quay_init_secret, quay_config=quay_config, quay_secret_section="SUPER_USERS")
         if args.debug:
             logging.debug("The contents of the Quay Secret is:")
@@ -266,18 +312,19 @@ if __name__ == "__main__":
             file.write(yaml.dump(quay_init_secret_decoded))
             file.close()
         logging.info(f"Replacing the secret {registry_object_secret}")
-        output = OpenShiftCommands.openshift_replace_quay_init_secret(full_path_to_file="/tmp/quay_init_bundle.yaml", secret_name=registry_object_secret)
+        output = openshift.openshift_replace_quay_init_secret(full_path_to_file="/tmp/quay_init_bundle.yaml", secret_name=registry_object_secret)
     
-    def create_admin_org(quay_api_token):
+    def create_admin_org(quay_api_token, server_url=None):
         """
         Description:
             Local function that creates an admin org. This may be needed in both
             initialize_oauth and add_admin_org.
         Args:
             quay_api_token (_type_): Quay api token
+            server_url (str, optional): The Quay server to create the org on. Defaults to the server this run manages.
         """
         time.sleep(10)
-        quay_server_api = QuayAPI(base_url=quay_url, api_token=quay_api_token)
+        quay_server_api = QuayAPI(base_url=server_url or quay_url, api_token=quay_api_token)
         logging.info(f"Attempting to create {quay_config.quay_admin_org}")
         quay_server_api.create_org(org_name=quay_config.quay_admin_org)
         response = quay_server_api.create_oauth_application(org_name=quay_config.quay_admin_org, application_name="oauth-automation")
@@ -286,129 +333,111 @@ if __name__ == "__main__":
     
     
     if args.add_admin_org:
+        Metrics.start_phase("add_admin_org")
         if args.initialize_user:
             quay_api_token = init_config_token_name
         create_admin_org(quay_api_token=quay_api_token)
         
         
-    if args.initialize_oauth:
-        # If we haven't logged into OpenShift yet, do so now
-        if not openshift_logged_in:
-            logging.debug(f"Attempting to login into {quay_config.openshift_api_url} as {quay_config.openshift_username}")
-            OpenShiftCommands.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
-            openshift_logged_in = True
-        token = quay_config.primary_init_token
-        if args.configure_secondary_quay_server:
-            token = quay_config.secondary_init_token
+    def initialize_oauth(server_type, kubeconfig=None):
+        """
+        Description:
+            Local function that creates the first OAUTH token for a Quay server. All of the database work
+            (finding the automation oauth application, the user tied to it and inserting the token) is done
+            by one helper script piped into a Quay pod, so there is a single `oc exec` and database connection
+        Args:
+            server_type (str): Either "primary" or "secondary"
+            kubeconfig (str, optional): The kubeconfig for the cluster this server runs on. Defaults to None (the current login).
+        Returns:
+            dict: The line to add to the config file. {"<server_type>_token": <token>}
+        """
+        server_url = quay_config.config[f"{server_type}_server"]
+        server_namespace = quay_config.config[f"{server_type}_quay_namespace"]
         # We want to ensure an admin org exists so we can tie an oauth application to it
-        create_admin_org(quay_api_token=token)
-        
-        pod_response = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace, 
-                                                                        "label": "quay-component=quay-app", 
-                                                                        "object_type": "pods"}), Loader=yaml.FullLoader)
-        select = "SELECT * FROM public.oauthapplication"
-        
-        logging.debug("Attempting get database information from the postgres-config-secret")
-            
-        all_quay_secrets = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace, 
-                                                                            "label": "quay-operator/quayregistry=central", 
-                                                                            "object_type": "secret"}), Loader=yaml.FullLoader)
+        create_admin_org(quay_api_token=quay_config.config[f"{server_type}_init_token"], server_url=server_url)
+
+        # Only running pods can be exec'd into, let the API server filter out the rest
+        pod_response = openshift.openshift_get_json(**{"namespace": server_namespace, 
+                                                            "label": "quay-component=quay-app", 
+                                                            "field_selector": "status.phase=Running",
+                                                            "object_type": "pods",
+                                                            "kubeconfig": kubeconfig})
+        pod_name = pod_response['items'][0]['metadata']['name']
+        logging.debug(f"Attempting get database information from the postgres-config-secret in {server_namespace}")
+        all_quay_secrets = openshift.openshift_get_json(**{"namespace": server_namespace, 
+                                                                "label": "quay-operator/quayregistry=central", 
+                                                                "object_type": "secret",
+                                                                "kubeconfig": kubeconfig})
         db_secret_dict = {}
         for secret in all_quay_secrets['items']:
             if "postgres-config-secret" in secret['metadata']['name']:
                 db_secret_dict = secret
-        db_info = OpenShiftCommands.openshift_process_secret(secret=db_secret_dict)
-        quay_db_service = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace, 
-                                                                            "label": "quay-component=postgres", 
-                                                                            "object_type": "svc"}), Loader=yaml.FullLoader)['items'][0]['metadata']['name']
+        db_info = openshift.openshift_process_secret(secret=db_secret_dict)
+        quay_db_service = openshift.openshift_get_json(**{"namespace": server_namespace, 
+                                                                "label": "quay-component=postgres", 
+                                                                "object_type": "svc",
+                                                                "kubeconfig": kubeconfig})['items'][0]['metadata']['name']
         db_info['database-svc'] = quay_db_service
         logging.debug(f"The database secret is:")
         logging.debug(db_info)
-        oauthapplication_script_location = quay_config.create_db_info_script(select_statement=select, db_info=db_info)
-        OpenShiftCommands.openshift_transfer_file(filename=oauthapplication_script_location,  
-                                                pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                namespace=quay_namespace)
-        
-        logging.debug("Retrieving current records from public.oauthapplication")
-        logging.debug(f"Running /tmp/generic.py in the {pod_response['items'][0]['metadata']['name']} pod")
+        oauth_script, oauth_token = BaseOperations.create_oauth_helper_script(db_info=db_info)
         if args.debug:
             logging.debug("The contents of the database script is:")
-            with open(oauthapplication_script_location) as file:
-                print(file.read())
-        oauthapplication_select_output = ast.literal_eval(OpenShiftCommands.openshift_exec_pod(pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                                                        namespace=quay_namespace,
-                                                                                        command=["/usr/bin/python", "/tmp/generic.py"]).decode().strip("\n").strip("\r"))
-        
-
-        select = "SELECT * FROM public.oauthaccesstoken"
-        oauthaccesstoken_script_location = quay_config.create_db_info_script(select_statement=select, db_info=db_info)
-        OpenShiftCommands.openshift_transfer_file(filename=oauthaccesstoken_script_location, 
-                                                pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                namespace=quay_namespace)
-
-        logging.debug("Retrieving current records from public.oauthaccesstoken")
-        logging.debug(f"Running /tmp/generic.py in the {pod_response['items'][0]['metadata']['name']} pod")
-        if args.debug:
-            logging.debug("The contents of the database script is:")
-            with open(oauthaccesstoken_script_location) as file:
-                print(file.read())    
-        oauthaccesstoken_select_output = ast.literal_eval(OpenShiftCommands.openshift_exec_pod(pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                                                        namespace=quay_namespace,
-                                                                                        command=["/usr/bin/python", "/tmp/generic.py"]).decode().strip("\n").strip("\r"))
-        
-        oauth_app_database_id = ""
-        oauth_app_org_id = ""
-        oauth_access_uid = ""
-        oauth_access_app_id = ""
-        for key in oauthapplication_select_output:
-            if oauthapplication_select_output[key]['oauth_name'] == "automation":
-                logging.debug("Found the 'automation' OAUTH application")
-                logging.debug("This is being used to tie the OAUTH key to")
-                logging.debug(oauthapplication_select_output[key])
-                oauth_app_database_id = key
-                oauth_app_org_id = oauthapplication_select_output[key]['org_id']
-
-
-        for key in oauthaccesstoken_select_output:
-            if oauthaccesstoken_select_output[key]['app_id'] == oauth_app_database_id:
-                logging.debug("Found the oauth database records")
-                logging.debug(oauthaccesstoken_select_output[key])
-                oauth_access_uid = oauthaccesstoken_select_output[key]['user_id']
-                oauth_access_app_id = oauthaccesstoken_select_output[key]['app_id']
-
-        initialize_oauth_script, oauth_token = quay_config.create_initial_oauth_script(user_id=oauth_access_uid, 
-                                            app_id=oauth_access_app_id, 
-                                            db_info=db_info)
-        if args.debug:
-            logging.debug(f"Attempting to transfer {initialize_oauth_script} to {pod_response['items'][0]['metadata']['name']}")
-            logging.debug("The contents of the database script is:")
-            with open(initialize_oauth_script) as file:
-                print(file.read())  
-        OpenShiftCommands.openshift_transfer_file(filename=initialize_oauth_script, 
-                                                pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                namespace=quay_namespace)
-        oauthaccesstoken_db_output = ast.literal_eval(OpenShiftCommands.openshift_exec_pod(pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                                                        namespace=quay_namespace,
-                                                                                        command=["/usr/bin/python", "/tmp/generic.py"]).decode().strip("\n").strip("\r"))
+            print(oauth_script)
+        logging.info(f"Creating the OAUTH token for the {server_type} server in the {pod_name} pod")
+        oauth_output = openshift.openshift_exec_pod_script(script=oauth_script, 
+                                                                  pod_name=pod_name, 
+                                                                  namespace=server_namespace, 
+                                                                  kubeconfig=kubeconfig)
+        if "error" in oauth_output:
+            logging.critical(f"Failed to create the OAUTH token for the {server_type} server ---> {oauth_output['error']}")
+            exit(1)
         if args.debug: 
-            logging.debug(f"Database activities respose: {oauthaccesstoken_db_output}")
+            logging.debug(f"Database activities respose: {oauth_output}")
             logging.debug(f"The generated token is: {oauth_token}")
-        if not args.debug:
-            OpenShiftCommands.openshift_exec_pod(pod_name=pod_response['items'][0]['metadata']['name'], 
-                                                                                        namespace=quay_namespace,
-                                                                                        command=["/usr/bin/rm", "/tmp/generic.py"])
-        
-        new_line = {"primary_token": oauth_token}
-        if args.configure_secondary_quay_server:
-            new_line = {"secondary_token": oauth_token}
+        return {f"{server_type}_token": oauth_token}
+
+    if args.initialize_oauth:
+        Metrics.start_phase("initialize_oauth")
+        new_line = {}
+        if args.all_quay_servers:
+            # Each cluster gets its own kubeconfig so the two servers can be worked on at the same time. They hold
+            # login tokens, so they go in a private directory (mode 0700) that is removed however the logins end
+            kubeconfig_dir = tempfile.mkdtemp(prefix="quay_management_")
+            try:
+                server_kubeconfigs = {}
+                for server_type in ["primary", "secondary"]:
+                    api_url = quay_config.config.get(f"{server_type}_openshift_api_url") or quay_config.openshift_api_url
+                    server_kubeconfigs[server_type] = os.path.join(kubeconfig_dir, f"{server_type}.kubeconfig")
+                    logging.debug(f"Attempting to login into {api_url} as {quay_config.openshift_username}")
+                    openshift.openshift_login(api_url=api_url, username=quay_config.openshift_username, 
+                                                      passwd=quay_config.openshift_password, kubeconfig=server_kubeconfigs[server_type])
+                with ThreadPoolExecutor(max_workers=len(server_kubeconfigs), thread_name_prefix="oauth") as executor:
+                    futures = [executor.submit(initialize_oauth, server_type, kubeconfig) for server_type, kubeconfig in server_kubeconfigs.items()]
+                    for future in futures:
+                        new_line.update(future.result())
+            finally:
+                shutil.rmtree(kubeconfig_dir, ignore_errors=True)
+        else:
+            # If we haven't logged into OpenShift yet, do so now
+            if not openshift_logged_in:
+                logging.debug(f"Attempting to login into {quay_config.openshift_api_url} as {quay_config.openshift_username}")
+                openshift.openshift_login(api_url=quay_config.openshift_api_url, username=quay_config.openshift_username, passwd=quay_config.openshift_password)
+                openshift_logged_in = True
+            server_type = "primary"
+            if args.configure_secondary_quay_server:
+                server_type = "secondary"
+            new_line = initialize_oauth(server_type)
     
         if args.debug:
             logging.debug("Rereading the config files and regenerating API sessions with new token...")
+        # The tokens are only written once every server has finished
         quay_config.add_to_config(config_path=args.config_file, insert_dict=new_line)
         # reread the config file because it should have new information in it
         quay_config = BaseOperations(args.config_file, args=args)
 
     if args.manage_orgs:
+        Metrics.start_phase("manage_orgs")
         if args.initialize_user:
             quay_api_token = init_config_token_name
         quay_server_api = QuayAPI(base_url=quay_url, api_token=quay_api_token)
@@ -419,30 +448,48 @@ if __name__ == "__main__":
                 quay_server_api.delete_org(org_name=key)
 
     if args.add_proxycache:
+        Metrics.start_phase("add_proxycache")
         quay_management.add_proxycache(quay_api=quay_server_api, overwrite=args.overwrite_proxycache)
 
     if args.add_robot_account:
+        Metrics.start_phase("add_robot_account")
         robots_exist = quay_management.get_robot(username=quay_username)
         quay_management.add_robot_acct(robot_exists=robots_exist, username=quay_username, quay_api_object=quay_server_api)
+
+    def async_api():
+        """
+        Description:
+            Local function that builds the AsyncQuayAPI the ownership tasks use with --async-api
+        Returns:
+            AsyncQuayAPI: None without --async-api
+        """
+        if not args.async_api:
+            return None
+        AsyncQuayAPI.configure_session(max_per_host=args.ownership_workers)
+        return AsyncQuayAPI(base_url=quay_url, api_token=quay_api_token)
     
     if args.take_ownership:
+        Metrics.start_phase("take_ownership")
         quay_server_api = QuayAPI(base_url=quay_url, api_token=quay_api_token)
         orgs = quay_server_api.get_org()
-        QuayManagement.take_org_ownership(quay_username=quay_username, orgs=orgs, quay_server_api=quay_server_api)
+        QuayManagement.take_org_ownership(quay_username=quay_username, orgs=orgs, quay_server_api=quay_server_api, max_workers=args.ownership_workers, async_api=async_api())
     
     if args.take_ownership_all_super_users:
+        Metrics.start_phase("take_ownership_all_super_users")
         quay_server_api = QuayAPI(base_url=quay_url, api_token=quay_api_token)
         orgs = quay_server_api.get_org()
-        quay_registry_object = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace,  
-                                                                            "object_type": "quayregistry"}), Loader=yaml.FullLoader)
+        quay_registry_object = openshift.openshift_get_json(**{"namespace": quay_namespace,  
+                                                                "object_type": "quayregistry"})
         registry_object_name = quay_registry_object['items'][0]['metadata']['name']
         registry_object_secret = quay_registry_object['items'][0]['spec']['configBundleSecret']
-        quay_init_secret = yaml.load(OpenShiftCommands.openshift_get_object(**{"namespace": quay_namespace, 
-                                                                                    "object_name": registry_object_secret, 
-                                                                                    "object_type": "secret"}), Loader=yaml.FullLoader)
-        quay_init_secret_decoded = yaml.load(base64.b64decode(quay_init_secret['data']['config.yaml']), Loader=yaml.FullLoader)  
+        quay_init_secret = openshift.openshift_get_json(**{"namespace": quay_namespace, 
+                                                                        "object_name": registry_object_secret, 
+                                                                        "object_type": "secret"})
+        quay_init_secret_decoded = BaseOperations.load_yaml(base64.b64decode(quay_init_secret['data']['config.yaml']))  
         user_list = quay_init_secret_decoded['SUPER_USERS']
-        QuayManagement.take_org_ownership(quay_username=user_list, orgs=orgs, quay_server_api=quay_server_api)
+        QuayManagement.take_org_ownership(quay_username=user_list, orgs=orgs, quay_server_api=quay_server_api, max_workers=args.ownership_workers, async_api=async_api())
+    Metrics.end_phase()
+    Metrics.log_summary()
     end_time = time.perf_counter()
     total_time = math.ceil((end_time - start_time)/60)
     logging.info(f"Total run time ---> {total_time} minutes <---")
@@ -7,10 +7,21 @@ import argparse
 import requests
 import time
 import json
+import os
+import signal
+from urllib.parse import urlsplit
 from modules.BaseOperations import BaseOperations
 from modules.PreflightChecker import PreflightChecker
-from modules.QuayAPI import QuayAPI
-from modules.QuayOperations import ImageMover
+from modules.AsyncQuayAPI import AsyncQuayAPI
+from modules.QuayAPI import QuayAPI, QuayAPIError
+from modules.QuayOperations import CopyBackend, ImageMover, PodmanCopyBackend, QuayManagement, RegistryCopyBackend, StorageBudget
+from modules.MirrorEngine import MirrorEngine
+from modules.SyncState import SyncState
+from modules.Metrics import Metrics
+from modules.ShardCoordinator import ShardCoordinator
+from modules.ChangeWatcher import ChangeWatcher
+from modules.SyncJournal import SyncJournal
+from modules.ParityVerifier import ParityVerifier
 
 logging.basicConfig(level=logging.INFO)
 parser = argparse.ArgumentParser(description='Process some integers.')
@@ -19,6 +30,43 @@ parser.add_argument("--skip-tls-verify", action="store_true", help="Ignore self
 parser.add_argument("--skip-broken-images", action="store_true", help="Don't stop because of broken image pull/push")
 parser.add_argument("--auto-discovery", action="store_true", help="Attempt to auto discover any repositories present in organizations")
 parser.add_argument("--failover", action="store_true", help="If set, the primary and secondary servers are flipped so the secondary is assumed live")
+parser.add_argument("--max-workers", type=int, default=4, help="How many images are started at the same time. A worker reads each image from the source and hands its copies to the destinations, which run on --max-per-destination-registry threads each. Up to 2 x --max-workers + 4 x --max-per-destination-registry images are in flight")
+parser.add_argument("--max-per-source-registry", type=int, default=None, help="How many concurrent pulls are allowed against a single source registry. Defaults to --max-workers")
+parser.add_argument("--copy-backend", choices=["podman", "direct"], default="podman", help="podman pulls, tags and pushes through local storage. direct streams blobs registry to registry and falls back to podman on failure")
+parser.add_argument("--api-pool-size", type=int, default=10, help="How many keep-alive connections to keep open to each Quay API")
+parser.add_argument("--api-connect-timeout", type=float, default=10, help="Seconds to wait when connecting to the Quay API")
+parser.add_argument("--api-read-timeout", type=float, default=60, help="Seconds to wait for the Quay API to respond")
+parser.add_argument("--api-rate", type=float, default=0, help="Maximum Quay API requests per second to each server. 0 means unlimited")
+parser.add_argument("--api-max-concurrency", type=int, default=32, help="Most concurrent Quay API requests to each server. Halved automatically when Quay answers 429/503")
+parser.add_argument("--api-max-retries", type=int, default=4, help="How many times an idempotent Quay API call is retried with backoff")
+parser.add_argument("--max-per-destination-registry", type=int, default=None, help="How many concurrent pushes are allowed against a single destination registry. Defaults to --max-workers")
+parser.add_argument("--max-org-workers", type=int, default=8, help="How many missing organizations are created on the secondary at the same time")
+parser.add_argument("--state-file", default="~/.quay_sync_state.db", help="SQLite file that records the digest of every mirrored tag so unchanged tags are skipped on the next run")
+parser.add_argument("--full-resync", action="store_true", help="Ignore the recorded state and mirror every tag again")
+parser.add_argument("--metrics-textfile", help="Write Prometheus metrics to this file when the sync finishes, for the node_exporter textfile collector")
+parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on http://<host>:<port>/metrics while the sync is running")
+parser.add_argument("--shard-store", help="SQLite file shared by several quay_sync.py workers. The repositories are split into shards and each worker mirrors the shards it holds a lease on")
+parser.add_argument("--shard-count", type=int, default=64, help="How many shards the repositories are split into. Every worker must use the same number")
+parser.add_argument("--shard-lease-seconds", type=float, default=60, help="How long a shard lease lasts without being renewed. A crashed worker's shards are taken over after this long")
+parser.add_argument("--worker-id", default=None, help="A name for this worker that is unique among the workers sharing --shard-store. Defaults to <hostname>-<pid>")
+parser.add_argument("--daemon", action="store_true", help="Keep running after the sync and mirror tags as soon as they are pushed to the primary")
+parser.add_argument("--webhook-port", type=int, default=None, help="With --daemon, listen for Quay repository notifications on this port")
+parser.add_argument("--webhook-address", default="0.0.0.0", help="The address the notification listener binds to")
+parser.add_argument("--webhook-token", default=None, help="If set, notifications must be sent to http://<host>:<port>/?token=<token>")
+parser.add_argument("--audit-poll-interval", type=float, default=30, help="With --daemon, seconds between polls of the primary's audit log for pushes. 0 turns polling off")
+parser.add_argument("--daemon-settle-seconds", type=float, default=2, help="With --daemon, how long to collect more pushes after the first one before mirroring them together")
+parser.add_argument("--daemon-resync-hours", type=float, default=24, help="With --daemon, run a full sync this often to catch anything the notifications missed. 0 turns it off")
+parser.add_argument("--preflight-timeout", type=float, default=5, help="Seconds each preflight step (DNS, connect, TLS, first byte) may take before a server is treated as unreachable")
+parser.add_argument("--max-destination-failures", type=int, default=5, help="With additional_secondaries in the config file, skip a destination for the rest of the sync after this many images in a row fail only there. 0 never skips")
+parser.add_argument("--pipeline-depth", type=int, default=0, help="With --copy-backend podman, pull, tag and push in separate stages with this many images waiting between stages, so the next image is pulled while the last one is pushed. Bounds the pulled images kept on disk. 0 turns it off")
+parser.add_argument("--local-storage-gib", type=float, default=None, help="With the podman backend, keep pulled images in local storage under this many GiB, removing the least recently used images that were already pushed. 0 removes each image as soon as it is pushed without holding back pulls. Unset leaves every image in local storage")
+parser.add_argument("--journal-file", default="~/.quay_sync_journal.db", help="SQLite file that records which images the current sync has finished, so an interrupted sync can be picked up with --resume")
+parser.add_argument("--resume", action="store_true", help="Continue the last sync that did not finish. Images it finished are skipped and the ones it was copying are mirrored first")
+parser.add_argument("--verify", action="store_true", help="Do not mirror anything. Compare the tags and manifest digests on the primary with every destination and report missing, stale and extra tags")
+parser.add_argument("--verify-workers", type=int, default=16, help="With --verify, how many repositories are compared at the same time")
+parser.add_argument("--shard-max-attempts", type=int, default=3, help="With --shard-store, how many times a shard with failed images is mirrored before it is marked done with its failures")
+parser.add_argument("--spool-dir", type=str, default=None, help="With --copy-backend direct and several destinations, the directory layers are downloaded to once while every destination uploads them. Defaults to $TMPDIR")
+parser.add_argument("--async-api", action="store_true", help="List the tags of many repositories at the same time with asyncio (needs aiohttp). Still capped by --api-max-concurrency requests to each server")
 
 args = parser.parse_args()
 
@@ -29,6 +77,7 @@ if __name__ == "__main__":
                 add_key(v, key)
             else:
                 v[key] = None
+    Metrics.configure(namespace="quay_sync", textfile=args.metrics_textfile, port=args.metrics_port)
     quay_config = BaseOperations(args.config_file, args=args)
     mover= ImageMover(args.config_file)
     preflight = PreflightChecker()
@@ -40,6 +89,19 @@ if __name__ == "__main__":
     # For now, use the Quay User's init token
     primary_api_token = quay_config.primary_init_token
     secondary_api_token = quay_config.secondary_init_token
+    if args.daemon and args.shard_store:
+        logging.critical("--daemon and --shard-store can not be used together")
+        exit(1)
+    if args.resume and args.shard_store:
+        logging.critical("--resume and --shard-store can not be used together. Shards that were not finished are already picked up by the other workers")
+        exit(1)
+    if args.spool_dir and not os.path.isdir(os.path.expanduser(args.spool_dir)):
+        logging.critical(f"--spool-dir ---> {args.spool_dir} <--- is not a directory")
+        exit(1)
+    if args.daemon and not args.skip_broken_images:
+        # A broken image should not stop a daemon. Failed images are retried instead
+        logging.info("--daemon implies --skip-broken-images")
+        args.skip_broken_images = True
     if args.failover:
         primary_server = quay_config.secondary_server
         secondary_server = quay_config.primary_server
@@ -47,102 +109,429 @@ if __name__ == "__main__":
         secondary_credentials = {"username": quay_config.primary_quay_user, "password": quay_config.primary_quay_password}
         primary_api_token = quay_config.secondary_init_token
         secondary_api_token = quay_config.primary_init_token
-        
+
+    # Every site that receives the images. additional_secondaries in the config file adds more sites after the secondary
+    destinations = [{"name": "secondary", "server": secondary_server, "api_token": secondary_api_token, "credentials": secondary_credentials}]
+    for number, additional_secondary in enumerate(quay_config.config.get("additional_secondaries") or [], start=2):
+        missing = [key for key in ("server", "init_token", "quay_user", "quay_password") if not additional_secondary.get(key)]
+        if missing:
+            logging.critical(f"additional_secondaries entry {number - 1} is missing ---> {', '.join(missing)} <---")
+            exit(1)
+        destinations.append({"name": f"secondary {number}", "server": additional_secondary["server"], "api_token": additional_secondary["init_token"],
+                             "credentials": {"username": additional_secondary["quay_user"], "password": additional_secondary["quay_password"]}})
+    if len(destinations) > 1:
+        logging.info(f"Mirroring to {len(destinations)} destinations ---> {', '.join(destination['server'] for destination in destinations)} <---")
+
     try:
-        preflight.check_dns(primary_server)
-        preflight.check_dns(secondary_server)
-        preflight.check_port(primary_server)
-        preflight.check_port(secondary_server)
-        print()
-        mover.login_to_quay(server=primary_server, username=primary_credentials['username'], password=primary_credentials['password'], args=args)
-        mover.login_to_quay(server=secondary_server, username=secondary_credentials['username'], password=secondary_credentials['password'], args=args)
+        with Metrics.timer("phase_seconds", phase="preflight"):
+            # Quay serves the API and the registry from the same host, but they are separate services behind it
+            endpoints = {"primary quay": (primary_server, "/health/instance"), "primary registry": (primary_server, "/v2/")}
+            for destination in destinations:
+                endpoints[f"{destination['name']} quay"] = (destination["server"], "/health/instance")
+                endpoints[f"{destination['name']} registry"] = (destination["server"], "/v2/")
+            preflight_results = preflight.probe_all(endpoints, timeout=args.preflight_timeout, verify_tls=not args.skip_tls_verify)
         print()
+        # --verify only reads through the APIs, podman is not needed
+        if not args.verify:
+            with Metrics.timer("phase_seconds", phase="login"):
+                mover.login_to_quay(server=primary_server, username=primary_credentials['username'], password=primary_credentials['password'], args=args)
+                for destination in destinations:
+                    mover.login_to_quay(server=destination["server"], username=destination["credentials"]['username'], password=destination["credentials"]['password'], args=args)
+            print()
     except Exception as e:
         logging.error("Error executing script: {}".format(e))
         exit(1)
 
 
+    QuayAPI.configure_session(pool_size=max(args.api_pool_size, args.verify_workers) if args.verify else args.api_pool_size, connect_timeout=args.api_connect_timeout, read_timeout=args.api_read_timeout)
+    QuayAPI.configure_scheduler(rate=args.api_rate, max_concurrency=args.api_max_concurrency, max_retries=args.api_max_retries)
+    for server_type, server in [("primary", primary_server)] + [(destination["name"], destination["server"]) for destination in destinations]:
+        starting_limit = QuayAPI.scheduler.seed_limit(urlsplit(server).netloc, preflight_results[f"{server_type} quay"]["first_byte_seconds"])
+        logging.info(f"Starting with {starting_limit} concurrent API requests to ---> {server} <---")
     # Create an instance of QuayAPI for the primary server
     primary_quay_api = QuayAPI(base_url=primary_server, api_token=primary_api_token)
+    async_quay_api = None
+    if args.async_api:
+        AsyncQuayAPI.configure_session(pool_size=args.api_pool_size, max_per_host=args.api_max_concurrency, connect_timeout=args.api_connect_timeout, read_timeout=args.api_read_timeout)
+        async_quay_api = AsyncQuayAPI(base_url=primary_server, api_token=primary_api_token)
+
+    # Create an instance of the QuayAPI class for each destination
+    for destination in destinations:
+        destination["quay_api"] = QuayAPI(base_url=destination["server"], api_token=destination["api_token"])
+
+    registry_credentials = {MirrorEngine.registry_from_image(primary_server): primary_credentials}
+    for destination in destinations:
+        registry_credentials[MirrorEngine.registry_from_image(destination["server"])] = destination["credentials"]
+
+    if args.verify:
+        # Nothing is created or copied. The state file is only read, to recognise manifests podman rewrote when it pushed them
+        verify_state = SyncState(os.path.expanduser(args.state_file))
+        verifier = ParityVerifier(primary_quay_api, destinations, state=verify_state, max_workers=args.verify_workers,
+                                  digest_backend=CopyBackend(credentials=registry_credentials, args=args, pool_size=args.verify_workers))
+        try:
+            with Metrics.timer("phase_seconds", phase="verify"):
+                verify_report = verifier.verify(images=None if args.auto_discovery else quay_config.repositories)
+        except QuayAPIError as e:
+            logging.critical(f"Could not list the repositories on the primary... nothing was verified: {e}")
+            exit(1)
+        finally:
+            verify_state.close()
+        Metrics.log_summary()
+        # Extra tags are only reported, a destination can hold repositories of its own
+        exit(1 if any(result["missing"] or result["stale"] or result["unverified"] for result in verify_report.values()) else 0)
+
+    watcher = None
+    # The MirrorEngine running right now, so SIGTERM can stop it. Every sync the daemon runs replaces it
+    running_engine = {}
+    if args.daemon:
+        # Started before the first sync so nothing pushed while it runs is missed
+        watcher = ChangeWatcher(quay_api=primary_quay_api, poll_interval=args.audit_poll_interval, webhook_port=args.webhook_port,
+                                webhook_address=args.webhook_address, webhook_token=args.webhook_token, settle_seconds=args.daemon_settle_seconds)
+        watcher.start()
+
+        def stop_daemon(signal_number, frame):
+            logging.info("SIGTERM received... stopping once the images in flight are done")
+            watcher.stop()
+            if running_engine.get("engine"):
+                running_engine["engine"].stop()
+
+        signal.signal(signal.SIGTERM, stop_daemon)
+
+    # List the organizations on every side once and only create what is missing
+    with Metrics.timer("phase_seconds", phase="org_reconcile"):
+        source_orgs = primary_quay_api.get_org_names()
+        if not args.auto_discovery:
+            source_orgs.update(repository.split("/")[0] for repository in quay_config.repositories)
+        for destination in destinations:
+            destination["orgs"] = destination["quay_api"].get_org_names()
+            org_results = QuayManagement.reconcile_orgs(source_orgs=source_orgs, destination_quay_api=destination["quay_api"],
+                                                        destination_orgs=destination["orgs"], max_workers=args.max_org_workers)
+            destination["orgs"].update(org_results["created"])
+
+    def reconcile_org(org: str) -> None:
+        """
+        Description:
+            Makes sure a namespace found during discovery exists on every destination. Only namespaces that
+            were not in the initial organization listing (such as user namespaces) need an API call
+        Args:
+            org (str): The name of the organization
+        """
+        for destination in destinations:
+            if org in destination["orgs"]:
+                continue
+            destination["orgs"].add(org)
+            if not destination["quay_api"].wait_for_org(org, timeout=0):
+                QuayManagement.reconcile_orgs(source_orgs={org}, destination_quay_api=destination["quay_api"], destination_orgs=set(), timeout=10)
+
+    def destination_images(image: str) -> dict:
+        """
+        Description:
+            Names an image on every destination
+        Args:
+            image (str): <org>/<repo>:<tag>
+        Returns:
+            dict: {"image_destination": <the image on the secondary>, "image_destinations": [<the image on each destination>]}
+        """
+        image_destinations = [destination["quay_api"].base_url + "/" + image for destination in destinations]
+        return {"image_destination": image_destinations[0], "image_destinations": image_destinations}
+
+    # <org>/<repo> whose tags could not be listed. Only touched on the thread running the sync
+    unlisted_repositories = []
+
+    def discovered_images(repositories, on_listed=None):
+        """
+        Description:
+            Generator that walks the tags of each repository on the primary page by page. Organizations are
+            reconciled the first time they are seen so mirroring of the first repositories can start
+            while later pages are still being read. With --async-api the tags of the next repositories are
+            listed at the same time while the current one is handed out
+        Args:
+            repositories (iterable): Repositories from primary_quay_api.iter_repositories(). A repository with
+                                     a "tags" set only has those tags mirrored
+            on_listed (callable, optional): Called as on_listed(<org>/<repo>) once every tag of a repository was yielded. It is not called
+                                            for a repository whose tags could not all be listed, which is added to unlisted_repositories. Defaults to None.
+        Yields:
+            dict: A job for the MirrorEngine
+        """
+        def listed_tags(tags, error):
+            yield from tags
+            if error is not None:
+                raise error
+
+        if async_quay_api is not None:
+            listings = ((repository, listed_tags(tags, error)) for repository, tags, error in async_quay_api.iter_repository_tags(repositories))
+        else:
+            listings = ((repository, primary_quay_api.iter_tags(repository['href'])) for repository in repositories)
+        for repository, tags in listings:
+            org = repository['namespace']['name']
+            reconcile_org(org)
+            wanted_tags = repository.get("tags")
+            name = org + "/" + repository['href'].split("/")[-1]
+            try:
+                for tag in tags:
+                    if wanted_tags is not None and tag['name'] not in wanted_tags:
+                        continue
+                    repo_and_tag = repository['href'].split("/")[-1] + ":" + tag['name']
+                    source_image_name = primary_quay_api.base_url + "/" + org + "/" + repo_and_tag
+                    yield {"image_source": source_image_name, **destination_images(org + "/" + repo_and_tag), "image_and_tag": org + "/" + repo_and_tag,
+                           "source_digest": tag.get("manifest_digest")}
+            except QuayAPIError as e:
+                # The tags that were listed are still mirrored, but the repository is not finished
+                logging.error(f"Could not list every tag of ---> {name} <---: {e}")
+                unlisted_repositories.append(name)
+                continue
+            if on_listed:
+                on_listed(name)
+
+    # The journal is not used with --shard-store, where the shard leases already record what is finished
+    journal = None
+    resumed = {"done": {}, "in_flight": {}, "repositories": set()}
+    if not args.shard_store:
+        journal = SyncJournal(os.path.expanduser(args.journal_file))
+        resumed = journal.start_run(resume=args.resume)
+
+    def resumed_jobs(jobs):
+        """
+        Description:
+            Generator that picks up where the interrupted sync stopped. The images it was copying are mirrored
+            first, then the listing carries on without the images it already finished
+        Args:
+            jobs (iterable): MirrorEngine jobs for the whole sync
+        Yields:
+            dict: A job for the MirrorEngine
+        """
+        for image in resumed["in_flight"]:
+            reconcile_org(image.split("/")[0])
+            yield {"image_source": primary_server + "/" + image, **destination_images(image), "image_and_tag": image}
+        skipped = 0
+        for job in jobs:
+            image = job["image_and_tag"]
+            if image in resumed["in_flight"]:
+                continue
+            # A tag that was pushed again since it was mirrored has a new digest and is mirrored again
+            if image in resumed["done"] and (job.get("source_digest") is None or resumed["done"][image] in (None, job.get("source_digest"))):
+                skipped += 1
+                continue
+            yield job
+        if resumed["done"]:
+            logging.info(f"Skipped {skipped} images and {len(resumed['repositories'])} repositories the interrupted sync had already finished")
 
-    # Create an instance of the QuayAPI class for the secondary server
-    secondary_quay_api = QuayAPI(base_url=secondary_server, api_token=secondary_api_token)
-
-    # Call the functions and pass in the token as an argument
-    source_data = primary_quay_api.get_data()
-
-    # Initialize variables
-    index = 0
-    source_orgs = []
-    source_repositories = []
-    orgs_to_be_created = []
-
-    # Loop through the results in the source data
-    for result in source_data['results']:
-        # Extract the namespace and href from each result
-        if source_data['results'][index]['namespace']['name'] not in source_orgs:
-            source_orgs.append(source_data['results'][index]['namespace']['name'])
-        source_repositories.append(source_data['results'][index]['href'])
-        index += 1
-
-    # Loop through the source organizations
-    for org in source_orgs:
-        # Check if the organization exists on the destination server
-        destination_data = primary_quay_api.get_data()
-        if not destination_data:
-            logging.info("Doesn't exist")
-            continue
-        # Check if the organization needs to be created on the destination server
-        create_org = secondary_quay_api.check_if_object_exists(org_name=org)
-        if create_org:
-            logging.info(f"Organization does not exist: {org} <---")
-            secondary_quay_api.create_org(org)
-            time.sleep(3)
-    
     if args.auto_discovery:
-        # Create a dictionary to store the images and tags
-        image_dict = {}
-
-        # Loop through the source repositories
-        for repo in source_repositories:
-            # Get the list of tags for each repository
-            tag_list = primary_quay_api.get_tag_info(repo)
-            # Loop through the tags and add them to the image_dict
-            for tag in tag_list:
-                organization = repo.split("/")[-2]
-                image_and_tag = repo.split("/")[-1] + ":" + tag
-
-                # If the organization already exists in the image_dict, append the image and tag to the list
-                if organization in image_dict:
-                    if not image_and_tag in image_dict[organization]:
-                        image_dict.setdefault(organization, []).append(image_and_tag)
-                # Otherwise, set the default value for the organization key to an empty list and append the image and tag
-                else:
-                    image_dict.setdefault(organization, []).append(image_and_tag)
-        # Loop through the image_dict and print the podman pull commands
-        for org in image_dict:
-            for repo_and_tag in image_dict[org]:
-                source_image_name = primary_quay_api.base_url.strip("https://")+ "/" + org + "/" + repo_and_tag
-                destination_image_name = secondary_quay_api.base_url.strip("https://") + "/" + org + "/" + repo_and_tag
-                print("")
-                ImageMover.podman_operations(operation="pull", image_source=source_image_name, image_and_tag=repo_and_tag, args=args)
-                ImageMover.podman_operations(operation="tag", image_source=source_image_name, image_destination=destination_image_name, image_and_tag=repo_and_tag, args=args)
-                time.sleep(1)
-                print("")
-                ImageMover.podman_operations(operation="push", image_source=source_image_name, image_destination=destination_image_name, image_and_tag=repo_and_tag, args=args)
+        # Repositories the interrupted sync finished are not listed again
+        repositories = (repository for repository in primary_quay_api.iter_repositories() if repository['href'].split("/", 2)[-1] not in resumed["repositories"])
+        on_listed = journal.repository_listed if journal else None
+        # Discovery runs while images are being mirrored, so this only counts the time spent waiting on it
+        mirror_jobs = Metrics.timed_iter(discovered_images(repositories, on_listed=on_listed), "phase_seconds", phase="discovery")
     else:
+        mirror_jobs = []
+        for repository in quay_config.repositories:
+            image_source_name = primary_server + "/" + repository
+            mirror_jobs.append({"image_source": image_source_name, **destination_images(repository), "image_and_tag": repository})
+
+    storage_budget = None
+    if args.local_storage_gib is not None:
+        storage_budget = StorageBudget(limit_bytes=int(args.local_storage_gib * 1024 ** 3))
+    sync_state = SyncState(os.path.expanduser(args.state_file))
+    copy_backend = PodmanCopyBackend(credentials=registry_credentials, args=args, storage_budget=storage_budget)
+    if args.copy_backend == "direct":
+        copy_backend = RegistryCopyBackend(credentials=registry_credentials, args=args, pool_size=args.max_workers, fallback=copy_backend, state=sync_state,
+                                           spool_dir=os.path.expanduser(args.spool_dir) if args.spool_dir else None)
+
+    def create_mirror_engine() -> MirrorEngine:
+        running_engine["engine"] = MirrorEngine(max_workers=args.max_workers,
+                                                max_per_source=args.max_per_source_registry,
+                                                max_per_destination=args.max_per_destination_registry,
+                                                args=args,
+                                                backend=copy_backend,
+                                                state=sync_state,
+                                                max_destination_failures=args.max_destination_failures,
+                                                pipeline_depth=args.pipeline_depth)
+        return running_engine["engine"]
+    mirror_engine = create_mirror_engine()
+
+    def run_shards() -> None:
+        """
+        Description:
+            Mirrors the repositories shard by shard with the other workers sharing --shard-store. Every worker
+            lists the repositories and groups them by shard. Shards are claimed one after another as the
+            MirrorEngine asks for more jobs, so images from the next shard start while the last images of
+            the previous one are still copying. A shard is completed once all of its images have finished. A shard
+            with failed images, or repositories whose tags could not be listed, is handed back to be mirrored again
+        """
+        coordinator = ShardCoordinator(os.path.expanduser(args.shard_store), worker_id=args.worker_id,
+                                       shard_count=args.shard_count, lease_seconds=args.shard_lease_seconds, max_attempts=args.shard_max_attempts)
+        shard_jobs = {}
+        with Metrics.timer("phase_seconds", phase="discovery"):
+            if args.auto_discovery:
+                for repository in primary_quay_api.iter_repositories():
+                    # href is /repository/<org>/<repo>
+                    shard = coordinator.shard_for(repository['href'].split("/", 2)[-1])
+                    shard_jobs.setdefault(shard, []).append(repository)
+            else:
+                for job in mirror_jobs:
+                    shard = coordinator.shard_for(job["image_and_tag"].split("@")[0].split(":")[0])
+                    shard_jobs.setdefault(shard, []).append(job)
+        unit = "repositories" if args.auto_discovery else "images"
+        logging.info(f"Split {sum(len(jobs) for jobs in shard_jobs.values())} {unit} into {len(shard_jobs)} of {coordinator.shard_count} shards")
+        # {<shard>: <images handed to the MirrorEngine that have not finished>}. Only touched on this thread
+        unfinished = {}
+        # {<shard>: <images that failed and repositories that could not be listed>}. Also only touched on this thread
+        failures = {}
+        fully_queued = set()
+
+        def complete_if_finished(shard: int) -> None:
+            if shard in fully_queued and not unfinished[shard]:
+                fully_queued.discard(shard)
+                if failures[shard]:
+                    coordinator.fail(shard, failures[shard])
+                else:
+                    coordinator.complete(shard)
+
+        def claimed_jobs():
+            while not mirror_engine.stop_requested.is_set():
+                shard = coordinator.claim_next()
+                if shard is None:
+                    return
+                logging.info(f"Mirroring shard {shard} ---> {len(shard_jobs.get(shard, []))} {unit} <---")
+                unfinished[shard] = failures[shard] = 0
+                unlisted_before = len(unlisted_repositories)
+                jobs = shard_jobs.get(shard, [])
+                if args.auto_discovery:
+                    jobs = Metrics.timed_iter(discovered_images(jobs), "phase_seconds", phase="discovery")
+                for job in jobs:
+                    unfinished[shard] += 1
+                    yield dict(job, shard=shard)
+                # The shard's repositories are listed while its jobs are handed out, so these are all from this shard
+                failures[shard] += len(unlisted_repositories) - unlisted_before
+                fully_queued.add(shard)
+                complete_if_finished(shard)
+
+        def image_finished(job: dict, outcome: str) -> None:
+            unfinished[job["shard"]] -= 1
+            if outcome in ("failed", "partial"):
+                failures[job["shard"]] += 1
+            complete_if_finished(job["shard"])
+
+        coordinator.join()
         try:
-            for repository in quay_config.repositories:
-                image_source_name = primary_server + "/" + repository
-                image_destination_name = secondary_server + "/" + repository
-                print("")
-                ImageMover.podman_operations(operation="pull", image_source=image_source_name, image_and_tag=repository, args=args)
-                ImageMover.podman_operations(operation="tag", image_source=image_source_name, image_destination=image_destination_name, image_and_tag=repository, args=args)
-                time.sleep(1)
-                print("")
-                ImageMover.podman_operations(operation="push", image_source=image_source_name, image_destination=image_destination_name, image_and_tag=repository, args=args)
-                print("")
-        except Exception as e:
-            logging.error("Error executing script: {}".format(e))
-            exit(1)
-    
+            while True:
+                with Metrics.timer("phase_seconds", phase="mirror"):
+                    mirror_engine.run(claimed_jobs(), on_finished=image_finished)
+                if mirror_engine.stop_requested.is_set() or not coordinator.wait_for_shards():
+                    break
+        finally:
+            # Shards that were not finished are handed back so another worker can pick them up
+            coordinator.leave()
+
+    def changed_images(changes: dict):
+        """
+        Description:
+            Generator of MirrorEngine jobs for the tags the watcher saw change on the primary. Each changed
+            repository has its tags listed once to get the current digests, then only the changed tags are mirrored
+        Args:
+            changes (dict): {<org>/<repo>: <set of tags, or None for every tag>}
+        Yields:
+            dict: A job for the MirrorEngine
+        """
+        configured_images = set(quay_config.repositories)
+        configured_repositories = {image.split(":")[0] for image in configured_images}
+        repositories = [{"namespace": {"name": repository.split("/")[0]}, "href": f"/repository/{repository}", "tags": tags}
+                        for repository, tags in changes.items() if args.auto_discovery or repository in configured_repositories]
+        for job in discovered_images(repositories):
+            # Without --auto-discovery only the images in the config file are mirrored
+            if args.auto_discovery or job["image_and_tag"] in configured_images:
+                yield job
+
+    def retry_failed(engine: MirrorEngine) -> None:
+        """
+        Description:
+            Hands the images that failed, and the repositories whose tags could not be listed, back to the watcher to be tried again later
+        Args:
+            engine (MirrorEngine): The engine that just ran
+        """
+        failed = {}
+        for image in engine.failed:
+            repository, tag = image.rsplit(":", 1)
+            failed.setdefault(repository, set()).add(tag)
+        # Every tag of a repository that could not be listed is checked again
+        for repository in unlisted_repositories:
+            failed[repository] = None
+        unlisted_repositories.clear()
+        if failed:
+            retry_delay = args.audit_poll_interval or 30
+            logging.warning(f"Retrying {len(failed)} repositories with failed images in {retry_delay} seconds")
+            watcher.requeue(failed, delay=retry_delay)
+
+    def run_daemon() -> None:
+        """
+        Description:
+            Mirrors what changes on the primary until SIGTERM or Ctrl-C. A full sync is run every
+            --daemon-resync-hours to pick up anything that was missed, such as pushes while the daemon was down
+        """
+        retry_failed(mirror_engine)
+        resync_seconds = args.daemon_resync_hours * 3600
+        next_resync = time.monotonic() + resync_seconds
+        logging.info("Waiting for pushes to the primary")
+        while True:
+            changes = watcher.wait_for_changes(timeout=max(0, next_resync - time.monotonic()) if resync_seconds else None)
+            if changes is None:
+                logging.info("Stopping the sync daemon")
+                return
+            if changes:
+                logging.info(f"Mirroring changes to {len(changes)} repositories")
+                jobs = changed_images(changes)
+            else:
+                logging.info("Running the periodic full sync")
+                jobs = discovered_images(primary_quay_api.iter_repositories()) if args.auto_discovery else mirror_jobs
+                next_resync = time.monotonic() + resync_seconds
+            engine = create_mirror_engine()
+            with Metrics.timer("phase_seconds", phase="mirror"):
+                engine.run(jobs)
+            sync_state.flush()
+            retry_failed(engine)
+            if args.metrics_textfile:
+                Metrics.write_textfile(args.metrics_textfile)
+
+    try:
+        if args.shard_store:
+            run_shards()
+        else:
+            with Metrics.timer("phase_seconds", phase="mirror"):
+                mirror_engine.run(journal.track(resumed_jobs(mirror_jobs)), on_finished=journal.unit_finished)
+            if mirror_engine.exit_code() == 0 and not unlisted_repositories:
+                journal.finish_run()
+            else:
+                logging.warning(f"The sync did not finish... run again with --resume to carry on from ---> {journal.journal_file} <---")
+        if args.daemon:
+            sync_state.flush()
+            run_daemon()
+    except Exception as e:
+        logging.error("Error executing script: {}".format(e))
+        exit(1)
+    except KeyboardInterrupt:
+        if not args.daemon:
+            raise
+        logging.info("Interrupted... stopping the sync daemon")
+    finally:
+        sync_state.close()
+        if journal:
+            journal.close()
+        if watcher:
+            watcher.stop()
+    if args.copy_backend == "direct":
+        transfer_stats = copy_backend.transfer_stats()
+        logging.info(f"Blobs uploaded: {transfer_stats['blobs_uploaded']}, already present: {transfer_stats['blobs_existing']}, mounted from another repository: {transfer_stats['blobs_mounted']}")
+        logging.info(f"Transferred ---> {BaseOperations.human_readable_bytes(transfer_stats['bytes_transferred'])} <--- saved ---> {BaseOperations.human_readable_bytes(transfer_stats['bytes_saved'])} <---")
+    if storage_budget:
+        storage_stats = storage_budget.storage_stats()
+        logging.info(f"Local image storage peaked at ---> {BaseOperations.human_readable_bytes(storage_stats['peak_bytes'])} <--- "
+                     f"removed {storage_stats['removed_pushed']} pushed and {storage_stats['removed_evicted']} evicted images, "
+                     f"{BaseOperations.human_readable_bytes(storage_stats['cached_bytes'])} still cached")
+    api_stats = QuayAPI.connection_stats()
+    logging.info(f"Quay API calls: {api_stats['requests']} over {api_stats['connections']} connections ({api_stats['reused']} handshakes saved)")
+    scheduler_stats = QuayAPI.scheduler.scheduler_stats()
+    if scheduler_stats['throttled'] or scheduler_stats['retries']:
+        logging.info(f"Quay API throttled {scheduler_stats['throttled']} times, {scheduler_stats['retries']} calls retried")
+    Metrics.log_summary()
+    # A daemon that was asked to stop has nothing left to report as failed
+    exit(0 if args.daemon else max(mirror_engine.exit_code(), 1 if unlisted_repositories else 0))
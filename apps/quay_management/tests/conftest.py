@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules are imported the way quay_sync.py imports them, and MockQuay the way the benchmark does
+for path in (app_dir, os.path.join(app_dir, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from MockQuay import MockQuay
+from modules.QuayAPI import QuayAPI
+
+
+@pytest.fixture
+def mock_quay():
+    """
+    Description:
+        Starts mock Quay servers on demand and stops them after the test. API calls are not retried so a
+        page MockQuay.failing_pages answers with a 500 fails straight away
+    Yields:
+        callable: Returns a new running MockQuay every time it is called
+    """
+    QuayAPI.configure_scheduler(max_retries=0)
+    servers = []
+
+    def start():
+        servers.append(MockQuay().start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+    QuayAPI.configure_scheduler()
@@ -0,0 +1,76 @@
+import pytest
+from modules.AsyncQuayAPI import AsyncQuayAPI
+from modules.QuayAPI import QuayAPI, QuayAPIError
+from modules.QuayOperations import QuayManagement
+
+pytest.importorskip("aiohttp")
+
+SEED = {"orgs": 2, "repos_per_org": 3, "tags_per_repo": 5, "layers_per_image": 1, "layer_size": 64}
+
+
+@pytest.fixture
+def server(mock_quay):
+    """
+    Description:
+        Starts a seeded MockQuay with small pages so every listing is read over several pages
+    Returns:
+        MockQuay: The running server
+    """
+    server = mock_quay()
+    server.seed(**SEED)
+    server.page_size = 2
+    return server
+
+
+def test_matches_the_threaded_api(server):
+    quay_api = QuayAPI(base_url=server.url, api_token=server.api_token)
+    async_api = AsyncQuayAPI(base_url=server.url, api_token=server.api_token)
+    href = next(quay_api.iter_repositories())['href']
+    assert AsyncQuayAPI.submit(async_api.get_org()).result() == quay_api.get_org()
+    assert AsyncQuayAPI.submit(async_api.get_tag_info(href)).result() == quay_api.get_tag_info(href)
+
+
+def test_repository_tags_are_listed_in_order(server):
+    quay_api = QuayAPI(base_url=server.url, api_token=server.api_token)
+    async_api = AsyncQuayAPI(base_url=server.url, api_token=server.api_token)
+    repositories = list(quay_api.iter_repositories())
+    listed = list(async_api.iter_repository_tags(iter(repositories), lookahead=2))
+    assert [repository for repository, _, _ in listed] == repositories
+    for repository, tags, error in listed:
+        assert error is None
+        assert tags == list(quay_api.iter_tags(repository['href']))
+
+
+def test_failed_tag_page_is_returned_as_an_error(server):
+    async_api = AsyncQuayAPI(base_url=server.url, api_token=server.api_token)
+    repository = next(QuayAPI(base_url=server.url, api_token=server.api_token).iter_repositories())
+    server.failing_pages.add((repository['href'] + "/tag", 2))
+    [(_, tags, error)] = async_api.iter_repository_tags([repository])
+    assert isinstance(error, QuayAPIError)
+    assert len(tags) == server.page_size
+
+
+class OwnershipAPI(AsyncQuayAPI):
+    """
+    Description:
+        MockQuay has no team endpoints, so the members of each organization are kept here
+    """
+    def __init__(self, members: dict) -> None:
+        super().__init__(base_url="https://quay.example.com", api_token="token")
+        self.members = members
+
+    async def get_org_members(self, org_name: str = None) -> dict:
+        return {"members": [{"name": user, "teams": [{"name": "owners"}]} for user in self.members[org_name]]}
+
+    async def create_org_member(self, org_name: str = None, new_member: str = None, team_name: str = None):
+        self.members[org_name].add(new_member)
+        return type("Response", (), {"status": 200})()
+
+
+def test_ownership_with_the_async_api():
+    async_api = OwnershipAPI({"org1": {"quayadmin"}, "org2": set()})
+    orgs = {"organizations": [{"name": "org1"}, {"name": "org2"}]}
+    result = QuayManagement.take_org_ownership(orgs=orgs, quay_username=["quayadmin", "admin2"], async_api=async_api)
+    assert sorted(result["added"]) == [("org1", "admin2"), ("org2", "admin2"), ("org2", "quayadmin")]
+    assert result["already_owner"] == 1
+    assert async_api.members == {"org1": {"quayadmin", "admin2"}, "org2": {"quayadmin", "admin2"}}
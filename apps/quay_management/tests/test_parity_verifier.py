@@ -0,0 +1,109 @@
+import pytest
+from modules.MirrorEngine import MirrorEngine
+from modules.ParityVerifier import ParityVerifier
+from modules.QuayAPI import QuayAPI, QuayAPIError
+from modules.QuayOperations import CopyBackend
+
+SEED = {"orgs": 2, "repos_per_org": 2, "tags_per_repo": 2, "layers_per_image": 1, "layer_size": 64}
+
+
+@pytest.fixture
+def servers(mock_quay):
+    """
+    Description:
+        Starts a primary and a secondary seeded with the same images, so they have the same digests
+    Returns:
+        tuple: The primary and secondary MockQuay
+    """
+    primary, secondary = mock_quay(), mock_quay()
+    primary.seed(**SEED)
+    secondary.seed(**SEED)
+    return primary, secondary
+
+
+def verifier(primary, secondary, digest_backend=None) -> ParityVerifier:
+    return ParityVerifier(QuayAPI(base_url=primary.url, api_token=primary.api_token),
+                          [{"name": "secondary", "quay_api": QuayAPI(base_url=secondary.url, api_token=secondary.api_token)}],
+                          digest_backend=digest_backend, max_workers=4)
+
+
+def registry_backend(*servers) -> CopyBackend:
+    return CopyBackend(credentials={MirrorEngine.registry_from_image(server.url): dict(zip(("username", "password"), server.credentials))
+                                    for server in servers})
+
+
+def test_identical_servers_match(servers):
+    report = verifier(*servers).verify()["secondary"]
+    assert report == {"matching": 8, "missing": [], "stale": [], "extra": [], "unverified": []}
+
+
+def test_differences_are_reported(servers):
+    primary, secondary = servers
+    layer = [primary.layer_bytes("changed", 64)]
+    primary.add_image("org0000", "repo0000", "v2", layer)
+    primary.add_image("org0000", "repo0001", "v0", layer)
+    secondary.add_image("org0001", "repo0000", "old", layer)
+    report = verifier(primary, secondary).verify()["secondary"]
+    assert report["missing"] == ["org0000/repo0000:v2"]
+    assert report["stale"] == ["org0000/repo0001:v0"]
+    assert report["extra"] == ["org0001/repo0000:old"]
+    assert report["matching"] == 7
+
+
+def test_listed_images_only(servers):
+    primary, secondary = servers
+    primary.add_image("org0000", "repo0000", "v2", [primary.layer_bytes("new", 64)])
+    secondary.add_image("org0000", "repo0000", "old", [secondary.layer_bytes("old", 64)])
+    report = verifier(primary, secondary).verify(images=["org0000/repo0000:v0", "org0000/repo0000:v2"])["secondary"]
+    assert report == {"matching": 1, "missing": ["org0000/repo0000:v2"], "stale": [], "extra": [], "unverified": []}
+
+
+def test_pinned_digests(servers):
+    primary, secondary = servers
+    pinned = primary.tag_digests()["org0000/repo0000:v0"]
+    unknown = primary.add_image("org0000", "repo0000", "v9", [primary.layer_bytes("only-on-primary", 64)])
+    images = ["org0000/repo0000:v1", f"org0000/repo0000@{pinned}", f"org0000/repo0000@{unknown}"]
+    report = verifier(primary, secondary, registry_backend(primary, secondary)).verify(images=images)["secondary"]
+    assert report == {"matching": 2, "missing": [f"org0000/repo0000@{unknown}"], "stale": [], "extra": [], "unverified": []}
+
+
+def test_pinned_digest_without_a_backend_is_unverified(servers):
+    primary, secondary = servers
+    image = "org0000/repo0000@" + primary.tag_digests()["org0000/repo0000:v0"]
+    report = verifier(primary, secondary).verify(images=[image])["secondary"]
+    assert report["unverified"] == [image]
+    assert report["missing"] == []
+
+
+def test_destination_tag_listing_failure_is_unverified_not_missing(servers):
+    primary, secondary = servers
+    secondary.failing_pages.add(("/repository/org0000/repo0001/tag", 1))
+    report = verifier(primary, secondary).verify()["secondary"]
+    assert report["unverified"] == ["org0000/repo0001"]
+    assert report["missing"] == []
+    assert report["matching"] == 6
+
+
+def test_primary_tag_listing_failure_is_unverified(servers):
+    primary, secondary = servers
+    primary.failing_pages.add(("/repository/org0001/repo0000/tag", 1))
+    report = verifier(primary, secondary).verify()["secondary"]
+    assert report["unverified"] == ["org0001/repo0000"]
+    assert report["missing"] == [] and report["extra"] == []
+    assert report["matching"] == 6
+
+
+def test_destination_namespace_listing_failure_is_unverified(servers):
+    primary, secondary = servers
+    secondary.failing_pages.add(("/repository", 1))
+    report = verifier(primary, secondary).verify()["secondary"]
+    assert sorted(report["unverified"]) == ["org0000/repo0000", "org0000/repo0001", "org0001/repo0000", "org0001/repo0001"]
+    assert report["missing"] == []
+    assert report["matching"] == 0
+
+
+def test_primary_repository_listing_failure_raises(servers):
+    primary, secondary = servers
+    primary.failing_pages.add(("/find/repositories", 1))
+    with pytest.raises(QuayAPIError):
+        verifier(primary, secondary).verify()
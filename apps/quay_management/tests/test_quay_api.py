@@ -0,0 +1,16 @@
+import pytest
+from modules.QuayAPI import QuayAPI
+
+
+def test_empty_first_page_aborts(mock_quay):
+    server = mock_quay()
+    quay_api = QuayAPI(base_url=server.url, api_token=server.api_token)
+    with pytest.raises(SystemExit):
+        quay_api.get_data()
+
+
+@pytest.mark.parametrize("params", [{"page": 2}, {"next_page": "token"}])
+def test_empty_later_page_ends_the_listing(mock_quay, params):
+    server = mock_quay()
+    quay_api = QuayAPI(base_url=server.url, api_token=server.api_token)
+    assert quay_api.get_data(params=params)["results"] == []
@@ -0,0 +1,112 @@
+import time
+import pytest
+from modules.ShardCoordinator import ShardCoordinator
+
+SHARD_COUNT = 4
+
+
+@pytest.fixture
+def store_file(tmp_path):
+    return str(tmp_path / "shards.db")
+
+
+@pytest.fixture
+def workers(store_file):
+    """
+    Description:
+        Joins worker-a and worker-b to the same run and makes them leave after the test
+    Yields:
+        tuple: The two ShardCoordinators
+    """
+    joined = []
+    for worker_id in ("worker-a", "worker-b"):
+        coordinator = ShardCoordinator(store_file, worker_id, shard_count=SHARD_COUNT, lease_seconds=0.5, max_attempts=2)
+        coordinator.join()
+        joined.append(coordinator)
+    yield tuple(joined)
+    for coordinator in joined:
+        if coordinator.heartbeat_thread and not coordinator.stop_heartbeat.is_set():
+            coordinator.leave()
+
+
+def claim_all(coordinator: ShardCoordinator) -> set:
+    shards = set()
+    while (shard := coordinator.claim_next()) is not None:
+        shards.add(shard)
+    return shards
+
+
+def crash(coordinator: ShardCoordinator) -> None:
+    # Stops renewing the leases without giving anything back, like a worker that was killed
+    coordinator.stop_heartbeat.set()
+    coordinator.heartbeat_thread.join()
+    coordinator.connection.close()
+
+
+def test_workers_join_the_same_run(workers):
+    worker_a, worker_b = workers
+    assert worker_a.run_id == worker_b.run_id
+    assert worker_a.progress()["members"] == 2
+
+
+def test_a_shard_is_only_leased_to_one_worker(workers):
+    worker_a, worker_b = workers
+    first = worker_a.claim_next()
+    claimed_by_b = claim_all(worker_b)
+    claimed_by_a = {first} | claim_all(worker_a)
+    assert not claimed_by_a & claimed_by_b
+    assert claimed_by_a | claimed_by_b == set(range(SHARD_COUNT))
+
+
+def test_expired_lease_is_taken_over(workers):
+    worker_a, worker_b = workers
+    held = claim_all(worker_a)
+    assert held == set(range(SHARD_COUNT))
+    assert worker_b.claim_next() is None
+    crash(worker_a)
+    time.sleep(worker_a.lease_seconds + 0.1)
+    assert worker_b.wait_for_shards(poll_interval=0.05)
+    assert claim_all(worker_b) == held
+
+
+def test_released_shard_can_be_claimed_straight_away(workers):
+    worker_a, worker_b = workers
+    held = claim_all(worker_a)
+    shard = held.pop()
+    worker_a.release(shard)
+    assert worker_b.claim_next() == shard
+
+
+def test_run_finishes_when_every_shard_is_done(workers, store_file):
+    worker_a, worker_b = workers
+    for shard in claim_all(worker_a):
+        worker_a.complete(shard)
+    assert worker_a.progress()["done"] == SHARD_COUNT
+    assert not worker_b.wait_for_shards(poll_interval=0.05)
+    # The next worker to join starts a new run
+    late_worker = ShardCoordinator(store_file, "worker-c", shard_count=SHARD_COUNT, lease_seconds=0.5)
+    try:
+        assert late_worker.join() != worker_a.run_id
+    finally:
+        late_worker.leave()
+
+
+def test_failed_shard_is_retried_until_max_attempts(workers):
+    worker_a, worker_b = workers
+    shard = worker_a.claim_next()
+    assert worker_a.fail(shard, failed_images=1)
+    assert shard not in worker_a.held_shards
+    assert worker_a.progress()["done"] == 0
+    assert shard in claim_all(worker_b)
+    # The second failure reaches max_attempts, so the shard is given up on and counted as done
+    assert not worker_b.fail(shard, failed_images=1)
+    assert worker_b.progress()["done"] == 1
+    assert shard not in claim_all(worker_a)
+
+
+def test_leave_gives_back_held_shards(workers):
+    worker_a, worker_b = workers
+    held = claim_all(worker_a)
+    worker_a.leave()
+    assert worker_b.progress()["members"] == 1
+    assert claim_all(worker_b) == held
@@ -0,0 +1,102 @@
+import threading
+import pytest
+from modules.QuayOperations import ImageMover, StorageBudget
+
+SIZES = {"a": 600, "b": 400, "c": 400}
+
+
+@pytest.fixture
+def podman(monkeypatch):
+    """
+    Description:
+        Stands in for podman image inspect and podman rmi, which the budget shells out to
+    Returns:
+        dict: {"removed": [<names>], "fail": set of names rmi refuses, "block": threading.Event rmi waits on}
+    """
+    calls = {"removed": [], "fail": set(), "block": threading.Event()}
+    calls["block"].set()
+    monkeypatch.setattr(ImageMover, "image_usage", classmethod(lambda cls, image_name: (SIZES[image_name], {f"layer-{image_name}"})))
+
+    def remove_images(cls, image_names):
+        calls["block"].wait()
+        if calls["fail"] & set(image_names):
+            return False
+        calls["removed"].extend(image_names)
+        return True
+
+    monkeypatch.setattr(ImageMover, "remove_images", classmethod(remove_images))
+    return calls
+
+
+def returns_quickly(function, timeout: float = 1) -> bool:
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_zero_limit_does_not_hold_back_pulls(podman):
+    budget = StorageBudget(limit_bytes=0)
+    budget.wait_for_room()
+    budget.add({"image_source": "a"})
+    # The first image is still pinned, a limit of 0 must not turn the sync into one image at a time
+    assert returns_quickly(budget.wait_for_room)
+    budget.add({"image_source": "b"})
+    budget.release({"image_source": "a"})
+    assert podman["removed"] == ["a"]
+    assert budget.storage_stats()["removed_pushed"] == 1
+
+
+def test_pull_waits_while_the_limit_is_pinned(podman):
+    budget = StorageBudget(limit_bytes=500)
+    budget.add({"image_source": "a"})
+    waiter = threading.Thread(target=budget.wait_for_room, daemon=True)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    budget.release({"image_source": "a"})
+    waiter.join(1)
+    assert not waiter.is_alive()
+    assert podman["removed"] == ["a"]
+
+
+def test_least_recently_used_image_is_evicted(podman):
+    budget = StorageBudget(limit_bytes=1000)
+    for name in ("a", "b"):
+        budget.add({"image_source": name})
+        budget.release({"image_source": name})
+    assert podman["removed"] == []
+    budget.add({"image_source": "c"})
+    budget.release({"image_source": "c"})
+    assert podman["removed"] == ["a"]
+    assert budget.storage_stats() == {"peak_bytes": 1400, "removed_pushed": 0, "removed_evicted": 1, "cached_bytes": 800}
+
+
+def test_failed_removal_keeps_counting(podman):
+    budget = StorageBudget(limit_bytes=0)
+    podman["fail"].add("a")
+    budget.add({"image_source": "a"})
+    budget.release({"image_source": "a"})
+    stats = budget.storage_stats()
+    assert stats["cached_bytes"] == 600
+    assert stats["removed_pushed"] == 0
+    # It is not picked again on every later release
+    budget.add({"image_source": "b"})
+    budget.release({"image_source": "b"})
+    assert podman["removed"] == ["b"]
+    assert budget.storage_stats()["cached_bytes"] == 600
+
+
+def test_rmi_runs_without_holding_the_lock(podman):
+    budget = StorageBudget(limit_bytes=0)
+    budget.add({"image_source": "a"})
+    podman["block"].clear()
+    releaser = threading.Thread(target=budget.release, args=({"image_source": "a"},), daemon=True)
+    releaser.start()
+    try:
+        assert returns_quickly(lambda: budget.add({"image_source": "b"}))
+        assert returns_quickly(budget.storage_stats)
+    finally:
+        podman["block"].set()
+        releaser.join(1)
+    assert podman["removed"] == ["a"]
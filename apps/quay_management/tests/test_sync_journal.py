@@ -0,0 +1,86 @@
+import pytest
+from modules.SyncJournal import SyncJournal
+
+
+def job(image: str, source_digest: str = None) -> dict:
+    return {"image_and_tag": image, "source_digest": source_digest or f"sha256:{image}"}
+
+
+@pytest.fixture
+def journal_file(tmp_path):
+    return str(tmp_path / "journal.db")
+
+
+def interrupted_run(journal_file: str) -> None:
+    """
+    Description:
+        Journals a sync of org/a (both tags done) and org/b (one done, one failed, one still copying) that
+        stops without finish_run(), like a sync that was killed
+    """
+    journal = SyncJournal(journal_file)
+    journal.start_run()
+    jobs = list(journal.track([job("org/a:v1"), job("org/a:v2"), job("org/b:v1"), job("org/b:v2"), job("org/b:v3")]))
+    journal.repository_listed("org/a")
+    journal.repository_listed("org/b")
+    journal.unit_finished(jobs[0], "mirrored")
+    journal.unit_finished(jobs[1], "unchanged")
+    journal.unit_finished(jobs[2], "mirrored")
+    journal.unit_finished(jobs[3], "failed")
+    journal.close()
+
+
+def test_resume_picks_up_an_interrupted_run(journal_file):
+    interrupted_run(journal_file)
+    journal = SyncJournal(journal_file)
+    try:
+        resumed = journal.start_run(resume=True)
+    finally:
+        journal.close()
+    assert resumed["done"] == {"org/a:v1": "sha256:org/a:v1", "org/a:v2": "sha256:org/a:v2", "org/b:v1": "sha256:org/b:v1"}
+    assert resumed["in_flight"] == {"org/b:v3": "sha256:org/b:v3"}
+    # A failed image is neither done nor in flight, so it is mirrored again with the rest of its repository
+    assert "org/b:v2" not in resumed["done"] and "org/b:v2" not in resumed["in_flight"]
+    assert resumed["repositories"] == {"org/a"}
+
+
+def test_repository_is_not_done_until_it_was_listed(journal_file):
+    journal = SyncJournal(journal_file)
+    journal.start_run()
+    for tracked in journal.track([job("org/a:v1")]):
+        journal.unit_finished(tracked, "mirrored")
+    journal.close()
+    journal = SyncJournal(journal_file)
+    try:
+        resumed = journal.start_run(resume=True)
+    finally:
+        journal.close()
+    assert resumed["done"] == {"org/a:v1": "sha256:org/a:v1"}
+    assert resumed["repositories"] == set()
+
+
+def test_finished_run_is_not_resumed(journal_file):
+    journal = SyncJournal(journal_file)
+    journal.start_run()
+    for tracked in journal.track([job("org/a:v1")]):
+        journal.unit_finished(tracked, "mirrored")
+    journal.finish_run()
+    journal.close()
+    journal = SyncJournal(journal_file)
+    try:
+        resumed = journal.start_run(resume=True)
+    finally:
+        journal.close()
+    assert resumed == {"done": {}, "in_flight": {}, "repositories": set()}
+
+
+def test_new_run_discards_the_interrupted_one(journal_file):
+    interrupted_run(journal_file)
+    journal = SyncJournal(journal_file)
+    journal.start_run()
+    journal.close()
+    journal = SyncJournal(journal_file)
+    try:
+        resumed = journal.start_run(resume=True)
+    finally:
+        journal.close()
+    assert resumed == {"done": {}, "in_flight": {}, "repositories": set()}
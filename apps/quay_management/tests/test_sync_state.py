@@ -0,0 +1,65 @@
+import pytest
+from modules.SyncState import SyncState
+
+SOURCE = "primary.example.com"
+DESTINATION = "secondary.example.com"
+IMAGE = "org/repo:v1"
+
+
+@pytest.fixture
+def state(tmp_path):
+    sync_state = SyncState(str(tmp_path / "state.db"))
+    yield sync_state
+    sync_state.close()
+
+
+def test_never_mirrored_is_not_current(state):
+    assert not state.is_current(SOURCE, DESTINATION, IMAGE, "sha256:aaa")
+
+
+def test_same_source_digest_is_current(state):
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", "sha256:bbb")
+    assert state.is_current(SOURCE, DESTINATION, IMAGE, "sha256:aaa")
+
+
+def test_changed_source_digest_is_not_current(state):
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", "sha256:bbb")
+    assert not state.is_current(SOURCE, DESTINATION, IMAGE, "sha256:ccc")
+
+
+def test_unknown_source_digest_is_not_current(state):
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", "sha256:bbb")
+    assert not state.is_current(SOURCE, DESTINATION, IMAGE, None)
+
+
+def test_copy_without_destination_digest_is_not_current(state):
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", None)
+    assert not state.is_current(SOURCE, DESTINATION, IMAGE, "sha256:aaa")
+
+
+def test_each_destination_is_tracked_on_its_own(state):
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", "sha256:bbb")
+    assert not state.is_current(SOURCE, "other.example.com", IMAGE, "sha256:aaa")
+
+
+def test_recorded_tags_survive_a_restart(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    state.record_tag(SOURCE, DESTINATION, IMAGE, "sha256:aaa", "sha256:bbb")
+    state.close()
+    reopened = SyncState(str(tmp_path / "state.db"))
+    try:
+        assert reopened.is_current(SOURCE, DESTINATION, IMAGE, "sha256:aaa")
+    finally:
+        reopened.close()
+
+
+def test_blob_locations_survive_a_restart(tmp_path):
+    state = SyncState(str(tmp_path / "state.db"))
+    state.record_blob_location("https://" + DESTINATION, "sha256:layer", "org/repo")
+    state.close()
+    reopened = SyncState(str(tmp_path / "state.db"))
+    try:
+        assert reopened.get_blob_location("https://" + DESTINATION, "sha256:layer") == "org/repo"
+        assert reopened.get_blob_location("https://" + DESTINATION, "sha256:other") is None
+    finally:
+        reopened.close()